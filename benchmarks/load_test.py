@@ -0,0 +1,142 @@
+"""
+Concurrent load test of the sync (WSGI) and async (ASGI) views against the stub NBP API.
+Each request asks for a different date, so every one of them waits on an upstream call. The sync path is driven by
+a pool of worker threads, like a threaded WSGI server; the async path by one event loop, like an ASGI worker.
+
+Run with:
+    python -m benchmarks.load_test --requests 200 --concurrency 100 --threads 8 --latency 0.1
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "exchange_rates.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import AsyncClient, Client  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+from benchmarks.stub_nbp import published, start_process  # noqa: E402
+from rates_api import cache, nbp, tables  # noqa: E402
+from rates_api.models import Rate  # noqa: E402
+
+
+def dates(count: int, today: date) -> list:
+    """
+    Returns `count` distinct publication dates before `today`.
+    """
+
+    days, day = [], today - timedelta(days=1)
+    while len(days) < count:
+        if published(day):
+            days.append(day.isoformat())
+        day -= timedelta(days=1)
+    return days
+
+
+def summary(path: str, latencies: list, elapsed: float, errors: int) -> dict:
+    """
+    Summarizes one run as throughput and latency percentiles in milliseconds.
+    """
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {"path": path,
+            "requests": len(latencies),
+            "errors": errors,
+            "seconds": round(elapsed, 3),
+            "throughput": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(quantiles[49] * 1000, 1),
+            "p95_ms": round(quantiles[94] * 1000, 1),
+            "p99_ms": round(quantiles[98] * 1000, 1)}
+
+
+def reset() -> None:
+    cache.rates.clear()
+    tables.index.clear()
+    Rate.objects.all().delete()
+
+
+def run_wsgi(days: list, threads: int) -> dict:
+    """
+    Drives the sync view from `threads` worker threads.
+    """
+
+    def call(day: str) -> tuple:
+        started = time.perf_counter()
+        response = Client().get(f"/api/exchanges/gbp/{day}/")
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(call, days))
+    elapsed = time.perf_counter() - started
+    return summary(f"wsgi ({threads} threads)", [latency for latency, _ in results], elapsed,
+                   sum(status != 200 for _, status in results))
+
+
+async def run_asgi(days: list, concurrency: int) -> dict:
+    """
+    Drives the async view from one event loop with up to `concurrency` requests in flight.
+    """
+
+    client = AsyncClient()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(day: str) -> tuple:
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.get(f"/api/exchanges/async/gbp/{day}/")
+            return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(call(day) for day in days))
+    elapsed = time.perf_counter() - started
+    await nbp.close_async_client()
+    return summary(f"asgi ({concurrency} in flight)", [latency for latency, _ in results], elapsed,
+                   sum(status != 200 for _, status in results))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=100, help="in-flight requests on the async path")
+    parser.add_argument("--threads", type=int, default=8, help="worker threads on the sync path")
+    parser.add_argument("--latency", type=float, default=0.1, help="stub NBP latency in seconds")
+    args = parser.parse_args()
+
+    today = date.today()
+    stub, base_url = start_process(latency=args.latency, today=today)
+    settings.NBP_CLIENT = {**settings.NBP_CLIENT, "BASE_URL": base_url, "RETRIES": 0,
+                           "POOL_SIZE": args.threads, "ASYNC_POOL_SIZE": args.concurrency,
+                           "MAX_IN_FLIGHT": args.threads, "ASYNC_MAX_IN_FLIGHT": args.concurrency,
+                           "MAX_QUEUE": args.requests, "RATE": 10 ** 6, "BURST": 10 ** 6}
+    settings.ALLOWED_HOSTS = ["testserver"]
+    setup_test_environment()
+    with tempfile.TemporaryDirectory() as directory:
+        connection.settings_dict["TEST"]["NAME"] = str(Path(directory) / "load_test.sqlite3")
+        connection.creation.create_test_db(verbosity=0)
+        days = dates(args.requests, today)
+        results = [run_wsgi(days, args.threads)]
+        reset()
+        results.append(asyncio.run(run_asgi(days, args.concurrency)))
+    stub.terminate()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
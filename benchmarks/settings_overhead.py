@@ -0,0 +1,89 @@
+"""
+Startup time and per-request overhead of settings profiles.
+Each profile is measured in fresh processes: the time to import Django and build the WSGI application (what a
+worker, or the gunicorn master with preload, pays at startup), and the time of requests answered without touching
+NBP or the database, which is the fixed cost of the middleware, the URL resolution and DRF paid by every call.
+
+Run with:
+    python -m benchmarks.settings_overhead --settings exchange_rates.settings,exchange_rates.production
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PATHS = {
+    # Rejected by the view before any lookup.
+    "validation-error": "/api/exchanges/gbp/0/",
+    # Served straight from the process without DRF.
+    "metrics": "/metrics",
+}
+
+
+def child(requests: int) -> None:
+    """
+    Measures the settings of this process and prints the results as JSON.
+    """
+
+    started = time.perf_counter()
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+    startup = time.perf_counter() - started
+
+    results = {"startup_ms": round(startup * 1000, 1)}
+    for name, path in PATHS.items():
+        latencies = []
+        for _ in range(requests):
+            environ = {"REQUEST_METHOD": "GET", "PATH_INFO": path, "QUERY_STRING": "", "SERVER_NAME": "localhost",
+                       "SERVER_PORT": "80", "HTTP_HOST": "localhost", "wsgi.url_scheme": "http",
+                       "wsgi.input": BytesIO(), "wsgi.errors": sys.stderr}
+            began = time.perf_counter()
+            body = b"".join(application(environ, lambda status, headers: None))
+            latencies.append(time.perf_counter() - began)
+        assert body, f"{path} returned an empty body"
+        quantiles = statistics.quantiles(latencies[requests // 10:], n=100)
+        results[f"{name}_p50_us"] = round(quantiles[49] * 1e6, 1)
+        results[f"{name}_p95_us"] = round(quantiles[94] * 1e6, 1)
+    print(json.dumps(results))
+
+
+def measure(module: str, runs: int, requests: int) -> dict:
+    """
+    Runs `runs` fresh processes with the settings `module` and returns the median of each of their results.
+    """
+
+    environ = {**os.environ, "DJANGO_SETTINGS_MODULE": module, "DJANGO_ALLOWED_HOSTS": "localhost"}
+    environ.setdefault("DJANGO_SECRET_KEY", "settings-overhead-benchmark")
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-m", "benchmarks.settings_overhead", "--child",
+                                 "--requests", str(requests)],
+                                cwd=ROOT, env=environ, check=True, capture_output=True, text=True).stdout
+        samples.append(json.loads(output.splitlines()[-1]))
+    return {"settings": module, **{key: statistics.median(sample[key] for sample in samples) for key in samples[0]}}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--settings", default="exchange_rates.settings,exchange_rates.production",
+                        help="comma-separated settings modules to compare")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per settings module")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per path and process")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.requests)
+        return
+    print(json.dumps([measure(module, args.runs, args.requests) for module in args.settings.split(",")], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+A local stand-in for the NBP Web API.
+Serves deterministic synthetic tables A and C, or tables recorded from api.nbp.pl, under the same paths as NBP, with
+a configurable latency and injected errors, so the application can be measured reproducibly and offline.
+
+Run standalone with:
+    python -m benchmarks.stub_nbp --port 8001 --latency 0.05 --jitter 0.02 --error-rate 0.01
+Record fixtures (needs network access to api.nbp.pl) with:
+    python -m benchmarks.stub_nbp --record benchmarks/fixtures --start 2023-01-02 --end 2023-12-29
+"""
+
+import argparse
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+
+import requests
+
+CURRENCIES = {
+    "A": ["THB", "USD", "AUD", "HKD", "CAD", "NZD", "SGD", "EUR", "HUF", "CHF", "GBP", "UAH", "JPY", "CZK", "DKK",
+          "ISK", "NOK", "SEK", "RON", "BGN", "TRY", "ILS", "CLP", "PHP", "MXN", "ZAR", "BRL", "MYR", "IDR", "INR",
+          "KRW", "CNY", "XDR"],
+    "C": ["USD", "AUD", "CAD", "EUR", "HUF", "CHF", "GBP", "JPY", "CZK", "DKK", "NOK", "SEK", "XDR"],
+}
+
+NO_DATA = b"404 NotFound - Not Found - Brak danych"
+
+UNAVAILABLE = b"503 Service Unavailable"
+
+NBP_URL = "http://api.nbp.pl/api/exchangerates/"
+
+TABLE_PATH = re.compile(r"^/api/exchangerates/tables/(?P<table>[abc])/(?P<rest>.*?)/?$")
+
+
+def published(day: date) -> bool:
+    """
+    Tells whether the stub publishes tables on `day`: every weekday.
+    """
+
+    return day.weekday() < 5
+
+
+def table(letter: str, day: date) -> dict:
+    """
+    Builds the synthetic table `letter` published on `day`.
+    """
+
+    first = date(day.year, 1, 1)
+    number = sum(1 for offset in range((day - first).days + 1) if published(first + timedelta(days=offset)))
+    rates = []
+    for position, code in enumerate(CURRENCIES[letter]):
+        mid = round(1 + position * 0.37 + ((day.toordinal() * (position + 7)) % 997) / 10000, 4)
+        if letter == "C":
+            rates.append({"currency": code.lower(), "code": code, "bid": round(mid * 0.99, 4),
+                          "ask": round(mid * 1.01, 4)})
+        else:
+            rates.append({"currency": code.lower(), "code": code, "mid": mid})
+    data = {"table": letter, "no": f"{number:03d}/{letter}/NBP/{day.year}", "effectiveDate": day.isoformat(),
+            "rates": rates}
+    if letter == "C":
+        data["tradingDate"] = (day - timedelta(days=1)).isoformat()
+    return data
+
+
+def tables(letter: str, rest: str, today: date, recorded: Optional[dict] = None) -> Optional[list]:
+    """
+    Resolves the part of a `tables` path after the table letter into the list of tables NBP would answer with,
+    or None when there is no data. With `recorded` tables (by table letter and effective date) only those are
+    served, and the newest of them is today's.
+    """
+
+    letter = letter.upper()
+    known = recorded.get(letter, {}) if recorded is not None else None
+    if known is not None:
+        today = max(known, default=today)
+
+    def is_published(day: date) -> bool:
+        return day in known if known is not None else published(day)
+
+    parts = [part for part in rest.split("/") if part]
+    if parts and parts[0] == "last":
+        number = int(parts[1]) if len(parts) > 1 else 1
+        oldest = min(known, default=today) if known is not None else date.min
+        days, day = [], today
+        while len(days) < number and day >= oldest:
+            if is_published(day):
+                days.append(day)
+            day -= timedelta(days=1)
+        days.reverse()
+    elif not parts or parts[0] == "today":
+        days = [today] if is_published(today) else []
+    else:
+        try:
+            start = date.fromisoformat(parts[0])
+            end = date.fromisoformat(parts[1]) if len(parts) > 1 else start
+        except ValueError:
+            return None
+        days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+        days = [day for day in days if is_published(day) and day <= today]
+    return [known[day] if known is not None else table(letter, day) for day in days] or None
+
+
+def load_fixtures(directory: str) -> dict:
+    """
+    Reads the tables recorded by `record`, by table letter and effective date.
+    """
+
+    recorded = {}
+    for path in sorted(Path(directory).glob("table_*.json")):
+        for data in json.loads(path.read_text(encoding="utf-8")):
+            recorded.setdefault(data["table"], {})[date.fromisoformat(data["effectiveDate"])] = data
+    return recorded
+
+
+def record(directory: str, start: date, end: date, letters: str = "AC", base_url: str = NBP_URL) -> None:
+    """
+    Records the tables NBP published from `start` to `end` into one `table_<letter>.json` file per table, in the
+    shape of its `tables` answers, fetching them in the 93-day windows NBP accepts.
+    """
+
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    for letter in letters:
+        recorded, first = [], start
+        while first <= end:
+            last = min(first + timedelta(days=92), end)
+            response = requests.get(f"{base_url}tables/{letter.lower()}/{first}/{last}/",
+                                    params={"format": "json"}, timeout=30)
+            if response.status_code != 404:
+                response.raise_for_status()
+                recorded.extend(response.json())
+            first = last + timedelta(days=1)
+        Path(directory, f"table_{letter.lower()}.json").write_text(json.dumps(recorded), encoding="utf-8")
+
+
+class StubNBPHandler(BaseHTTPRequestHandler):
+    """
+    Answers `exchangerates/tables` requests like NBP does.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self) -> None:
+        time.sleep(self.server.latency + self.server.random.uniform(0, self.server.jitter))
+        if self.server.random.random() < self.server.error_rate:
+            self._send(503, UNAVAILABLE, "text/plain; charset=utf-8")
+            return
+        match = TABLE_PATH.match(self.path.split("?")[0])
+        data = tables(match["table"], match["rest"], self.server.today, self.server.recorded) if match else None
+        if data is None:
+            self._send(404, NO_DATA, "text/plain; charset=utf-8")
+        else:
+            self._send(200, json.dumps(data).encode(), "application/json; charset=utf-8")
+
+    def _send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class StubNBPServer(ThreadingHTTPServer):
+    """
+    A threaded stub NBP server.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port: int = 0, latency: float = 0.0, today: Optional[date] = None, jitter: float = 0.0,
+                 error_rate: float = 0.0, fixtures: Optional[str] = None, seed: int = 0) -> None:
+        """
+        Parameters:
+        -----------
+        port : int
+            The port to listen on, any free one by default.
+        latency : float
+            Seconds added to every response.
+        today : date, optional
+            The date of the newest synthetic table.
+        jitter : float
+            Up to this many seconds added at random to every response.
+        error_rate : float
+            The share of requests answered with a 503, at random.
+        fixtures : str, optional
+            A directory of tables recorded with `record`, served instead of synthetic ones.
+        seed : int
+            The seed of the jitter and the injected errors, so runs are reproducible.
+        """
+
+        super().__init__(("127.0.0.1", port), StubNBPHandler)
+        self.latency = latency
+        self.today = today or date.today()
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.recorded = load_fixtures(fixtures) if fixtures else None
+        self.random = random.Random(seed)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/api/exchangerates/"
+
+    def start(self) -> "StubNBPServer":
+        """
+        Serves in a background thread.
+        """
+
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def _serve(options: dict, ports) -> None:
+    server = StubNBPServer(**options)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_process(latency: float = 0.0, today: Optional[date] = None, **options) -> tuple:
+    """
+    Serves the stub from a separate process, so it does not compete for the GIL with the application under test.
+    The parameters are the ones of `StubNBPServer`.
+    Returns:
+    --------
+    tuple
+        The process and the base URL of the stub API.
+    """
+
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=({"latency": latency, "today": today, **options}, ports),
+                                      daemon=True)
+    process.start()
+    return process, f"http://127.0.0.1:{ports.get(timeout=10)}/api/exchangerates/"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many seconds added at random")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 503")
+    parser.add_argument("--fixtures", help="directory of recorded tables to serve instead of synthetic ones")
+    parser.add_argument("--record", metavar="DIRECTORY", help="record NBP tables into DIRECTORY and exit")
+    parser.add_argument("--start", type=date.fromisoformat, help="first date to record")
+    parser.add_argument("--end", type=date.fromisoformat, default=date.today(), help="last date to record")
+    args = parser.parse_args()
+    if args.record:
+        record(args.record, args.start or args.end - timedelta(days=365), args.end)
+        return
+    server = StubNBPServer(args.port, args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                           fixtures=args.fixtures)
+    print(f"Stub NBP API on {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
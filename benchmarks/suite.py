@@ -0,0 +1,175 @@
+"""
+Benchmark suite of the API endpoints against the stub NBP API.
+Every scenario sends the same seeded list of requests at each concurrency level, first against empty caches (cold,
+every lookup waits on the stub) and then again (warm, answered from the caches, the table index and the store), and
+reports throughput and p50/p95/p99 latency as JSON. Compared with a baseline report, p95 regressions beyond the
+tolerance make the run fail, so it can gate changes to the view hot paths.
+
+Run with:
+    python -m benchmarks.suite --concurrency 1,8,32 --requests 200 --latency 0.05 --output results.json
+    python -m benchmarks.suite --fixtures benchmarks/fixtures --error-rate 0.01 --baseline results.json
+"""
+
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+
+from benchmarks.load_test import reset, summary
+from benchmarks.stub_nbp import CURRENCIES, load_fixtures, published, start_process
+
+from django.conf import settings  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.test.utils import setup_test_environment  # noqa: E402
+
+from rates_api import nbp  # noqa: E402
+
+
+def scenarios(days: list, codes: dict) -> dict:
+    """
+    Returns the request builders of every scenario: each takes a seeded `random.Random` and returns the method,
+    path and JSON body of one request.
+    """
+
+    def day(rng: random.Random) -> str:
+        return rng.choice(days).isoformat()
+
+    def span(rng: random.Random) -> str:
+        first = rng.randrange(len(days))
+        last = min(len(days) - 1, first + rng.randint(20, 250))
+        return f"{days[first].isoformat()}/{days[last].isoformat()}"
+
+    def a(rng: random.Random) -> str:
+        return rng.choice(codes["A"]).lower()
+
+    def c(rng: random.Random) -> str:
+        return rng.choice(codes["C"]).lower()
+
+    return {
+        "currency-date": lambda rng: ("get", f"/api/exchanges/{a(rng)}/{day(rng)}/", None),
+        "last-quotations": lambda rng: ("get", f"/api/exchanges/{a(rng)}/{rng.randint(1, 255)}/", None),
+        "difference": lambda rng: ("get", f"/api/exchanges/difference/{c(rng)}/{rng.randint(1, 255)}/", None),
+        "date-range": lambda rng: ("get", f"/api/exchanges/{a(rng)}/{span(rng)}/", None),
+        "extremes": lambda rng: ("get", f"/api/exchanges/extremes/{a(rng)}/{span(rng)}/", None),
+        "range-difference": lambda rng: ("get", f"/api/exchanges/difference/{c(rng)}/{span(rng)}/", None),
+        "statistics": lambda rng: ("get", f"/api/exchanges/statistics/{a(rng)}/{rng.randint(10, 255)}/", None),
+        "batch": lambda rng: ("post", "/api/exchanges/batch/",
+                              {"items": [{"code": a(rng), "date": day(rng)} for _ in range(20)]}),
+    }
+
+
+def run(requests: list, concurrency: int) -> tuple:
+    """
+    Sends `requests` from `concurrency` worker threads.
+    Returns:
+    --------
+    tuple
+        The latency of every request in seconds, the wall-clock time of the run and the number of answers that
+        were not 2xx or 404.
+    """
+
+    def call(request: tuple) -> tuple:
+        method, path, body = request
+        started = time.perf_counter()
+        if method == "post":
+            response = Client().post(path, data=body, content_type="application/json")
+        else:
+            response = Client().get(path)
+        connection.close()
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, requests))
+    elapsed = time.perf_counter() - started
+    errors = sum(not (200 <= status < 300 or status == 404) for _, status in results)
+    return [latency for latency, _ in results], elapsed, errors
+
+
+def regressions(results: list, baseline: list, tolerance: float) -> list:
+    """
+    Returns the runs whose p95 latency is more than `tolerance` (a fraction) above the same run in `baseline`.
+    """
+
+    before = {(entry["scenario"], entry["concurrency"], entry["phase"]): entry for entry in baseline}
+    found = []
+    for entry in results:
+        previous = before.get((entry["scenario"], entry["concurrency"], entry["phase"]))
+        if previous is not None and entry["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            found.append(f"{entry['path']}: p95 {previous['p95_ms']} ms -> {entry['p95_ms']} ms")
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", help="comma-separated scenarios to run, all by default")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated numbers of client threads")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario and concurrency level")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub NBP latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many seconds added at random")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of stub answers that are 503s")
+    parser.add_argument("--fixtures", help="directory of recorded NBP tables, see benchmarks.stub_nbp --record")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write the JSON results to, stdout by default")
+    parser.add_argument("--baseline", help="JSON results to compare with; p95 regressions fail the run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 increase over the baseline")
+    args = parser.parse_args()
+
+    today = date.today()
+    if args.fixtures:
+        recorded = load_fixtures(args.fixtures)
+        days = sorted(recorded["A"])
+        codes = {letter: [rate["code"] for rate in recorded[letter][max(recorded[letter])]["rates"]]
+                 for letter in ("A", "C")}
+    else:
+        days = [today - timedelta(days=offset) for offset in range(730, 0, -1)]
+        days = [day for day in days if published(day)]
+        codes = CURRENCIES
+    builders = scenarios(days, codes)
+    names = args.scenarios.split(",") if args.scenarios else list(builders)
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    stub, base_url = start_process(latency=args.latency, today=today, jitter=args.jitter,
+                                   error_rate=args.error_rate, fixtures=args.fixtures, seed=args.seed)
+    settings.NBP_CLIENT = {**settings.NBP_CLIENT, "BASE_URL": base_url, "RETRIES": 0, "POOL_SIZE": max(levels),
+                           "MAX_IN_FLIGHT": max(levels), "RATE": 10 ** 6, "BURST": 10 ** 6}
+    settings.ALLOWED_HOSTS = ["testserver"]
+    setup_test_environment()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        connection.settings_dict["TEST"]["NAME"] = str(Path(directory) / "suite.sqlite3")
+        connection.creation.create_test_db(verbosity=0)
+        for name in names:
+            for level in levels:
+                rng = random.Random(f"{args.seed}:{name}")
+                requests = [builders[name](rng) for _ in range(args.requests)]
+                reset()
+                nbp.reset_client()
+                for phase in ("cold", "warm"):
+                    latencies, elapsed, errors = run(requests, level)
+                    entry = summary(f"{name} {phase} ({level} threads)", latencies, elapsed, errors)
+                    results.append({"scenario": name, "concurrency": level, "phase": phase, **entry})
+                    print(f"{entry['path']}: {entry['throughput']} req/s, p95 {entry['p95_ms']} ms", file=sys.stderr)
+    stub.terminate()
+
+    report = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(report)
+    else:
+        print(report)
+    if args.baseline:
+        found = regressions(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for line in found:
+            print(f"Regression: {line}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Production settings for exchange_rates project.
+
+Loads only what the read-only rate API needs: no admin, users, sessions, messages or CSRF, and no per-request
+authentication, so every call skips their middleware and database lookups. Served by gunicorn with
+`gunicorn.conf.py`; select it with DJANGO_SETTINGS_MODULE=exchange_rates.production. Under gunicorn every worker
+writes its metrics to RATES_METRICS_DIR, so /metrics exports those of the whole server whichever worker answers.
+"""
+
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, REST_FRAMEWORK
+
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+
+DEBUG = False
+
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost,127.0.0.1').split(',')
+
+# Application definition
+# staticfiles and drf_yasg serve the Swagger UI; its assets are collected to STATIC_ROOT at build time and served,
+# compressed and cached, by whitenoise from the workers themselves
+
+INSTALLED_APPS = [
+    'django.contrib.staticfiles',
+    'rates_api.apps.RatesApiConfig',
+
+    'rest_framework',
+    'drf_yasg',
+]
+
+MIDDLEWARE = [
+    'rates_api.profiler.ProfilerMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'rates_api.metrics.MetricsMiddleware',
+]
+
+# No cookies or sessions are used and only JSON and the Swagger UI are served, so CSRF and frame protection are off
+
+SILENCED_SYSTEM_CHECKS = ['security.W002', 'security.W003']
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [BASE_DIR / 'templates'],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.request',
+            ],
+        },
+    },
+]
+
+# Database
+# Connections are kept open between requests instead of being reopened on every call. Every worker writes the rates
+# it ingests, so SQLite runs in write-ahead-log mode (see rates_api.apps) and a writer waits up to `timeout` seconds
+# for another one instead of failing with "database is locked"; the file must be on a local disk of the one node
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('RATES_DATABASE', BASE_DIR / 'db.sqlite3'),
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'timeout': 20,
+        },
+    }
+}
+
+AUTH_PASSWORD_VALIDATORS = []
+
+STATIC_ROOT = BASE_DIR / 'static'
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedStaticFilesStorage',
+    },
+}
+
+# Every endpoint is public, so requests are not authenticated and the anonymous user is not built
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': (
+        'rest_framework.permissions.AllowAny',
+    ),
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+    ],
+    'UNAUTHENTICATED_USER': None,
+}
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'rates_api.profiler.ProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -49,6 +51,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'rates_api.metrics.MetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'exchange_rates.urls'
@@ -79,6 +82,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file rather than the in-memory default, so tests of concurrent ingestion wait on SQLite's lock
+        # instead of failing on the shared-cache table lock
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -128,5 +136,147 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
-    )
+    ),
+    'EXCEPTION_HANDLER': 'rates_api.metrics.exception_handler',
+}
+
+# NBP API client
+# Pooled keep-alive connections, timeouts in seconds and retries for calls to api.nbp.pl. After BREAKER_FAILURES
+# failed calls in a row the circuit breaker fails calls at once for BREAKER_RESET seconds. Each process makes at most
+# MAX_IN_FLIGHT calls at once (ASYNC_MAX_IN_FLIGHT per event loop) and RATE calls per second with bursts of BURST;
+# SHARED_RATE holds every worker sharing the cache to one RATE. Calls that cannot start within MAX_WAIT seconds, or
+# find MAX_QUEUE callers waiting, are answered with a 503
+
+NBP_CLIENT = {
+    'BASE_URL': 'http://api.nbp.pl/api/exchangerates/',
+    'POOL_SIZE': 10,
+    'ASYNC_POOL_SIZE': 100,
+    'CONNECT_TIMEOUT': 3.05,
+    'READ_TIMEOUT': 10,
+    'RETRIES': 2,
+    'BACKOFF_FACTOR': 0.3,
+    'BREAKER_FAILURES': 5,
+    'BREAKER_RESET': 30,
+    'BREAKER_TRIAL_TIMEOUT': 60,
+    'MAX_IN_FLIGHT': 10,
+    'ASYNC_MAX_IN_FLIGHT': 100,
+    'MAX_QUEUE': 100,
+    'MAX_WAIT': 2,
+    'RATE': 20,
+    'BURST': 20,
+    'SHARED_RATE': False,
+}
+
+# Shared cache
+# Rate lookups and NBP responses are cached once for every worker and node. The backend is picked with the
+# RATES_CACHE_BACKEND environment variable: 'locmem' (one process, the default), 'file' (one machine), 'redis' or
+# 'memcached' (many machines, requires the `redis` or `pymemcache` package), at RATES_CACHE_LOCATION
+
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'rates'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / 'cache')),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379'),
+    'memcached': ('django.core.cache.backends.memcached.PyMemcacheCache', '127.0.0.1:11211'),
+}
+
+CACHE_BACKEND, CACHE_LOCATION = CACHE_BACKENDS[os.environ.get('RATES_CACHE_BACKEND', 'locmem')]
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.environ.get('RATES_CACHE_LOCATION', CACHE_LOCATION),
+        'KEY_PREFIX': 'exchange-rates',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        } if CACHE_BACKEND.endswith(('LocMemCache', 'FileBasedCache')) else {},
+    }
+}
+
+# Rate lookup cache
+# Rates for a given date are kept until evicted, `last/N` answers until the next table is published. Each worker
+# keeps the hottest entries in process in front of the shared cache; VERSION is bumped to drop every shared entry.
+# Expired `last/N` answers are kept STALE_TTL seconds more and served, marked stale, while NBP is unreachable
+
+RATES_CACHE = {
+    'MAX_ENTRIES': 4096,
+    'MAX_BYTES': 16 * 1024 * 1024,
+    'RETRY_AFTER': 300,
+    'ALIAS': 'default',
+    'VERSION': 1,
+    'STALE_TTL': 24 * 3600,
+}
+
+NBP_PUBLICATION_TIMES = {
+    'A': '12:15',
+    'C': '08:15',
+}
+
+# Batch endpoint
+# Maximum number of items per request and worker threads fetching their tables concurrently
+
+RATES_BATCH = {
+    'MAX_ITEMS': 500,
+    'WORKERS': 8,
+}
+
+# Conversion endpoint
+# Maximum number of target currencies and amounts per request, and of converted values (dates x targets x amounts)
+# per answer
+
+RATES_CONVERT = {
+    'MAX_TARGETS': 50,
+    'MAX_AMOUNTS': 10000,
+    'MAX_VALUES': 1000000,
+}
+
+# Date range endpoint
+# NBP answers range queries of up to 93 days; longer ranges are fetched in windows by concurrent workers
+
+RATES_RANGE = {
+    'WINDOW_DAYS': 93,
+    'WORKERS': 4,
+}
+
+# Rates snapshot
+# Written by `manage.py snapshot_rates` and mapped into memory by every worker at startup
+
+RATES_SNAPSHOT = BASE_DIR / 'rates.snapshot'
+
+# OpenAPI schema
+# Written by `manage.py write_schema` and served as is by every worker; generated on first use when missing
+
+RATES_SCHEMA = BASE_DIR / 'openapi.json'
+
+# Metrics
+# Each worker records its own metrics; with a DIRECTORY shared by the workers of a server (RATES_METRICS_DIR, set by
+# gunicorn.conf.py) each one writes them there every FLUSH_INTERVAL seconds and /metrics exports the sum of all of them
+
+RATES_METRICS = {
+    'DIRECTORY': os.environ.get('RATES_METRICS_DIR', ''),
+    'FLUSH_INTERVAL': 1,
+}
+
+# Sampling profiler
+# A SAMPLE_RATE share of the requests, and the requests sent with the HEADER set to TOKEN, are profiled: their stacks
+# are sampled every INTERVAL seconds ('stacks' MODE) or traced with cProfile ('pstats' MODE) and aggregated by view.
+# Each worker serves its profiles at /profiles to requests carrying the TOKEN; with neither set nothing is profiled
+
+RATES_PROFILER = {
+    'SAMPLE_RATE': float(os.environ.get('RATES_PROFILER_SAMPLE_RATE', 0)),
+    'TOKEN': os.environ.get('RATES_PROFILER_TOKEN', ''),
+    'HEADER': 'X-Profile',
+    'MODE': os.environ.get('RATES_PROFILER_MODE', 'stacks'),
+    'INTERVAL': 0.005,
+    'MAX_STACKS': 10000,
+}
+
+# Scheduled sync
+# `manage.py sync_rates` fetches the tables published since the last run (the last SINCE_DAYS on the first one) and
+# pre-computes the LAST quotations answers into the shared cache
+
+RATES_SYNC = {
+    'LAST': (10, 30, 90, 255),
+    'SINCE_DAYS': 366,
+    'LOCK_TIMEOUT': 3600,
 }
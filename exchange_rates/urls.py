@@ -15,23 +15,17 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.urls import path, include
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Exchange Rates API",
-        default_version="1.0.0",
-        description="API documentation for ExchangeRates App",
-    ),
-    public=True,
-)
+from rates_api import metrics, profiler, schema
 
 urlpatterns = [
     path("api/",
          include([
              path("exchanges/", include("rates_api.urls", namespace="rates-api")),
-             path("swagger/", schema_view.with_ui("swagger", cache_timeout=0), name="swagger-schema"),
+             path("swagger/", schema.swagger, name="swagger-schema"),
+             path("swagger.json", schema.serve, name="openapi-schema"),
          ])
          ),
+    path("metrics", metrics.export, name="metrics"),
+    path("profiles", profiler.export, name="profiles"),
 ]
@@ -0,0 +1,52 @@
+"""
+Gunicorn configuration of the production entrypoint:
+    DJANGO_SECRET_KEY=... gunicorn exchange_rates.wsgi
+
+The app is imported once in the master before forking (`preload_app`), so workers start at once and share the pages
+of the loaded code and of the rates snapshot mapped at startup. Each worker is threaded, as requests mostly wait on
+NBP or the cache; the clients, circuit breaker and limits of the NBP API are built per worker after the fork. The
+`async/` routes work under this WSGI server too, but each request runs on an event loop, and opens an NBP session, of
+its own; serve them under ASGI (`uvicorn exchange_rates.asgi:application`) to share one per process.
+
+Each worker records its own metrics, and a scrape of `/metrics` lands on any of them, so the workers share them
+through the `RATES_METRICS_DIR` directory: the hooks below empty it at startup, flush a worker's metrics when it
+exits and fold them into the totals of the exited workers, so the exported counters never go back.
+"""
+
+import multiprocessing
+import os
+import tempfile
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "exchange_rates.production")
+os.environ.setdefault("RATES_METRICS_DIR", os.path.join(tempfile.gettempdir(), "rates-metrics"))
+os.makedirs(os.environ["RATES_METRICS_DIR"], exist_ok=True)
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+preload_app = True
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG")
+errorlog = "-"
+
+
+def _metrics():
+    import django
+    django.setup()
+    from rates_api import metrics
+    return metrics
+
+
+def on_starting(server):
+    _metrics().clear_directory()
+
+
+def worker_exit(server, worker):
+    _metrics().flush()
+
+
+def child_exit(server, worker):
+    _metrics().fold(worker.pid)
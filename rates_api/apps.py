@@ -1,6 +1,34 @@
+import os
+
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.backends.signals import connection_created
 
 
 class RatesApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rates_api'
+
+    def ready(self) -> None:
+        """
+        Maps the rates snapshot into the table index, when one was written, so the worker starts with the history,
+        and puts SQLite databases in write-ahead-log mode as they are connected to.
+        """
+
+        connection_created.connect(_write_ahead_log)
+
+        path = getattr(settings, "RATES_SNAPSHOT", None)
+        if path and os.path.exists(path):
+            from .tables import index
+            index.load_snapshot(path)
+
+
+def _write_ahead_log(sender, connection, **kwargs) -> None:
+    """
+    Switches an SQLite database to write-ahead logging, so the threads and workers reading it never wait on one
+    ingesting rates, and writers only wait on each other, for up to the `timeout` option of the database.
+    """
+
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode=WAL")
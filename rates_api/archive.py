@@ -0,0 +1,153 @@
+"""
+Import of the yearly NBP archive files into the local rate store.
+NBP publishes one semicolon-separated file per table and year (e.g. `archiwum_tab_a_2023.csv`): a header row of
+currency columns like `1USD` or `100HUF` (rates of that many units), a row of currency names, one row per table and
+footer rows describing the columns. Table C files have two columns per currency, the bid and the ask rate. Files
+are parsed row by row and stored in large batches, so a whole archive is imported in seconds without any call to
+the NBP API.
+"""
+
+import csv
+import re
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import Iterable, Iterator, Optional
+
+from django.db import transaction
+
+from .models import Rate
+
+CURRENCY = re.compile(r"(\d+)([A-Z]{3})")
+
+DAY = re.compile(r"\d{4}-?\d{2}-?\d{2}")
+
+FILE_TABLE = re.compile(r"tab_([abc])", re.IGNORECASE)
+
+
+def parse(rows: Iterable[list], table: str) -> Iterator[Rate]:
+    """
+    Reads the rates of an archive file.
+    Parameters:
+    -----------
+    rows : Iterable[list]
+        The rows of the file, split into cells.
+    table : str
+        The NBP table letter of the file, `a` or `c`.
+    Returns:
+    --------
+    Iterator[Rate]
+        The unsaved rates, in file order.
+    Raises:
+    --------
+        ValueError: If the file has no header row with currency columns or a rate is not a number.
+    """
+
+    table = table.upper()
+    columns = None
+    for line, row in enumerate(rows, 1):
+        if columns is None:
+            if row and row[0].strip().lower().startswith("data"):
+                columns = _columns(row, table)
+            continue
+        cells = [cell.strip() for cell in row]
+        if not cells or not DAY.fullmatch(cells[columns["date"]]):
+            continue
+        effective_date = datetime.strptime(cells[columns["date"]].replace("-", ""), "%Y%m%d").date()
+        no = _table_number(cells, columns, table, effective_date)
+        for code, units, position in columns["currencies"]:
+            if table == "C":
+                bid, ask = _rate(cells, line, position, units), _rate(cells, line, position + 1, units)
+                if bid is not None and ask is not None:
+                    yield Rate(table=table, code=code, effective_date=effective_date, no=no, bid=bid, ask=ask)
+            else:
+                mid = _rate(cells, line, position, units)
+                if mid is not None:
+                    yield Rate(table=table, code=code, effective_date=effective_date, no=no, mid=mid)
+    if columns is None:
+        raise ValueError("No header row with currency columns")
+
+
+def import_file(path: str, table: Optional[str] = None, batch_size: int = 20000, encoding: str = "cp1250") -> int:
+    """
+    Imports an archive file into the rate store. Rates already stored are kept, so importing a file again changes
+    nothing.
+    Parameters:
+    -----------
+    path : str
+        The archive file.
+    table : str, optional
+        The NBP table letter of the file, by default read from its name.
+    batch_size : int
+        The number of rates inserted per transaction.
+    encoding : str
+        The encoding of the file; NBP writes them in Windows-1250.
+    Returns:
+    --------
+    int
+        The number of rates read from the file.
+    Raises:
+    --------
+        ValueError: If the table cannot be told from the file name, the file is not an archive file or a rate in it
+        is not a number.
+    """
+
+    if table is None:
+        match = FILE_TABLE.search(str(path))
+        if match is None:
+            raise ValueError(f"Cannot tell the table of {path}, pass it explicitly")
+        table = match.group(1)
+    read = 0
+    batch = []
+    with open(path, newline="", encoding=encoding) as file:
+        for rate in parse(csv.reader(file, delimiter=";"), table):
+            batch.append(rate)
+            if len(batch) == batch_size:
+                read += _store(batch)
+                batch = []
+    return read + _store(batch)
+
+
+def _columns(header: list, table: str) -> dict:
+    header = [cell.strip() for cell in header]
+    currencies = []
+    for position, cell in enumerate(header):
+        match = CURRENCY.fullmatch(cell)
+        if match is not None:
+            currencies.append((match.group(2), int(match.group(1)), position))
+    if not currencies:
+        raise ValueError("No header row with currency columns")
+    dates = [position for position, cell in enumerate(header[:currencies[0][2]]) if cell.lower().startswith("data")]
+    numbers = [position for position, cell in enumerate(header) if "numer tabeli" in cell.lower()]
+    full = [position for position in numbers if "pełny" in header[position].lower()]
+    return {
+        # Table C files also give the trading date; the effective date is the last date column.
+        "date": dates[-1],
+        "currencies": currencies,
+        "number": (full or numbers or [None])[0],
+        "full": bool(full),
+    }
+
+
+def _table_number(cells: list, columns: dict, table: str, effective_date: date) -> str:
+    position = columns["number"]
+    value = cells[position] if position is not None and position < len(cells) else ""
+    if columns["full"] and value:
+        return value
+    number = int(value.split("/")[0]) if value else 0
+    return f"{number:03d}/{table}/NBP/{effective_date.year}"
+
+
+def _rate(cells: list, line: int, position: int, units: int) -> Optional[float]:
+    value = cells[position] if position < len(cells) else ""
+    if not value:
+        return None
+    try:
+        return float(Decimal(value.replace(",", ".")) / units)
+    except InvalidOperation:
+        raise ValueError(f"Malformed rate {value!r} in row {line}, column {position + 1}") from None
+
+
+def _store(batch: list) -> int:
+    with transaction.atomic():
+        Rate.objects.bulk_create(batch, batch_size=1000, ignore_conflicts=True)
+    return len(batch)
@@ -0,0 +1,99 @@
+"""
+Async Django views for the currency exchange rates application.
+These are the native async versions of the views in `views`, meant to run under ASGI: their lookups wait on NBP
+through the non-blocking client, so one process can serve many in-flight upstream calls. Under WSGI Django runs each
+of them on an event loop of its own, so the client of that loop is closed with the request.
+"""
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse
+from django.views import View
+from rest_framework.exceptions import APIException
+
+from . import conditional, nbp, rates, service
+from .summaries import currency_date_data, difference_rate_data, last_quotations_data
+
+
+class AsyncAPIView(View):
+    """
+    A base async view that renders the API exceptions raised by the lookups the way DRF does.
+    """
+
+    http_method_names = ["get", "options"]
+
+    async def dispatch(self, request, *args, **kwargs) -> JsonResponse:
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {"detail": exc.detail}
+            return JsonResponse(data, status=exc.status_code, safe=False)
+        finally:
+            if not isinstance(request, ASGIRequest):
+                await nbp.close_async_client()
+
+
+class AsyncAverageRateCurrencyDate(AsyncAPIView):
+    """
+    The async version of `AverageRateCurrencyDate`.
+    """
+
+    async def get(self, request, code: str, date: str) -> JsonResponse:
+        """
+        Retrieve the average exchange rate for a given currency code and date, or with `?nearest=previous` of the
+        nearest previous publication day.
+        """
+
+        nearest = request.GET.get("nearest") == "previous"
+        conditional_get = conditional.for_date(request, "a", code, date, nearest)
+        unchanged = conditional_get.unchanged()
+        if unchanged is not None:
+            return unchanged
+        if nearest:
+            rate = await rates.aprevious_rate("a", code, date)
+            return conditional_get.respond(JsonResponse(currency_date_data(code, rate["effectiveDate"], rate)), rate)
+        rate = await rates.arate_on_date("a", code, date)
+        return conditional_get.respond(JsonResponse(currency_date_data(code, date, rate)), rate)
+
+
+class AsyncAverageRateLastQuotations(AsyncAPIView):
+    """
+    The async version of `AverageRateLastQuotations`.
+    """
+
+    async def get(self, request, code: str, number: int) -> JsonResponse:
+        """
+        Retrieves the minimum and maximum average exchange rate over the last N quotations of a currency.
+        """
+
+        if 1 <= number <= 255:
+            conditional_get = conditional.for_last(request, "a", code, number)
+            unchanged = conditional_get.unchanged()
+            if unchanged is not None:
+                return unchanged
+            quotations = await rates.alast_rates("a", code, number)
+            response = JsonResponse(last_quotations_data(code, number, rates.extremes_of("a", code, quotations)))
+            return conditional_get.respond(response, quotations[-1], stale=isinstance(quotations, rates.Stale))
+        else:
+            service.bad_request_raise(number)
+
+
+class AsyncDifferenceRateLastQuotations(AsyncAPIView):
+    """
+    The async version of `DifferenceRateLastQuotations`.
+    """
+
+    async def get(self, request, code: str, number: int) -> JsonResponse:
+        """
+        Retrieves the biggest difference between the bid and ask rates of a currency over the last N quotations.
+        """
+
+        if 1 <= number <= 255:
+            conditional_get = conditional.for_last(request, "c", code, number)
+            unchanged = conditional_get.unchanged()
+            if unchanged is not None:
+                return unchanged
+            quotations = await rates.alast_rates("c", code, number)
+            response = JsonResponse(difference_rate_data(code, number, rates.extremes_of("c", code, quotations)[1]))
+            return conditional_get.respond(response, quotations[-1], stale=isinstance(quotations, rates.Stale))
+        else:
+            service.bad_request_raise(number)
@@ -0,0 +1,138 @@
+"""
+Resolution of batched rate lookups.
+A batch is a list of items, each asking for what one of the single endpoints answers: the rate of a currency on a
+date, or the minimum and maximum (or the biggest bid/ask difference) over its last N quotations. Identical items
+are resolved once, and the upstream fetches the batch needs are made concurrently, one whole table per date and one
+`last/N` fetch per table, before the items are answered from the table index.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from rest_framework.exceptions import APIException, ValidationError
+
+from . import rates, service
+from .summaries import currency_date_data, difference_rate_data, last_quotations_data
+
+DEFAULTS = {
+    "MAX_ITEMS": 500,
+    "WORKERS": 8,
+}
+
+
+def options() -> dict:
+    """
+    Returns the `RATES_BATCH` setting merged over the defaults.
+    """
+
+    return {**DEFAULTS, **getattr(settings, "RATES_BATCH", {})}
+
+
+def parse(item) -> tuple:
+    """
+    Validates one batch item and turns it into a hashable lookup.
+    Parameters:
+    -----------
+    item : Any
+        A JSON object with a `code` and either a `date` (yyyy-mm-dd) or a `number` of last quotations, optionally
+        with `"difference": true` to ask for the biggest bid/ask difference instead of the minimum and maximum.
+    Returns:
+    --------
+    tuple
+        `("date", code, date)`, `("last", code, number)` or `("difference", code, number)`.
+    Raises:
+    --------
+        ValidationError: If the item is malformed or the number of quotations is out of range.
+    """
+
+    if not isinstance(item, dict) or not isinstance(item.get("code"), str) or ("date" in item) == ("number" in item):
+        raise ValidationError({"detail": "400 BadRequest - An item needs a `code` and either a `date` or a `number`"})
+    code = item["code"].lower()
+    if "date" in item:
+        if not isinstance(item["date"], str) or "/" in item["date"]:
+            raise ValidationError({"detail": "400 BadRequest - `date` must be in the format yyyy-mm-dd"})
+        return "date", code, item["date"]
+    number = item["number"]
+    if not isinstance(number, int) or isinstance(number, bool):
+        raise ValidationError({"detail": "400 BadRequest - `number` must be an integer"})
+    if not 1 <= number <= 255:
+        service.bad_request_raise(number)
+    return ("difference" if item.get("difference") else "last"), code, number
+
+
+def resolve(lookup: tuple) -> dict:
+    """
+    Answers one parsed lookup with the body its single endpoint would return.
+    """
+
+    kind, code, argument = lookup
+    if kind == "date":
+        return currency_date_data(code, argument, rates.rate_on_date("a", code, argument))
+    if kind == "last":
+        return last_quotations_data(code, argument, rates.last_extremes("a", code, argument))
+    return difference_rate_data(code, argument, rates.last_extremes("c", code, argument)[1])
+
+
+def leaders(lookups: list) -> list:
+    """
+    Picks the lookups whose upstream fetches cover the whole batch: one per date, and the one with the largest
+    number of quotations per table. Once they are resolved, the tables they ingested answer the others.
+    """
+
+    by_date = {}
+    by_table = {}
+    for lookup in lookups:
+        kind, _, argument = lookup
+        if kind == "date":
+            by_date.setdefault(argument, lookup)
+        elif argument > by_table.get(kind, (None, None, 0))[2]:
+            by_table[kind] = lookup
+    return [*by_date.values(), *by_table.values()]
+
+
+def run(items: list) -> list:
+    """
+    Resolves a batch.
+    Parameters:
+    -----------
+    items : list
+        The batch items, see `parse`.
+    Returns:
+    --------
+    list
+        One element per item, in order: `{"item": ..., "result": ...}` or `{"item": ..., "error": {"status": ...,
+        "detail": ...}}`.
+    """
+
+    outcomes = {}
+    lookups = {}
+    for position, item in enumerate(items):
+        try:
+            lookups[position] = parse(item)
+        except APIException as exc:
+            outcomes[position] = _error(exc)
+    unique = list(dict.fromkeys(lookups.values()))
+    answers = {}
+    first = leaders(unique)
+    with ThreadPoolExecutor(max_workers=options()["WORKERS"]) as pool:
+        answers.update(zip(first, pool.map(_answer, first)))
+        rest = [lookup for lookup in unique if lookup not in answers]
+        answers.update(zip(rest, pool.map(_answer, rest)))
+    for position, lookup in lookups.items():
+        outcomes[position] = answers[lookup]
+    return [{"item": item, **outcomes[position]} for position, item in enumerate(items)]
+
+
+def _answer(lookup: tuple) -> dict:
+    try:
+        return {"result": resolve(lookup)}
+    except APIException as exc:
+        return _error(exc)
+    finally:
+        connection.close()
+
+
+def _error(exc: APIException) -> dict:
+    detail = exc.detail.get("detail", exc.detail) if isinstance(exc.detail, dict) else exc.detail
+    return {"error": {"status": exc.status_code, "detail": detail}}
@@ -0,0 +1,112 @@
+"""
+Circuit breaker for the calls to the NBP API.
+After a run of failed calls (network errors, or the 429 and 5xx answers left after retries) the breaker opens and
+calls fail at once instead of waiting on timeouts, so an NBP outage does not pile up blocked workers. Once the reset
+delay has passed one trial call goes through: its success closes the breaker, its failure opens it again. A trial
+call that ends without an answer to record (rejected by the limits, cancelled) is given back, and one that has not
+ended after the trial timeout is given up on, so the breaker can never stay open for good.
+"""
+
+import threading
+import time
+from typing import Optional
+
+
+class CircuitBreaker:
+    """
+    The state of the upstream as seen by the calls of one process.
+    """
+
+    def __init__(self, failures: int, reset_after: float, trial_timeout: float = 60) -> None:
+        """
+        Parameters:
+        -----------
+        failures : int
+            The number of consecutive failed calls that opens the breaker.
+        reset_after : float
+            Seconds the breaker stays open before letting a trial call through.
+        trial_timeout : float
+            Seconds after which a trial call that has not been recorded is given up on, and another one let through.
+        """
+
+        self.failures = failures
+        self.reset_after = reset_after
+        self.trial_timeout = trial_timeout
+        self._count = 0
+        self._opened_at = None
+        self._trial = False
+        self._trial_at = 0.0
+        self._trials = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Tells whether a call may go upstream, taking the trial call when the reset delay has passed.
+        """
+
+        return self.take() is not None
+
+    def take(self) -> Optional[int]:
+        """
+        Lets a call go upstream when the breaker allows it.
+        Returns:
+        --------
+        Optional[int]
+            None if the call is refused, 0 for a call while the breaker is closed, or the number of the trial call
+            taken when the reset delay has passed, to give back with `release`.
+        """
+
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            now = time.monotonic()
+            if self._trial and now < self._trial_at + self.trial_timeout:
+                return None
+            if now < self._opened_at + self.reset_after:
+                return None
+            self._trial = True
+            self._trial_at = now
+            self._trials += 1
+            return self._trials
+
+    def is_open(self) -> bool:
+        """
+        Tells whether calls are currently refused or waiting on the trial call.
+        """
+
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            now = time.monotonic()
+            return ((self._trial and now < self._trial_at + self.trial_timeout)
+                    or now < self._opened_at + self.reset_after)
+
+    def release(self, trial: int) -> None:
+        """
+        Gives back a trial call taken by `take` that ended without being recorded, so the next call may try.
+        """
+
+        with self._lock:
+            if self._trial and trial == self._trials:
+                self._trial = False
+
+    def record_success(self) -> None:
+        """
+        Records a call NBP answered, closing the breaker.
+        """
+
+        with self._lock:
+            self._count = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self) -> None:
+        """
+        Records a failed call, opening the breaker after `failures` of them in a row or when the trial call fails.
+        """
+
+        with self._lock:
+            self._count += 1
+            if self._count >= self.failures or self._trial:
+                self._opened_at = time.monotonic()
+            self._trial = False
@@ -0,0 +1,357 @@
+"""
+Caches for rate lookups and NBP responses.
+Entries are shared by every worker and node through Django's cache framework (the `CACHES` setting picks the
+backend), under versioned keys and compactly serialized, with an in-process LRU in front bounded both by count and
+by approximate size in memory. Rates for a given date never change once published, so those entries never expire;
+`last/N` entries expire with the next table, and are kept for `STALE_TTL` seconds more as the last known good answer
+to serve while NBP is unreachable.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Any, Hashable, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics, publication
+
+DEFAULTS = {
+    "MAX_ENTRIES": 4096,
+    "MAX_BYTES": 16 * 1024 * 1024,
+    "RETRY_AFTER": 300,
+    "ALIAS": "default",
+    "VERSION": 1,
+    "STALE_TTL": 24 * 3600,
+}
+
+# Bumped when the layout of cached values changes, so workers running different releases never read each other's.
+SCHEMA = 1
+
+SAFE_KEY = re.compile(r"[\w.:-]{1,200}", re.ASCII)
+
+COMPRESS_OVER = 512
+
+# Seconds a process keeps using the generation of a shared cache before reading it again, to see a clear by another.
+GENERATION_TTL = 60
+
+
+class RateCache:
+    """
+    A thread-safe LRU mapping with per-entry expiry and a memory bound.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, stale_for: float = 0) -> None:
+        """
+        Parameters:
+        -----------
+        max_entries : int
+            The maximum number of entries kept.
+        max_bytes : int
+            The maximum total size of the kept entries.
+        stale_for : float
+            Seconds an expired entry is still kept for stale reads.
+        """
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale_for = stale_for
+        self.size = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, stale: bool = False) -> Any:
+        """
+        Returns the value stored under `key`, or None when it is missing or expired. With `stale`, an expired value
+        kept for stale reads is returned too.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                if expires_at + self.stale_for <= time.time():
+                    del self._entries[key]
+                    self.size -= size
+                    return None
+                return value if stale else None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, size: int, expires_at: Optional[float] = None) -> None:
+        """
+        Stores `value` under `key`, evicting the least recently used entries to stay within the bounds.
+        Parameters:
+        -----------
+        key : Hashable
+            The cache key.
+        value : Any
+            The value to store.
+        size : int
+            The number of bytes accounted for the entry.
+        expires_at : float, optional
+            A UNIX timestamp after which the entry is expired, or None to keep it until evicted.
+        """
+
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self._entries[key] = (value, size, expires_at)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self) -> None:
+        """
+        Removes every entry.
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class SharedCache:
+    """
+    A cache shared through Django's cache framework, optionally with an in-process `RateCache` in front.
+    Values are JSON-compatible and stored as compact (and, when large, compressed) JSON, so any backend holds them
+    and any worker can read what another one wrote.
+    """
+
+    def __init__(self, prefix: str, local: Optional[RateCache] = None) -> None:
+        """
+        Parameters:
+        -----------
+        prefix : str
+            The namespace of the keys of this cache.
+        local : RateCache, optional
+            The in-process cache answering before the shared backend.
+        """
+
+        self.prefix = prefix
+        self.local = local
+        self._generation = 0
+        self._generation_read_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self.local) if self.local is not None else 0
+
+    def get(self, key: tuple, stale: bool = False) -> Any:
+        """
+        Returns the value stored under `key`, or None when it is missing or expired. With `stale`, an expired value
+        kept for `STALE_TTL` seconds is returned too.
+        """
+
+        value = self._local_get(key, stale)
+        if value is not None:
+            return value
+        options = _options()
+        payload = caches[options["ALIAS"]].get(self.key(key), version=options["VERSION"])
+        return self._found(key, payload, stale)
+
+    async def aget(self, key: tuple, stale: bool = False) -> Any:
+        """
+        The async version of `get`, waiting on the shared backend through its async API.
+        """
+
+        value = self._local_get(key, stale)
+        if value is not None:
+            return value
+        options = _options()
+        payload = await caches[options["ALIAS"]].aget(await self.akey(key), version=options["VERSION"])
+        return self._found(key, payload, stale)
+
+    def set(self, key: tuple, value: Any, size: int, expires_at: Optional[float] = None) -> None:
+        """
+        Stores `value` under `key` in the local and the shared cache. The parameters are the ones of `RateCache.set`.
+        """
+
+        timeout = self._local_set(key, value, size, expires_at)
+        if timeout is not False:
+            options = _options()
+            caches[options["ALIAS"]].set(self.key(key), _encode(value, expires_at), timeout=timeout,
+                                         version=options["VERSION"])
+
+    async def aset(self, key: tuple, value: Any, size: int, expires_at: Optional[float] = None) -> None:
+        """
+        The async version of `set`.
+        """
+
+        timeout = self._local_set(key, value, size, expires_at)
+        if timeout is not False:
+            options = _options()
+            await caches[options["ALIAS"]].aset(await self.akey(key), _encode(value, expires_at), timeout=timeout,
+                                                version=options["VERSION"])
+
+    def _local_get(self, key: tuple, stale: bool) -> Any:
+        if self.local is None:
+            return None
+        value = self.local.get(key, stale)
+        if value is not None:
+            metrics.cache_lookups.inc(self.prefix, "local")
+        return value
+
+    def _found(self, key: tuple, payload: Optional[bytes], stale: bool) -> Any:
+        """
+        Decodes a payload read from the shared backend, keeping it in the local cache while it is current.
+        """
+
+        if payload is None:
+            metrics.cache_lookups.inc(self.prefix, "miss")
+            return None
+        expires_at, value = _decode(payload)
+        if expires_at is not None and expires_at <= time.time():
+            if stale and expires_at + _options()["STALE_TTL"] > time.time():
+                metrics.cache_lookups.inc(self.prefix, "stale")
+                return value
+            metrics.cache_lookups.inc(self.prefix, "miss")
+            return None
+        metrics.cache_lookups.inc(self.prefix, "shared")
+        if self.local is not None:
+            self.local.set(key, value, size=len(payload), expires_at=expires_at)
+        return value
+
+    def _local_set(self, key: tuple, value: Any, size: int, expires_at: Optional[float]):
+        """
+        Stores `value` in the local cache and returns the timeout of its shared entry, False when it is past keeping.
+        """
+
+        if self.local is not None:
+            self.local.set(key, value, size, expires_at)
+        if expires_at is None:
+            return None
+        timeout = expires_at + _options()["STALE_TTL"] - time.time()
+        return timeout if timeout > 0 else False
+
+    def clear(self) -> None:
+        """
+        Removes every entry from the local cache, and drops the entries of this cache from the shared backend by
+        bumping its generation, leaving the other keys of the backend alone. Other processes stop reading the dropped
+        entries within `GENERATION_TTL` seconds; the backend evicts them as they expire or by its memory policy.
+        """
+
+        if self.local is not None:
+            self.local.clear()
+        options = _options()
+        backend = caches[options["ALIAS"]]
+        key = self._generation_key()
+        backend.add(key, 0, timeout=None, version=options["VERSION"])
+        try:
+            backend.incr(key, version=options["VERSION"])
+        except ValueError:
+            backend.set(key, self._generation + 1, timeout=None, version=options["VERSION"])
+        self._generation_read_at = None
+
+    def key(self, key: tuple) -> str:
+        """
+        Returns the backend key of `key` in the current generation of this cache, hashed when it is too long or has
+        characters some backends reject.
+        """
+
+        return self._key(key, self.generation())
+
+    async def akey(self, key: tuple) -> str:
+        """
+        The async version of `key`.
+        """
+
+        return self._key(key, await self.ageneration())
+
+    def generation(self) -> int:
+        """
+        Returns the generation of this cache, bumped by every `clear`, read from the backend every `GENERATION_TTL`
+        seconds.
+        """
+
+        if self._generation_due():
+            options = _options()
+            self._generation = caches[options["ALIAS"]].get(self._generation_key(), 0, version=options["VERSION"])
+        return self._generation
+
+    async def ageneration(self) -> int:
+        """
+        The async version of `generation`.
+        """
+
+        if self._generation_due():
+            options = _options()
+            self._generation = await caches[options["ALIAS"]].aget(self._generation_key(), 0,
+                                                                   version=options["VERSION"])
+        return self._generation
+
+    def _generation_due(self) -> bool:
+        now = time.monotonic()
+        if self._generation_read_at is not None and now < self._generation_read_at + GENERATION_TTL:
+            return False
+        self._generation_read_at = now
+        return True
+
+    def _generation_key(self) -> str:
+        return f"{self.prefix}:{SCHEMA}:generation"
+
+    def _key(self, key: tuple, generation: int) -> str:
+        text = ":".join(str(part) for part in key)
+        if not SAFE_KEY.fullmatch(text):
+            text = hashlib.sha1(text.encode()).hexdigest()
+        return f"{self.prefix}:{SCHEMA}:{generation}:{text}"
+
+
+def _encode(value: Any, expires_at: Optional[float]) -> bytes:
+    data = json.dumps([expires_at, value], separators=(",", ":")).encode()
+    if len(data) > COMPRESS_OVER:
+        return b"z" + zlib.compress(data)
+    return b"j" + data
+
+
+def _decode(payload: bytes) -> tuple:
+    data = zlib.decompress(payload[1:]) if payload[:1] == b"z" else payload[1:]
+    expires_at, value = json.loads(data)
+    return expires_at, value
+
+
+def last_expiry(table: str, newest: date) -> float:
+    """
+    Returns when a `last/N` answer whose newest rate is dated `newest` stops being current.
+    Parameters:
+    -----------
+    table : str
+        The NBP table letter.
+    newest : date
+        The effective date of the newest rate in the answer.
+    Returns:
+    --------
+    float
+        The UNIX timestamp of the next publication, or a short retry delay when the table expected to be out
+        already was not in the answer (NBP publishing late, or a holiday).
+    """
+
+    moment = publication.now()
+    expires_at = publication.next_publication(table, moment)
+    if newest < publication.latest_publication(table, moment):
+        retry_at = moment + timedelta(seconds=_options()["RETRY_AFTER"])
+        expires_at = min(expires_at, retry_at)
+    return expires_at.timestamp()
+
+
+def _options() -> dict:
+    return {**DEFAULTS, **getattr(settings, "RATES_CACHE", {})}
+
+
+rates = SharedCache("rates", RateCache(max_entries=_options()["MAX_ENTRIES"], max_bytes=_options()["MAX_BYTES"],
+                                      stale_for=_options()["STALE_TTL"]))
+responses = SharedCache("responses")
@@ -0,0 +1,210 @@
+"""
+HTTP conditional requests for the rate endpoints.
+Answers carry an `ETag` naming the NBP table of their newest rate (its effective date and number) and a
+`Last-Modified` at that table's publication, so clients and edge caches revalidate instead of downloading again.
+Published rates never change, so a client's copy can often be judged current from its validators and the
+publication schedule alone and answered with 304 before any lookup: the answer for a past date is immutable, and a
+`last/N` answer is current while its newest rate is from the latest publication.
+"""
+
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+from . import cache, publication, rates, tables
+
+# What `immutable` answers are cached for: a year, the longest lifetime caches are expected to honour.
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+STALE_WARNING = '110 - "Response is Stale"'
+
+
+class Conditional:
+    """
+    The conditional request for one answer of a rate endpoint.
+    """
+
+    def __init__(self, request, table: str, resource: Optional[str], fixed: Optional[date] = None,
+                 nearest: bool = False) -> None:
+        """
+        Parameters:
+        -----------
+        request : HttpRequest
+            The request object.
+        table : str
+            The NBP table letter of the answer.
+        resource : str
+            What the answer is of, e.g. `GBP:2023-01-02` or `GBP:last/10`, naming its validators; None for a
+            request no answer can be current for.
+        fixed : date, optional
+            The date the answer is for, which no later table changes once it is published; None for answers that
+            follow the latest table.
+        nearest : bool
+            Whether the answer for `fixed` is the rate of the nearest previous publication day, so it exists on days
+            without a table.
+        """
+
+        self.request = request
+        self.table = table.upper()
+        self.resource = resource
+        self.fixed = fixed
+        self.nearest = nearest
+        self.latest = publication.latest_publication(table)
+
+    def unchanged(self) -> Optional[HttpResponse]:
+        """
+        Returns a 304 response when the validators of the request show the client's copy is still current, without
+        looking any rate up, or None.
+        """
+
+        if self.resource is None:
+            return None
+        client_tags = parse_etags(self.request.headers.get("If-None-Match", ""))
+        if client_tags:
+            for tag in client_tags:
+                newest = self._newest_of(tag)
+                if newest is not None and self._current(newest):
+                    return self._not_modified(tag, self._expires_at(newest))
+            return None
+        modified_since = parse_http_date_safe(self.request.headers.get("If-Modified-Since", ""))
+        if modified_since is None:
+            return None
+        if self.fixed is not None:
+            return self._unmodified_since(modified_since)
+        moment = datetime.fromtimestamp(modified_since, publication.WARSAW)
+        newest = moment.date() - timedelta(days=moment.time() < publication.publication_time(self.table))
+        if not self._current(newest):
+            return None
+        return self._not_modified(None, self._expires_at(newest))
+
+    def _unmodified_since(self, modified_since: int) -> Optional[HttpResponse]:
+        """
+        Returns a 304 response when a copy of the answer for a fixed date, as of `modified_since`, is current: the
+        table of the date is out, the copy is from after its publication (no later table changes the answer), and,
+        but for the nearest mode, the date is not known to have no table, which is answered with a 404. Or None.
+        """
+
+        if self.fixed > self.latest or modified_since < self._published_at(self.fixed).timestamp():
+            return None
+        if not self.nearest and tables.index.calendar.is_missing(self.table, self.fixed):
+            return None
+        return self._not_modified(None, self._expires_at(self.fixed))
+
+    def respond(self, response: HttpResponse, rate: dict, stale: bool = False) -> HttpResponse:
+        """
+        Adds the validators and the caching lifetime of an answer to its response, or returns a 304 response when
+        they match the validators of the request.
+        Parameters:
+        -----------
+        response : HttpResponse
+            The response with the answer.
+        rate : dict
+            The newest rate of the answer, in the shape of one element of the `rates` list of an NBP response.
+        stale : bool
+            Whether the answer is served after it expired; it is then marked with a `Warning` and not cached.
+        Returns:
+        --------
+        HttpResponse
+            The response, or a 304 response.
+        """
+
+        tag = f'W/"{self.table}:{self.resource}:{rate["effectiveDate"]}:{rate["no"]}"'
+        newest = date.fromisoformat(rate["effectiveDate"])
+        last_modified = self._published_at(newest)
+        expires_at = publication.now().timestamp() if stale else self._expires_at(newest)
+        client_tags = parse_etags(self.request.headers.get("If-None-Match", ""))
+        if client_tags:
+            if "*" in client_tags or _opaque(tag) in map(_opaque, client_tags):
+                response = self._not_modified(tag, expires_at)
+        else:
+            modified_since = parse_http_date_safe(self.request.headers.get("If-Modified-Since", ""))
+            if modified_since is not None and modified_since >= int(last_modified.timestamp()):
+                response = self._not_modified(tag, expires_at)
+        if response.status_code != 304:
+            response.headers["ETag"] = tag
+            response.headers["Last-Modified"] = http_date(last_modified.timestamp())
+            _cache_for(response, expires_at)
+        if stale:
+            response.headers["Warning"] = STALE_WARNING
+        return response
+
+    def _newest_of(self, tag: str) -> Optional[date]:
+        """
+        Returns the effective date of the newest rate of the copy an entity tag of this answer names, or None for
+        a tag of another answer.
+        """
+
+        resource, _, rest = _opaque(tag).partition(f"{self.table}:{self.resource}:")
+        if resource or not rest:
+            return None
+        try:
+            return date.fromisoformat(rest.split(":", 1)[0])
+        except ValueError:
+            return None
+
+    def _current(self, newest: date) -> bool:
+        """
+        Tells whether a copy whose newest rate is from `newest` is still the answer: the answer is for a date whose
+        table is out, or the copy has the latest table.
+        """
+
+        return (self.fixed is not None and self.fixed < self.latest) or newest >= self.latest
+
+    def _expires_at(self, newest: date) -> Optional[float]:
+        """
+        Returns when an answer whose newest rate is from `newest` may change, or None when it never does.
+        """
+
+        if self.fixed is not None and (newest == self.fixed or self.fixed < self.latest):
+            return None
+        return cache.last_expiry(self.table, newest)
+
+    def _published_at(self, day: date) -> datetime:
+        return datetime.combine(day, publication.publication_time(self.table), tzinfo=publication.WARSAW)
+
+    def _not_modified(self, tag: Optional[str], expires_at: Optional[float]) -> HttpResponse:
+        response = HttpResponseNotModified()
+        if tag is not None:
+            response.headers["ETag"] = tag
+        _cache_for(response, expires_at)
+        return response
+
+
+def for_date(request, table: str, code: str, day: str, nearest: bool = False) -> Conditional:
+    """
+    Returns the conditional request for the rate of a currency on a date, or on the nearest previous publication
+    day with `nearest`.
+    """
+
+    fixed = rates.parse_date(day)
+    if fixed is None:
+        return Conditional(request, table, None)
+    resource = f"{code.upper()}:previous/{day}" if nearest else f"{code.upper()}:{day}"
+    return Conditional(request, table, resource, fixed, nearest)
+
+
+def for_last(request, table: str, code: str, number: int) -> Conditional:
+    """
+    Returns the conditional request for an answer over the last `number` quotations of a currency.
+    """
+
+    return Conditional(request, table, f"{code.upper()}:last/{number}")
+
+
+def _opaque(tag: str) -> str:
+    """
+    Returns the quoted part of an entity tag, without the weakness marker, as `If-None-Match` compares tags weakly.
+    """
+
+    return (tag[2:] if tag.startswith("W/") else tag).strip('"')
+
+
+def _cache_for(response: HttpResponse, expires_at: Optional[float]) -> None:
+    if expires_at is None:
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        seconds = int(expires_at - publication.now().timestamp())
+        patch_cache_control(response, public=True, max_age=max(seconds, 0))
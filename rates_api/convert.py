@@ -0,0 +1,176 @@
+"""
+Conversion of amounts between currencies through their table A rates.
+NBP publishes the average rate of every currency in zloty, so the cross rate of a base currency into a target is
+the ratio of their mids. The mids of all the requested currencies on every requested date are read from the table
+index into one array, and the cross rates and converted amounts of every date, target and amount are computed from
+it in one vectorized pass.
+"""
+
+from datetime import date
+
+import numpy as np
+from django.conf import settings
+from rest_framework.exceptions import ValidationError
+
+from . import rates, service, tables
+
+DEFAULTS = {
+    "MAX_TARGETS": 50,
+    "MAX_AMOUNTS": 10000,
+    "MAX_VALUES": 1000000,
+}
+
+# The zloty is not in table A: every rate is quoted in it.
+PLN = "PLN"
+
+DECIMALS = 4
+
+
+def options() -> dict:
+    """
+    Returns the `RATES_CONVERT` setting merged over the defaults.
+    """
+
+    return {**DEFAULTS, **getattr(settings, "RATES_CONVERT", {})}
+
+
+def parse(data) -> tuple:
+    """
+    Validates a conversion request.
+    Parameters:
+    -----------
+    data : Any
+        A JSON object with a `base` currency code, a list of `targets` codes, a list of `amounts` in the base
+        currency and either a `date` or a `start` and an `end` (yyyy-mm-dd).
+    Returns:
+    --------
+    tuple
+        The upper-case base and targets, the amounts as a float array, and the first and last date (equal for a
+        single date) as strings.
+    Raises:
+    --------
+        ValidationError: If the request is malformed or asks for more values than allowed.
+    """
+
+    if not isinstance(data, dict) or not isinstance(data.get("base"), str):
+        raise ValidationError({"detail": "400 BadRequest - The body must be an object with a `base` currency"})
+    targets = data.get("targets")
+    if not isinstance(targets, list) or not targets or not all(isinstance(code, str) for code in targets):
+        raise ValidationError({"detail": "400 BadRequest - `targets` must be a non-empty list of currency codes"})
+    amounts = data.get("amounts")
+    if not isinstance(amounts, list) or not amounts \
+            or not all(isinstance(amount, (int, float)) and not isinstance(amount, bool) for amount in amounts):
+        raise ValidationError({"detail": "400 BadRequest - `amounts` must be a non-empty list of numbers"})
+    if "date" in data:
+        start = end = data["date"]
+    elif "start" in data and "end" in data:
+        start, end = data["start"], data["end"]
+    else:
+        raise ValidationError({"detail": "400 BadRequest - The body needs either a `date` or a `start` and an `end`"})
+    if not all(isinstance(day, str) and "/" not in day for day in (start, end)):
+        raise ValidationError({"detail": "400 BadRequest - Dates must be in the format yyyy-mm-dd"})
+    limits = options()
+    if len(targets) > limits["MAX_TARGETS"]:
+        raise ValidationError({"detail": f"400 BadRequest - At most {limits['MAX_TARGETS']} targets can be asked for"})
+    if len(amounts) > limits["MAX_AMOUNTS"]:
+        raise ValidationError({"detail": f"400 BadRequest - At most {limits['MAX_AMOUNTS']} amounts can be converted"})
+    return data["base"].upper(), [code.upper() for code in targets], np.asarray(amounts, dtype=np.float64), start, end
+
+
+def mids(codes: list, start: str, end: str) -> tuple:
+    """
+    Reads the table A mids of currencies on a date or over a date range, on the dates all of them were quoted.
+    Parameters:
+    -----------
+    codes : list
+        The upper-case currency codes, the zloty included (quoted at 1).
+    start : str
+        The first date in the format yyyy-mm-dd.
+    end : str
+        The last date, equal to `start` for a single date.
+    Returns:
+    --------
+    tuple
+        The effective dates as ISO strings, and a float array with one row per date and one column per code.
+    Raises:
+    --------
+        ValidationError: If the range is malformed.
+        NotFound: If NBP has no rate of one of the currencies on the date, or no date quoting all of them in the
+        range.
+    """
+
+    quoted = [code for code in dict.fromkeys(codes) if code != PLN]
+    if start == end:
+        found = {code: rates.rate_on_date("a", code, start) for code in quoted}
+        days = [found[quoted[0]]["effectiveDate"]] if quoted else [start]
+        values = np.array([[found[code]["mid"] if code != PLN else 1.0 for code in codes]])
+        return days, values
+    first, last = rates.parse_range(start, end)
+    if not quoted:
+        service.no_data_raise()
+    if not all(rates.CODE.fullmatch(code) for code in quoted):
+        service.no_data_raise()
+    tables.ingest_range("a", first, last)
+    series = {}
+    for code in quoted:
+        found = tables.index.rates_between("a", code, first, last)
+        ordinals = np.fromiter((date.fromisoformat(rate["effectiveDate"]).toordinal() for rate in found),
+                               dtype=np.int64, count=len(found))
+        series[code] = (ordinals, np.fromiter((rate["mid"] for rate in found), dtype=np.float64, count=len(found)))
+    common = series[quoted[0]][0]
+    for ordinals, _ in series.values():
+        common = np.intersect1d(common, ordinals, assume_unique=True)
+    if not len(common):
+        service.no_data_raise()
+    values = np.ones((len(common), len(codes)))
+    for column, code in enumerate(codes):
+        if code != PLN:
+            ordinals, quotes = series[code]
+            values[:, column] = quotes[np.searchsorted(ordinals, common)]
+    return [date.fromordinal(int(day)).isoformat() for day in common], values
+
+
+def convert(base: str, targets: list, amounts: np.ndarray, start: str, end: str) -> dict:
+    """
+    Converts amounts of a base currency into target currencies at the cross rates of a date or of every date of a
+    range.
+    Parameters:
+    -----------
+    base : str
+        The upper-case code of the currency of the amounts.
+    targets : list
+        The upper-case codes of the currencies to convert into.
+    amounts : np.ndarray
+        The amounts in the base currency.
+    start : str
+        The date of the rates, or the first date of the range, in the format yyyy-mm-dd.
+    end : str
+        The last date of the range, equal to `start` for a single date.
+    Returns:
+    --------
+    dict
+        The base and, for each date, its effective date, the cross rate of each target and the amounts converted
+        into it, rounded to four decimals.
+    Raises:
+    --------
+        ValidationError: If the range is malformed or the answer would have more values than allowed.
+        NotFound: If NBP has no rates of the currencies for the dates.
+    """
+
+    # Checked on the calendar days of the range, an upper bound of its quoted dates, before anything is fetched.
+    span = 1
+    if start != end:
+        first, last = rates.parse_range(start, end)
+        span = (last - first).days + 1
+    limit = options()["MAX_VALUES"]
+    if span * len(targets) * len(amounts) > limit:
+        raise ValidationError({"detail": f"400 BadRequest - A conversion cannot have more than {limit} values"})
+    days, values = mids([base, *targets], start, end)
+    # Zloty per base unit over zloty per target unit: target units per base unit, one row per date.
+    cross = values[:, :1] / values[:, 1:]
+    converted = np.round(cross[:, :, np.newaxis] * amounts, DECIMALS)
+    conversions = [{"effectiveDate": day,
+                    "rates": dict(zip(targets, day_rates)),
+                    "amounts": dict(zip(targets, day_amounts))}
+                   for day, day_rates, day_amounts in zip(days, cross.tolist(), converted.tolist())]
+    return {"base": base, "conversions": conversions}
@@ -0,0 +1,233 @@
+"""
+Limits on the calls to the NBP API.
+A limiter bounds the calls in flight and the callers waiting for one, and takes every call from a requests-per-second
+budget: a token bucket of the process, or a per-second counter in the shared cache to hold every worker and node to
+one budget. A caller that cannot start its call before its deadline is rejected at once rather than left waiting, so
+traffic spikes queue briefly instead of bursting against NBP or holding workers.
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+from django.core.cache import caches
+
+from . import service
+
+
+class TokenBucket:
+    """
+    A requests-per-second budget of one process, allowing bursts of up to `burst` calls.
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        """
+        Parameters:
+        -----------
+        rate : float
+            The calls per second.
+        burst : int
+            The calls that can be made at once after a quiet period.
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, deadline: float) -> Optional[float]:
+        """
+        Takes a token, possibly one not refilled yet.
+        Parameters:
+        -----------
+        deadline : float
+            The `time.monotonic()` by which the call must start.
+        Returns:
+        --------
+        float
+            The seconds to wait before the call, or None (taking nothing) when its token comes after the deadline.
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            delay = max(0.0, (1 - self._tokens) / self.rate)
+            if now + delay > deadline:
+                return None
+            self._tokens -= 1
+            return delay
+
+    async def areserve(self, deadline: float) -> Optional[float]:
+        """
+        The async version of `reserve`, which waits on nothing.
+        """
+
+        return self.reserve(deadline)
+
+
+class SharedBucket:
+    """
+    A requests-per-second budget shared through Django's cache framework, counting the calls of each second.
+    """
+
+    def __init__(self, rate: float, alias: str = "default", prefix: str = "nbp_calls") -> None:
+        """
+        Parameters:
+        -----------
+        rate : float
+            The calls per second, for every worker together.
+        alias : str
+            The cache the counters are kept in; it must be shared by the workers (e.g. Redis or Memcached).
+        prefix : str
+            The namespace of the counter keys.
+        """
+
+        self.rate = rate
+        self.alias = alias
+        self.prefix = prefix
+
+    def reserve(self, deadline: float) -> Optional[float]:
+        """
+        Takes a call from the budget of the current second or of the first later second before the deadline. The
+        parameters and result are the ones of `TokenBucket.reserve`.
+        """
+
+        now = time.time()
+        last = now + deadline - time.monotonic()
+        second = int(now)
+        backend = caches[self.alias]
+        while second <= last:
+            key = f"{self.prefix}:{second}"
+            backend.add(key, 0, timeout=int(last - now) + 2)
+            try:
+                count = backend.incr(key)
+            except ValueError:
+                count = 1
+                backend.set(key, count, timeout=int(last - now) + 2)
+            if count <= self.rate:
+                return max(0.0, second - now)
+            second += 1
+        return None
+
+    async def areserve(self, deadline: float) -> Optional[float]:
+        """
+        The async version of `reserve`, counting through the async API of the cache so the event loop is not blocked
+        on its round-trips.
+        """
+
+        now = time.time()
+        last = now + deadline - time.monotonic()
+        second = int(now)
+        backend = caches[self.alias]
+        while second <= last:
+            key = f"{self.prefix}:{second}"
+            await backend.aadd(key, 0, timeout=int(last - now) + 2)
+            try:
+                count = await backend.aincr(key)
+            except ValueError:
+                count = 1
+                await backend.aset(key, count, timeout=int(last - now) + 2)
+            if count <= self.rate:
+                return max(0.0, second - now)
+            second += 1
+        return None
+
+
+class Limiter:
+    """
+    The limits on the calls of a sync client.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, max_wait: float, bucket) -> None:
+        """
+        Parameters:
+        -----------
+        max_in_flight : int
+            The calls running at once.
+        max_queue : int
+            The callers waiting for a call; more are rejected at once.
+        max_wait : float
+            Seconds a caller may wait for its call to start.
+        bucket : TokenBucket or SharedBucket
+            The requests-per-second budget.
+        """
+
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.bucket = bucket
+        self.waiting = 0
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        """
+        Holds a call slot for the duration of the block.
+        Raises:
+        --------
+            UpstreamUnavailable: If too many callers are waiting, or the call cannot start within `max_wait`.
+        """
+
+        deadline = time.monotonic() + self.max_wait
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                service.busy_raise()
+            self.waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.max_wait)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        if not acquired:
+            service.busy_raise()
+        try:
+            delay = self.bucket.reserve(deadline)
+            if delay is None:
+                service.busy_raise()
+            time.sleep(delay)
+            yield
+        finally:
+            self._slots.release()
+
+
+class AsyncLimiter:
+    """
+    The limits on the calls of an async client, for the tasks of its event loop. The parameters are the ones of
+    `Limiter`.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, max_wait: float, bucket) -> None:
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.bucket = bucket
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Holds a call slot for the duration of the block, like `Limiter.slot`.
+        """
+
+        deadline = time.monotonic() + self.max_wait
+        if self.waiting >= self.max_queue:
+            service.busy_raise()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            service.busy_raise()
+        finally:
+            self.waiting -= 1
+        try:
+            delay = await self.bucket.areserve(deadline)
+            if delay is None:
+                service.busy_raise()
+            await asyncio.sleep(delay)
+            yield
+        finally:
+            self._slots.release()
@@ -0,0 +1,27 @@
+"""
+Fills the local rate store with the history from the yearly NBP archive files, without calling the NBP API.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import archive
+
+
+class Command(BaseCommand):
+    help = "Imports NBP archive files (e.g. archiwum_tab_a_2023.csv) into the rate store; re-imports change nothing."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("files", nargs="+", help="The archive files to import.")
+        parser.add_argument("--table", choices=("a", "c"),
+                            help="The NBP table of the files, by default read from each file name.")
+        parser.add_argument("--batch-size", type=int, default=20000,
+                            help="The number of rates inserted per transaction.")
+        parser.add_argument("--encoding", default="cp1250", help="The encoding of the files, by default cp1250.")
+
+    def handle(self, *args, **options) -> None:
+        for path in options["files"]:
+            try:
+                read = archive.import_file(path, options["table"], options["batch_size"], options["encoding"])
+            except (OSError, UnicodeDecodeError, ValueError) as exc:
+                raise CommandError(f"Cannot import {path}: {exc}")
+            self.stdout.write(f"Imported {read} rates from {path}")
@@ -0,0 +1,32 @@
+"""
+Writes the rates of the local rate store to the snapshot file mapped by the workers at startup.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Rate
+from ...tables import TableIndex
+
+
+class Command(BaseCommand):
+    help = "Writes the stored rates to the snapshot file that workers map into memory at startup."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--path", default=getattr(settings, "RATES_SNAPSHOT", None),
+                            help="The snapshot file, by default the RATES_SNAPSHOT setting.")
+
+    def handle(self, *args, **options) -> None:
+        if not options["path"]:
+            raise CommandError("No snapshot path: pass --path or set RATES_SNAPSHOT.")
+        snapshot = TableIndex()
+        rows = Rate.objects.order_by("table", "code", "effective_date").iterator(chunk_size=10000)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == 10000:
+                snapshot.add_stored(batch)
+                batch = []
+        snapshot.add_stored(batch)
+        snapshot.save_snapshot(str(options["path"]))
+        self.stdout.write(f"Wrote {Rate.objects.count()} rates to {options['path']}")
@@ -0,0 +1,48 @@
+"""
+Brings the local rate store up to date with NBP and pre-computes the popular answers, to be run on a schedule after
+every publication.
+"""
+
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import APIException
+
+from ... import sync
+
+
+class Command(BaseCommand):
+    help = "Fetches the NBP tables newer than the stored ones and pre-computes the popular last/N answers."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--tables", default="a,c",
+                            help="The comma-separated NBP tables to sync, by default a,c.")
+        parser.add_argument("--since", type=date.fromisoformat,
+                            help="The first date to fetch on the first sync, in the format yyyy-mm-dd.")
+        parser.add_argument("--last", default=",".join(map(str, sync.options()["LAST"])),
+                            help="The comma-separated numbers of last quotations to pre-compute.")
+        parser.add_argument("--no-warm", action="store_true",
+                            help="Only sync the store, without pre-computing answers.")
+
+    def handle(self, *args, **options) -> None:
+        if not sync.acquire():
+            self.stdout.write("Another sync is running.")
+            return
+        warm = not options["no_warm"]
+        if warm and not sync.shared_cache():
+            self.stderr.write("The cache backend is local to this process, so answers pre-computed here would not "
+                              "reach the web workers: not pre-computing them. Set RATES_CACHE_BACKEND to file, redis "
+                              "or memcached to warm a cache the workers share.")
+            warm = False
+        try:
+            for table in options["tables"].split(","):
+                fetched = sync.sync_table(table, options["since"], progress=self.stdout.write)
+                self.stdout.write(f"Table {table.upper()}: {fetched} new tables, "
+                                  f"synced through {sync.synced_through(table)}")
+                if warm:
+                    numbers = tuple(int(number) for number in options["last"].split(","))
+                    self.stdout.write(f"Table {table.upper()}: {sync.warm(table, numbers)} answers pre-computed")
+        except APIException as exc:
+            raise CommandError(f"Sync stopped, run again to resume: {exc.detail}")
+        finally:
+            sync.release()
@@ -0,0 +1,42 @@
+"""
+Writes the OpenAPI schema of the API to the file served by the workers.
+"""
+
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from drf_yasg.errors import SwaggerValidationError
+
+from ... import schema
+
+
+class Command(BaseCommand):
+    help = "Generates and validates the OpenAPI schema and writes it to the file that workers serve."
+
+    def add_arguments(self, parser) -> None:
+        parser.add_argument("--path", default=getattr(settings, "RATES_SCHEMA", None),
+                            help="The schema file, by default the RATES_SCHEMA setting.")
+        parser.add_argument("--check", action="store_true",
+                            help="Only check that the file is up to date with the views, failing when it is not.")
+
+    def handle(self, *args, **options) -> None:
+        if not options["path"]:
+            raise CommandError("No schema path: pass --path or set RATES_SCHEMA.")
+        try:
+            content = schema.generate()
+        except SwaggerValidationError as exc:
+            raise CommandError(str(exc)) from exc
+        if options["check"]:
+            try:
+                with open(options["path"], "rb") as file:
+                    current = file.read()
+            except FileNotFoundError:
+                current = None
+            if current != content:
+                raise CommandError(f"{options['path']} is out of date: run manage.py write_schema")
+            self.stdout.write(f"{options['path']} is up to date")
+            return
+        with open(options["path"], "wb") as file:
+            file.write(content)
+        self.stdout.write(f"Wrote the schema of {len(json.loads(content)['paths'])} paths to {options['path']}")
@@ -0,0 +1,506 @@
+"""
+Metrics of the service in the Prometheus text format.
+Handled requests, NBP calls, JSON decoding, cache lookups and errors are recorded into in-process counters and
+histograms, at the cost of a lock and a bisect each, and exposed on `/metrics`. The time of a request is split into
+waiting on NBP, decoding its JSON and the rest (compute and rendering), counting the calls made on the request's own
+thread or task.
+Every worker process records its own metrics. With `RATES_METRICS['DIRECTORY']` set, each worker also writes them to
+its file in that directory every `FLUSH_INTERVAL` seconds, and `/metrics` exports the sum of its own metrics, the
+files of the other workers and the totals of the workers that exited, so any worker answers a scrape with the metrics
+of the whole server and counters never go back. The gunicorn hooks flush a worker on exit and fold its file into the
+totals (`fold`), and empty the directory when the server starts.
+"""
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+from rest_framework import views
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULTS = {
+    "DIRECTORY": "",
+    "FLUSH_INTERVAL": 1.0,
+}
+
+WORKER_FILE = re.compile(r"worker-(\d+)\.json")
+
+EXITED_FILE = "exited.json"
+
+
+def options() -> dict:
+    return {**DEFAULTS, **getattr(settings, "RATES_METRICS", {})}
+
+
+class Counter:
+    """
+    A counter by label values.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, labels: tuple) -> None:
+        """
+        Parameters:
+        -----------
+        name : str
+            The metric name.
+        description : str
+            The help text of the metric.
+        labels : tuple
+            The label names, whose values are passed in this order when recording.
+        """
+
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values: dict = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *values: str, amount: float = 1.0) -> None:
+        """
+        Adds `amount` to the counter of the label `values`.
+        """
+
+        with self._lock:
+            self._values[values] = self._values.get(values, 0.0) + amount
+
+    def value(self, *values: str) -> float:
+        """
+        Returns the counter of the label `values`.
+        """
+
+        return self._values.get(values, 0.0)
+
+    def state(self) -> list:
+        """
+        Returns the counters as JSON, a `[labels, value]` pair per label values.
+        """
+
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+    @staticmethod
+    def merge(into: dict, state: list) -> None:
+        """
+        Adds the counters of a `state` to the counters `into`, by label values.
+        """
+
+        for labels, value in state:
+            labels = tuple(labels)
+            into[labels] = into.get(labels, 0.0) + value
+
+    def samples(self, values: Optional[dict] = None) -> Iterator[str]:
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        for labels, value in values.items():
+            yield f"{self.name}{_labels(self.labels, labels)} {_number(value)}"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    """
+    A histogram of observed values, e.g. durations in seconds, by label values.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: tuple, buckets: tuple = BUCKETS) -> None:
+        """
+        Parameters:
+        -----------
+        name : str
+            The metric name.
+        description : str
+            The help text of the metric.
+        labels : tuple
+            The label names, whose values are passed in this order when recording.
+        buckets : tuple
+            The ascending upper bounds of the buckets; an infinite one is added.
+        """
+
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._values: dict = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *values: str) -> None:
+        """
+        Records `value` in the histogram of the label `values`.
+        """
+
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(values)
+            if counts is None:
+                # One count per bucket and the infinite one, then the sum of the observed values.
+                counts = self._values[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[position] += 1
+            counts[-1] += value
+
+    def count(self, *values: str) -> int:
+        """
+        Returns the number of values observed with the label `values`.
+        """
+
+        counts = self._values.get(values)
+        return sum(counts[:-1]) if counts is not None else 0
+
+    def state(self) -> list:
+        """
+        Returns the histograms as JSON, a `[labels, counts]` pair per label values.
+        """
+
+        with self._lock:
+            return [[list(labels), list(counts)] for labels, counts in self._values.items()]
+
+    @staticmethod
+    def merge(into: dict, state: list) -> None:
+        """
+        Adds the histograms of a `state` to the histograms `into`, by label values.
+        """
+
+        for labels, counts in state:
+            labels = tuple(labels)
+            known = into.get(labels)
+            into[labels] = list(counts) if known is None else [a + b for a, b in zip(known, counts)]
+
+    def samples(self, values: Optional[dict] = None) -> Iterator[str]:
+        if values is None:
+            with self._lock:
+                values = {labels: list(counts) for labels, counts in self._values.items()}
+        names = self.labels + ("le",)
+        for labels, counts in values.items():
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                yield f"{self.name}_bucket{_labels(names, labels + (_number(bound),))} {total}"
+            yield f"{self.name}_sum{_labels(self.labels, labels)} {_number(counts[-1])}"
+            yield f"{self.name}_count{_labels(self.labels, labels)} {total}"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+REGISTRY: list = []
+
+requests = Histogram("rates_request_duration_seconds", "Time spent handling API requests.",
+                     ("view", "method", "status"))
+compute = Histogram("rates_request_compute_seconds",
+                    "Time of API requests spent neither waiting on NBP nor decoding its JSON.", ("view",))
+upstream = Histogram("rates_nbp_request_duration_seconds", "Latency of NBP API calls, retries included.",
+                     ("endpoint", "table", "status"))
+decode = Histogram("rates_nbp_decode_duration_seconds", "Time spent decoding the JSON of NBP answers.",
+                   ("endpoint", "table"))
+cache_lookups = Counter("rates_cache_lookups_total", "Cache lookups by cache and result: local, shared, stale or miss.",
+                        ("cache", "result"))
+errors = Counter("rates_errors_total", "Failed API requests by view and exception type.", ("view", "type"))
+
+# The seconds the current request spent waiting on NBP and decoding its answers.
+_spent: ContextVar[Optional[list]] = ContextVar("rates_metrics_spent", default=None)
+
+
+def render() -> str:
+    """
+    Returns every metric in the Prometheus text exposition format: of this process, or of every worker with a
+    metrics directory.
+    """
+
+    collected = collect() if options()["DIRECTORY"] else {}
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples(collected.get(metric.name)))
+    return "\n".join(lines) + "\n"
+
+
+def collect() -> dict:
+    """
+    Sums the metrics of this process, the last ones written by the other workers to the metrics directory and the
+    totals of the workers that exited.
+    Returns:
+    --------
+    dict
+        The values of every metric by name, then by label values.
+    """
+
+    directory = options()["DIRECTORY"]
+    collected = {metric.name: {} for metric in REGISTRY}
+    by_name = {metric.name: metric for metric in REGISTRY}
+    for metric in REGISTRY:
+        metric.merge(collected[metric.name], metric.state())
+    # The workers are read before the totals: a worker folded in between is then found in the totals and skipped.
+    workers = {}
+    for name in os.listdir(directory):
+        match = WORKER_FILE.fullmatch(name)
+        if match is not None and int(match.group(1)) != os.getpid():
+            state = _read(os.path.join(directory, name))
+            if state is not None:
+                workers[int(match.group(1))] = state
+    exited = _read(os.path.join(directory, EXITED_FILE)) or {"workers": [], "metrics": {}}
+    for pid, state in [(None, exited["metrics"]), *workers.items()]:
+        if pid in exited["workers"]:
+            continue
+        for name, values in state.items():
+            if name in by_name:
+                by_name[name].merge(collected[name], values)
+    return collected
+
+
+def flush() -> None:
+    """
+    Writes the metrics of this process to its file in the metrics directory, if any.
+    """
+
+    directory = options()["DIRECTORY"]
+    if directory:
+        _write(os.path.join(directory, f"worker-{os.getpid()}.json"),
+               {metric.name: metric.state() for metric in REGISTRY})
+
+
+def fold(pid: int) -> None:
+    """
+    Adds the last metrics written by an exited worker to the totals of the exited workers and removes its file, so
+    its counts keep being exported. Called by the gunicorn master, the only writer of the totals.
+    """
+
+    directory = options()["DIRECTORY"]
+    if not directory:
+        return
+    path = os.path.join(directory, f"worker-{pid}.json")
+    state = _read(path)
+    exited_path = os.path.join(directory, EXITED_FILE)
+    exited = _read(exited_path) or {"workers": [], "metrics": {}}
+    if state is not None and pid not in exited["workers"]:
+        for metric in REGISTRY:
+            totals = {}
+            metric.merge(totals, exited["metrics"].get(metric.name, []))
+            metric.merge(totals, state.get(metric.name, []))
+            exited["metrics"][metric.name] = [[list(labels), value] for labels, value in totals.items()]
+        exited["workers"].append(pid)
+        _write(exited_path, exited)
+    if state is not None:
+        os.remove(path)
+
+
+def clear_directory() -> None:
+    """
+    Removes the files of the metrics directory, when the server starts.
+    """
+
+    directory = options()["DIRECTORY"]
+    if not directory:
+        return
+    for name in os.listdir(directory):
+        if name == EXITED_FILE or WORKER_FILE.fullmatch(name):
+            os.remove(os.path.join(directory, name))
+
+
+_flusher_pid: Optional[int] = None
+_flusher_lock = threading.Lock()
+
+
+def _start_flushing() -> None:
+    """
+    Starts the thread writing the metrics of this process every `FLUSH_INTERVAL` seconds, once per process.
+    """
+
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        config = options()
+        if config["DIRECTORY"]:
+            threading.Thread(target=_flush_every, args=(config["FLUSH_INTERVAL"],), name="metrics-flush",
+                             daemon=True).start()
+        _flusher_pid = os.getpid()
+
+
+def _flush_every(interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def clear() -> None:
+    """
+    Resets every metric.
+    """
+
+    for metric in REGISTRY:
+        metric.clear()
+
+
+def export(request: HttpRequest) -> HttpResponse:
+    """
+    Serves the metrics of the worker, or of every worker with a metrics directory, to Prometheus.
+    """
+
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
+
+
+def observe_upstream(path: str, latency: float, status: Optional[int]) -> None:
+    """
+    Records an NBP call; registered as a latency listener of the NBP clients.
+    """
+
+    endpoint, table = endpoint_of(path)
+    upstream.observe(latency, endpoint, table, "error" if status is None else str(status))
+    spent = _spent.get()
+    if spent is not None:
+        spent[0] += latency
+
+
+@contextmanager
+def decoding(path: str):
+    """
+    Times the decoding of the NBP answer to `path` in the block.
+    """
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        decode.observe(elapsed, *endpoint_of(path))
+        spent = _spent.get()
+        if spent is not None:
+            spent[1] += elapsed
+
+
+def endpoint_of(path: str) -> tuple:
+    """
+    Returns the endpoint and table labels of an NBP API path, e.g. `("tables/range", "a")` for
+    `tables/a/2023-01-02/2023-03-31/`.
+    """
+
+    parts = path.strip("/").split("/")
+    if len(parts) < 2:
+        return parts[0], ""
+    rest = parts[3:] if parts[0] == "rates" else parts[2:]
+    if rest and rest[0] in ("last", "today"):
+        kind = rest[0]
+    else:
+        kind = {0: "current", 1: "date"}.get(len(rest), "range")
+    return f"{parts[0]}/{kind}", parts[1].lower()
+
+
+def exception_handler(exc: Exception, context: dict) -> Optional[HttpResponse]:
+    """
+    DRF's exception handler, counting the failed request by exception type.
+    """
+
+    errors.inc(view_of(context.get("request")), type(exc).__name__)
+    return views.exception_handler(exc, context)
+
+
+class MetricsMiddleware:
+    """
+    Times every request, split into waiting on NBP, decoding its answers and the rest.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response) -> None:
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _spent.set([0.0, 0.0])
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            self._record(request, response, time.perf_counter() - started)
+        finally:
+            _spent.reset(token)
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        token = _spent.set([0.0, 0.0])
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            self._record(request, response, time.perf_counter() - started)
+        finally:
+            _spent.reset(token)
+        return response
+
+    @staticmethod
+    def _record(request: HttpRequest, response: HttpResponse, elapsed: float) -> None:
+        _start_flushing()
+        view = view_of(request)
+        requests.observe(elapsed, view, request.method, str(response.status_code))
+        waiting, decoded = _spent.get()
+        compute.observe(max(0.0, elapsed - waiting - decoded), view)
+
+
+def view_of(request) -> str:
+    """
+    Returns the namespaced URL name of the view that handled `request`, or `unmatched`.
+    """
+
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match is not None else "unmatched"
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+def _read(path: str) -> Optional[dict]:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _write(path: str, data: dict) -> None:
+    with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), delete=False) as file:
+        json.dump(data, file)
+    os.replace(file.name, path)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
@@ -0,0 +1,31 @@
+# Generated by Django 4.2 on 2026-10-18 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=1)),
+                ('code', models.CharField(max_length=3)),
+                ('effective_date', models.DateField()),
+                ('no', models.CharField(max_length=20)),
+                ('mid', models.FloatField(null=True)),
+                ('bid', models.FloatField(null=True)),
+                ('ask', models.FloatField(null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='rate',
+            constraint=models.UniqueConstraint(fields=('table', 'code', 'effective_date'), name='unique_rate'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+"""
+Models for the locally stored NBP rate history.
+"""
+
+from django.db import models
+
+
+class Rate(models.Model):
+    """
+    One currency quotation from an NBP table: the mid rate for table A, the bid and ask rates for table C.
+    """
+
+    table = models.CharField(max_length=1)
+    code = models.CharField(max_length=3)
+    effective_date = models.DateField()
+    no = models.CharField(max_length=20)
+    mid = models.FloatField(null=True)
+    bid = models.FloatField(null=True)
+    ask = models.FloatField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["table", "code", "effective_date"], name="unique_rate"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.no} {self.code} {self.effective_date}"
+
+    @classmethod
+    def from_nbp(cls, table: str, code: str, rate: dict) -> "Rate":
+        """
+        Builds an unsaved rate from one element of the `rates` list of an NBP response.
+        """
+
+        return cls(table=table.upper(),
+                   code=code.upper(),
+                   effective_date=rate["effectiveDate"],
+                   no=rate["no"],
+                   mid=rate.get("mid"),
+                   bid=rate.get("bid"),
+                   ask=rate.get("ask"))
+
+    def to_nbp(self) -> dict:
+        """
+        Returns the rate in the shape of one element of the `rates` list of an NBP response.
+        """
+
+        data = {"no": self.no, "effectiveDate": self.effective_date.isoformat()}
+        if self.table == "C":
+            data.update(bid=self.bid, ask=self.ask)
+        else:
+            data["mid"] = self.mid
+        return data
+
+    @property
+    def sequence(self) -> tuple:
+        """
+        The (year, number) of the NBP table this rate was published in, e.g. (2023, 77) for `077/A/NBP/2023`.
+        """
+
+        number, _, _, year = self.no.split("/")
+        return int(year), int(number)
+
+
+class SyncState(models.Model):
+    """
+    How far the rate store of an NBP table is complete, advanced by `manage.py sync_rates` after every stored window.
+    """
+
+    table = models.CharField(max_length=1, unique=True)
+    synced_through = models.DateField()
+
+    def __str__(self) -> str:
+        return f"{self.table} {self.synced_through}"
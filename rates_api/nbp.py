@@ -0,0 +1,395 @@
+"""
+HTTP clients for the NBP Web API.
+Every upstream call goes through one pooled keep-alive connection pool per process (per event loop for the async
+client), with connect and read timeouts and a bounded retry with backoff for transient failures. The clients of a
+process share one circuit breaker, so calls fail fast while NBP is down, and one requests-per-second budget, and
+each client bounds its calls in flight.
+"""
+
+import asyncio
+import json
+import os
+import time
+import weakref
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Optional
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from django.conf import settings
+
+from . import cache, metrics, service
+from .breaker import CircuitBreaker
+from .limiter import AsyncLimiter, Limiter, SharedBucket, TokenBucket
+
+DEFAULTS = {
+    "BASE_URL": "http://api.nbp.pl/api/exchangerates/",
+    "POOL_SIZE": 10,
+    "ASYNC_POOL_SIZE": 100,
+    "CONNECT_TIMEOUT": 3.05,
+    "READ_TIMEOUT": 10,
+    "RETRIES": 2,
+    "BACKOFF_FACTOR": 0.3,
+    "BREAKER_FAILURES": 5,
+    "BREAKER_RESET": 30,
+    "BREAKER_TRIAL_TIMEOUT": 60,
+    "MAX_IN_FLIGHT": 10,
+    "ASYNC_MAX_IN_FLIGHT": 100,
+    "MAX_QUEUE": 100,
+    "MAX_WAIT": 2,
+    "RATE": 20,
+    "BURST": 20,
+    "SHARED_RATE": False,
+}
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+LatencyListener = Callable[[str, float, Optional[int]], None]
+
+
+class NBPClient:
+    """
+    A thin client over a pooled `requests.Session` that talks to the NBP exchange rates API.
+    """
+
+    def __init__(self, base_url: str, pool_size: int, connect_timeout: float, read_timeout: float,
+                 retries: int, backoff_factor: float, breaker: Optional[CircuitBreaker] = None,
+                 limiter: Optional[Limiter] = None) -> None:
+        """
+        Builds the pooled session.
+        Parameters:
+        -----------
+        base_url : str
+            The root of the NBP exchange rates API, ending with a slash.
+        pool_size : int
+            The number of keep-alive connections kept per host.
+        connect_timeout : float
+            Seconds to wait for the TCP connection to be established.
+        read_timeout : float
+            Seconds to wait between bytes of the response.
+        retries : int
+            How many times a failed connection or a transient 5xx/429 response is retried.
+        backoff_factor : float
+            The exponential backoff factor between retries.
+        breaker : CircuitBreaker, optional
+            The circuit breaker the calls go through.
+        limiter : Limiter, optional
+            The limits the calls wait on, retries included.
+        """
+
+        self.base_url = base_url
+        self.breaker = breaker
+        self.limiter = limiter
+        self.timeout = (connect_timeout, read_timeout)
+        self.listeners: list[LatencyListener] = []
+        self.session = requests.Session()
+        retry = Retry(total=retries,
+                      connect=retries,
+                      read=retries,
+                      status=retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=RETRY_STATUSES,
+                      allowed_methods=frozenset(["GET"]),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def add_listener(self, listener: LatencyListener) -> None:
+        """
+        Registers a callable that is told the path, latency in seconds and status code (None on a network
+        failure) of every upstream call.
+        """
+
+        self.listeners.append(listener)
+
+    def get(self, path: str) -> requests.Response:
+        """
+        Performs a GET request against the NBP API.
+        Parameters:
+        -----------
+        path : str
+            The path relative to the API root, e.g. `rates/a/gbp/2023-01-02/`.
+        Returns:
+        --------
+        requests.Response
+            The upstream response, with the wall-clock time of the call stored in its `latency` attribute.
+        Raises:
+        --------
+            UpstreamUnavailable: If NBP could not be reached within the timeouts and retries, the circuit breaker is
+            open, or the limits left no room for the call in time.
+        """
+
+        with self.limiter.slot() if self.limiter is not None else nullcontext(), _guarded(self.breaker):
+            started = time.perf_counter()
+            try:
+                response = self.session.get(self.base_url + path, params={"format": "json"}, timeout=self.timeout)
+            except requests.RequestException as exc:
+                self._notify(path, time.perf_counter() - started, None)
+                _record(self.breaker, None)
+                service.unavailable_raise(exc)
+            response.latency = time.perf_counter() - started
+            self._notify(path, response.latency, response.status_code)
+            _record(self.breaker, response.status_code)
+        return response
+
+    def _notify(self, path: str, latency: float, status: Optional[int]) -> None:
+        for listener in self.listeners:
+            listener(path, latency, status)
+
+
+class AsyncResponse:
+    """
+    The fully read response of an `AsyncNBPClient` call, exposing the parts of `requests.Response` the views use.
+    """
+
+    def __init__(self, status_code: int, content: bytes) -> None:
+        self.status_code = status_code
+        self.content = content
+        self.ok = status_code < 400
+        self.latency = 0.0
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncNBPClient:
+    """
+    The non-blocking counterpart of `NBPClient`, over a pooled `aiohttp.ClientSession`.
+    """
+
+    def __init__(self, base_url: str, pool_size: int, connect_timeout: float, read_timeout: float,
+                 retries: int, backoff_factor: float, breaker: Optional[CircuitBreaker] = None,
+                 limiter: Optional[AsyncLimiter] = None) -> None:
+        """
+        Builds the pooled session. The parameters are the ones of `NBPClient`, with an `AsyncLimiter`.
+        """
+
+        self.base_url = base_url
+        self.breaker = breaker
+        self.limiter = limiter
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.listeners: list[LatencyListener] = []
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size),
+            timeout=aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout))
+
+    def add_listener(self, listener: LatencyListener) -> None:
+        """
+        Registers a callable that is told the path, latency in seconds and status code (None on a network
+        failure) of every upstream call.
+        """
+
+        self.listeners.append(listener)
+
+    async def get(self, path: str) -> AsyncResponse:
+        """
+        Performs a GET request against the NBP API without blocking the event loop.
+        Parameters:
+        -----------
+        path : str
+            The path relative to the API root, e.g. `tables/a/2023-01-02/`.
+        Returns:
+        --------
+        AsyncResponse
+            The upstream response, with the wall-clock time of the call stored in its `latency` attribute.
+        Raises:
+        --------
+            UpstreamUnavailable: If NBP could not be reached within the timeouts and retries, the circuit breaker is
+            open, or the limits left no room for the call in time.
+        """
+
+        async with self.limiter.slot() if self.limiter is not None else nullcontext():
+            with _guarded(self.breaker):
+                return await self._call(path)
+
+    async def _call(self, path: str) -> AsyncResponse:
+        started = time.perf_counter()
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff_factor * 2 ** (attempt - 1))
+            try:
+                async with self.session.get(self.base_url + path, params={"format": "json"}) as upstream:
+                    response = AsyncResponse(upstream.status, await upstream.read())
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                if attempt == self.retries:
+                    self._notify(path, time.perf_counter() - started, None)
+                    _record(self.breaker, None)
+                    service.unavailable_raise(exc)
+                continue
+            if response.status_code not in RETRY_STATUSES:
+                break
+        response.latency = time.perf_counter() - started
+        self._notify(path, response.latency, response.status_code)
+        _record(self.breaker, response.status_code)
+        return response
+
+    def _notify(self, path: str, latency: float, status: Optional[int]) -> None:
+        for listener in self.listeners:
+            listener(path, latency, status)
+
+
+@contextmanager
+def _guarded(breaker: Optional[CircuitBreaker]):
+    """
+    Asks the breaker for a call once the limits let it through, so a rejected call never takes the trial call, and
+    gives the trial call back when the call ends without being recorded, e.g. when it is cancelled.
+    Raises:
+    --------
+        UpstreamUnavailable: If the breaker is open.
+    """
+
+    if breaker is None:
+        yield
+        return
+    trial = breaker.take()
+    if trial is None:
+        service.circuit_open_raise()
+    try:
+        yield
+    finally:
+        if trial:
+            breaker.release(trial)
+
+
+def _record(breaker: Optional[CircuitBreaker], status: Optional[int]) -> None:
+    """
+    Tells the breaker about a call: a network failure (no status) or a status left failing after retries count
+    against NBP, any other answer (a 404 included) shows it is up.
+    """
+
+    if breaker is None:
+        return
+    if status is None or status in RETRY_STATUSES:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+
+
+_breaker: Optional[CircuitBreaker] = None
+_breaker_pid: Optional[int] = None
+
+
+def get_breaker() -> CircuitBreaker:
+    """
+    Returns the circuit breaker of the current process, building it from the `NBP_CLIENT` setting on first use.
+    """
+
+    global _breaker, _breaker_pid
+    if _breaker is None or _breaker_pid != os.getpid():
+        options = {**DEFAULTS, **getattr(settings, "NBP_CLIENT", {})}
+        _breaker = CircuitBreaker(failures=options["BREAKER_FAILURES"], reset_after=options["BREAKER_RESET"],
+                                  trial_timeout=options["BREAKER_TRIAL_TIMEOUT"])
+        _breaker_pid = os.getpid()
+    return _breaker
+
+
+_bucket = None
+_bucket_pid: Optional[int] = None
+
+
+def get_bucket():
+    """
+    Returns the requests-per-second budget of the current process, building it from the `NBP_CLIENT` setting on
+    first use: a `TokenBucket`, or with `SHARED_RATE` a `SharedBucket` in the cache of the rate lookups, shared by
+    every worker using it.
+    """
+
+    global _bucket, _bucket_pid
+    if _bucket is None or _bucket_pid != os.getpid():
+        options = {**DEFAULTS, **getattr(settings, "NBP_CLIENT", {})}
+        if options["SHARED_RATE"]:
+            _bucket = SharedBucket(rate=options["RATE"], alias=cache._options()["ALIAS"])
+        else:
+            _bucket = TokenBucket(rate=options["RATE"], burst=options["BURST"])
+        _bucket_pid = os.getpid()
+    return _bucket
+
+
+_client: Optional[NBPClient] = None
+_client_pid: Optional[int] = None
+
+
+def get_client() -> NBPClient:
+    """
+    Returns the client of the current process, building it from the `NBP_CLIENT` setting on first use, with its
+    calls recorded in the metrics. A forked worker gets its own client, so pooled sockets are never shared across
+    processes.
+    """
+
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        options = {**DEFAULTS, **getattr(settings, "NBP_CLIENT", {})}
+        _client = NBPClient(base_url=options["BASE_URL"],
+                            pool_size=options["POOL_SIZE"],
+                            connect_timeout=options["CONNECT_TIMEOUT"],
+                            read_timeout=options["READ_TIMEOUT"],
+                            retries=options["RETRIES"],
+                            backoff_factor=options["BACKOFF_FACTOR"],
+                            breaker=get_breaker(),
+                            limiter=Limiter(max_in_flight=options["MAX_IN_FLIGHT"],
+                                            max_queue=options["MAX_QUEUE"],
+                                            max_wait=options["MAX_WAIT"],
+                                            bucket=get_bucket()))
+        _client.add_listener(metrics.observe_upstream)
+        _client_pid = os.getpid()
+    return _client
+
+
+_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def get_async_client() -> AsyncNBPClient:
+    """
+    Returns the async client of the running event loop, building it from the `NBP_CLIENT` setting on first use.
+    Under ASGI the loop lives as long as the process; a loop of a single request must `close_async_client` before
+    it ends.
+    """
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        options = {**DEFAULTS, **getattr(settings, "NBP_CLIENT", {})}
+        client = AsyncNBPClient(base_url=options["BASE_URL"],
+                                pool_size=options["ASYNC_POOL_SIZE"],
+                                connect_timeout=options["CONNECT_TIMEOUT"],
+                                read_timeout=options["READ_TIMEOUT"],
+                                retries=options["RETRIES"],
+                                backoff_factor=options["BACKOFF_FACTOR"],
+                                breaker=get_breaker(),
+                                limiter=AsyncLimiter(max_in_flight=options["ASYNC_MAX_IN_FLIGHT"],
+                                                     max_queue=options["MAX_QUEUE"],
+                                                     max_wait=options["MAX_WAIT"],
+                                                     bucket=get_bucket()))
+        client.add_listener(metrics.observe_upstream)
+        _async_clients[loop] = client
+    return client
+
+
+async def close_async_client() -> None:
+    """
+    Closes the async client of the running event loop, if it was built.
+    """
+
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.session.close()
+
+
+def reset_client() -> None:
+    """
+    Drops the client, the circuit breaker and the requests-per-second budget of the current process, closing its
+    pooled connections.
+    """
+
+    global _client, _client_pid, _breaker, _bucket
+    if _client is not None:
+        _client.session.close()
+    _client = None
+    _client_pid = None
+    _breaker = None
+    _bucket = None
@@ -0,0 +1,270 @@
+"""
+Opt-in profiling of sampled requests in production.
+A share of the requests, and the requests sent with the profiling header set to the configured token, are profiled
+from the outermost middleware, so Django's middleware, DRF's content negotiation and rendering, JSON decoding and the
+upstream calls all show up. Their stacks are either sampled by a background thread at a fixed interval (cheap, and
+dumped as collapsed stacks for flame graphs) or traced with cProfile (exact call counts, dumped as pstats), and are
+aggregated by view. Requests that are not sampled only pay for a random draw and a header lookup; with no sample
+rate and no token the middleware is left out.
+Only sync requests are profiled, as the tasks of an event loop share its thread.
+"""
+
+import cProfile
+import hmac
+import marshal
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import Http404, HttpRequest, HttpResponse
+
+from .metrics import view_of
+
+DEFAULTS = {
+    "SAMPLE_RATE": 0.0,
+    "TOKEN": "",
+    "HEADER": "X-Profile",
+    "MODE": "stacks",
+    "INTERVAL": 0.005,
+    "MAX_STACKS": 10000,
+}
+
+
+def options() -> dict:
+    return {**DEFAULTS, **getattr(settings, "RATES_PROFILER", {})}
+
+
+class StackSampler:
+    """
+    Samples the stacks of the threads handling profiled requests, counting each distinct stack.
+    """
+
+    def __init__(self, interval: float, max_stacks: int) -> None:
+        """
+        Parameters:
+        -----------
+        interval : float
+            Seconds between two samples.
+        max_stacks : int
+            The distinct stacks kept per view; samples of new stacks beyond it are counted under `(other)`.
+        """
+
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.views: dict = {}
+        self._active: dict = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Starts sampling the calling thread.
+        """
+
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def stop(self, view: Optional[str]) -> None:
+        """
+        Stops sampling the calling thread, adding its samples to the stacks of `view`, or dropping them with None.
+        """
+
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), Counter())
+            if view is None:
+                return
+            stacks = self.views.setdefault(view, Counter())
+            for stack, count in samples.items():
+                if stack not in stacks and len(stacks) >= self.max_stacks:
+                    stack = "(other)"
+                stacks[stack] += count
+
+    def collapsed(self, view: Optional[str] = None) -> str:
+        """
+        Returns the sampled stacks in the collapsed format of flame graph tools, one `frame;frame;... count` line per
+        stack, rooted at their view.
+        """
+
+        with self._lock:
+            views = {name: dict(stacks) for name, stacks in self.views.items() if view in (None, name)}
+        return "".join(f"{name};{stack} {count}\n"
+                       for name, stacks in sorted(views.items())
+                       for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
+
+    def clear(self) -> None:
+        with self._lock:
+            self.views.clear()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while True:
+            with self._lock:
+                while not self._active:
+                    self._wake.wait()
+                frames = sys._current_frames()
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None and ident != me:
+                        samples[_stack(frame)] += 1
+            time.sleep(self.interval)
+
+
+class CallProfiles:
+    """
+    The cProfile traces of profiled requests, aggregated by view.
+    """
+
+    def __init__(self) -> None:
+        self.views: dict = {}
+        self._lock = threading.Lock()
+
+    def add(self, view: str, profile: cProfile.Profile) -> None:
+        """
+        Adds the trace of a request to the statistics of `view`.
+        """
+
+        with self._lock:
+            stats = self.views.get(view)
+            if stats is None:
+                self.views[view] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+    def dump(self, view: Optional[str] = None) -> bytes:
+        """
+        Returns the statistics of `view`, or of every view together, in the file format `pstats.Stats` loads.
+        """
+
+        merged = pstats.Stats()
+        with self._lock:
+            for name, stats in self.views.items():
+                if view in (None, name):
+                    merged.add(stats)
+        return marshal.dumps(merged.stats)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.views.clear()
+
+
+sampler: Optional[StackSampler] = None
+calls = CallProfiles()
+
+
+def get_sampler() -> StackSampler:
+    """
+    Returns the stack sampler of the process, building it from the `RATES_PROFILER` setting on first use.
+    """
+
+    global sampler
+    if sampler is None:
+        config = options()
+        sampler = StackSampler(interval=config["INTERVAL"], max_stacks=config["MAX_STACKS"])
+    return sampler
+
+
+class ProfilerMiddleware:
+    """
+    Profiles the sampled and the flagged requests.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response) -> None:
+        config = options()
+        if not config["SAMPLE_RATE"] and not config["TOKEN"]:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sample_rate = config["SAMPLE_RATE"]
+        self.token = config["TOKEN"]
+        self.header = config["HEADER"]
+        self.mode = config["MODE"]
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+        if not self._sampled(request):
+            return self.get_response(request)
+        if self.mode == "pstats":
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profile.disable()
+            if not _exports(request):
+                calls.add(view_of(request), profile)
+            return response
+        stacks = get_sampler()
+        stacks.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            stacks.stop(None if _exports(request) else view_of(request))
+        return response
+
+    def _sampled(self, request: HttpRequest) -> bool:
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        return _carries_token(request, self.token, self.header)
+
+
+def _carries_token(request: HttpRequest, token: str, header: str) -> bool:
+    """
+    Tells whether a token is configured and sent in `header`, compared in constant time so its timing does not
+    leak how much of a guess matches.
+    """
+
+    return bool(token) and hmac.compare_digest(request.headers.get(header, "").encode(), token.encode())
+
+
+def export(request: HttpRequest) -> HttpResponse:
+    """
+    Serves the profiles of the worker to requests carrying the profiling token: collapsed stacks, or pstats with
+    `?format=pstats`, of one `view` or of every view, emptied afterwards with `reset=1`.
+    Raises:
+    --------
+        Http404: If no token is configured or the request does not carry it.
+    """
+
+    config = options()
+    if not _carries_token(request, config["TOKEN"], config["HEADER"]):
+        raise Http404()
+    view = request.GET.get("view")
+    if request.GET.get("format") == "pstats":
+        response = HttpResponse(calls.dump(view), content_type="application/octet-stream")
+        response["Content-Disposition"] = 'attachment; filename="profile.pstats"'
+    else:
+        response = HttpResponse(get_sampler().collapsed(view), content_type="text/plain; charset=utf-8")
+    if request.GET.get("reset"):
+        calls.clear()
+        get_sampler().clear()
+    return response
+
+
+def _exports(request: HttpRequest) -> bool:
+    match = getattr(request, "resolver_match", None)
+    return match is not None and match.func is export
+
+
+def _stack(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
@@ -0,0 +1,143 @@
+"""
+The NBP publication schedule.
+Table A is published on business days around noon and table C around 8:00, both in Warsaw time. Once a table is
+published its rates never change, so the schedule tells how long a `last/N` answer stays valid. The days NBP did
+not publish on (weekends and Polish holidays) are learnt from the ingested tables.
+"""
+
+import threading
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+
+WARSAW = ZoneInfo("Europe/Warsaw")
+
+DEFAULT_TIMES = {
+    "A": "12:15",
+    "B": "12:15",
+    "C": "08:15",
+}
+
+
+def now() -> datetime:
+    """
+    Returns the current moment in Warsaw time.
+    """
+
+    return datetime.now(WARSAW)
+
+
+def publication_time(table: str) -> time:
+    """
+    Returns the time of day by which the given table is published, from the `NBP_PUBLICATION_TIMES` setting.
+    """
+
+    times = {**DEFAULT_TIMES, **getattr(settings, "NBP_PUBLICATION_TIMES", {})}
+    return time.fromisoformat(times[table.upper()])
+
+
+def is_publication_day(day: date) -> bool:
+    """
+    Tells whether NBP publishes tables on the given day.
+    """
+
+    return day.weekday() < 5
+
+
+def latest_publication(table: str, moment: Optional[datetime] = None) -> date:
+    """
+    Returns the effective date of the newest table that should already be published at `moment`.
+    """
+
+    moment = (moment or now()).astimezone(WARSAW)
+    day = moment.date()
+    if moment.time() < publication_time(table):
+        day -= timedelta(days=1)
+    while not is_publication_day(day):
+        day -= timedelta(days=1)
+    return day
+
+
+def next_publication(table: str, moment: Optional[datetime] = None) -> datetime:
+    """
+    Returns the moment at which the next table after `moment` is expected to be published.
+    """
+
+    moment = (moment or now()).astimezone(WARSAW)
+    day = moment.date()
+    if moment.time() >= publication_time(table):
+        day += timedelta(days=1)
+    while not is_publication_day(day):
+        day += timedelta(days=1)
+    return datetime.combine(day, publication_time(table), tzinfo=WARSAW)
+
+
+class Calendar:
+    """
+    The NBP publication days known from ingested tables, per table letter.
+    A day is known as published once its table is ingested, and as not published when it is a weekend, when NBP
+    published a later table in a response that covered it, or when NBP had no table for it although a later one
+    should already be out.
+    """
+
+    def __init__(self) -> None:
+        self._published: dict = {}
+        self._missing: dict = {}
+        self._lock = threading.Lock()
+
+    def add_published(self, table: str, days) -> None:
+        """
+        Records that the tables of `days` were published.
+        """
+
+        with self._lock:
+            self._published.setdefault(table.upper(), set()).update(days)
+
+    def add_span(self, table: str, first: date, last: date) -> None:
+        """
+        Records that every table published from `first` to `last` inclusive is known, so the other days of the span
+        are not publication days.
+        """
+
+        table = table.upper()
+        with self._lock:
+            published = self._published.get(table, set())
+            missing = self._missing.setdefault(table, set())
+            day = first
+            while day <= last:
+                if day not in published:
+                    missing.add(day)
+                day += timedelta(days=1)
+
+    def add_missing(self, table: str, day: date) -> None:
+        """
+        Records that NBP published no table on `day`.
+        """
+
+        with self._lock:
+            self._missing.setdefault(table.upper(), set()).add(day)
+
+    def is_published(self, table: str, day: date) -> bool:
+        """
+        Tells whether the table of `day` is known to be published.
+        """
+
+        return day in self._published.get(table.upper(), ())
+
+    def is_missing(self, table: str, day: date) -> bool:
+        """
+        Tells whether NBP is known to have published no table on `day`.
+        """
+
+        return not is_publication_day(day) or day in self._missing.get(table.upper(), ())
+
+    def clear(self) -> None:
+        """
+        Forgets every known day.
+        """
+
+        with self._lock:
+            self._published.clear()
+            self._missing.clear()
@@ -0,0 +1,233 @@
+"""
+Range-query index over the rate series of each currency.
+The quotations themselves stay in the compact arrays of the table index (`CompactSeries`, possibly mapped from a
+snapshot); this index only adds, per series (the mid rates of a table A currency, the ask - bid spreads of a table C
+currency), the minimum and maximum of every block of `BLOCK` consecutive quotations, in a sparse table: level k holds
+the extremes of every run of 2^k consecutive blocks, so the whole blocks of any window are the combination of two
+overlapping runs, found in constant time, and the at most 2 * (BLOCK - 1) quotations left at its edges are scanned.
+Every level is a numpy array of one float per block, so a series of n quotations costs about n / BLOCK * log2(n /
+BLOCK) floats on top of its arrays. Quotations appended to a series (a new day's table) extend its levels in place on
+its next query, recomputing only the entries that cover the new blocks; a quotation inserted or changed before the
+indexed end rebuilds them, in vectorized linear time.
+"""
+
+import threading
+from datetime import date
+from typing import Optional
+
+import numpy as np
+
+from .series import CompactSeries
+
+BLOCK = 32
+
+
+class SparseTable:
+    """
+    Idempotent range queries (minimum or maximum) over an array of block extremes.
+    """
+
+    def __init__(self, vectorized: np.ufunc) -> None:
+        """
+        Parameters:
+        -----------
+        vectorized : np.ufunc
+            The operation on arrays, `np.minimum` or `np.maximum`.
+        """
+
+        self.vectorized = vectorized
+        self.levels: list = []
+        self._buffers: list = []
+
+    def build(self, values: np.ndarray) -> None:
+        """
+        Rebuilds every level from `values`.
+        """
+
+        levels = [values]
+        half = 1
+        while 2 * half <= len(values):
+            previous = levels[-1]
+            levels.append(self.vectorized(previous[:-half], previous[half:]))
+            half *= 2
+        self.levels = levels
+        self._buffers = list(levels)
+
+    def extend(self, values: np.ndarray, first: int) -> None:
+        """
+        Replaces the values from position `first` on, at most the current length, by `values`, recomputing only
+        the entries of each level that cover them. Levels grow in buffers of doubling capacity.
+        """
+
+        length = first + len(values)
+        self._grown(0, length)[first:] = values
+        span = 2
+        while span <= length:
+            level = span.bit_length() - 1
+            previous = self.levels[level - 1]
+            start = max(0, first - span + 1)
+            size = length - span + 1
+            half = span // 2
+            self._grown(level, size)[start:] = self.vectorized(previous[start:size], previous[start + half:size + half])
+            span *= 2
+
+    def _grown(self, level: int, size: int) -> np.ndarray:
+        """
+        Resizes a level to `size` entries, keeping the ones it has, and returns it.
+        """
+
+        if level == len(self._buffers):
+            self._buffers.append(np.empty(size))
+            self.levels.append(self._buffers[level][:0])
+        buffer = self._buffers[level]
+        if len(buffer) < size:
+            buffer = np.empty(max(size, 2 * len(buffer)))
+            kept = self.levels[level]
+            buffer[:len(kept)] = kept
+            self._buffers[level] = buffer
+        self.levels[level] = buffer[:size]
+        return self.levels[level]
+
+    def query(self, first: int, last: int) -> float:
+        """
+        Returns the extreme of the values at positions `first` to `last` inclusive.
+        """
+
+        level = (last - first + 1).bit_length() - 1
+        values = self.levels[level]
+        return self.vectorized(values[first], values[last - (1 << level) + 1])
+
+
+class Series:
+    """
+    The block extremes of one field of a `CompactSeries`.
+    """
+
+    def __init__(self, source: CompactSeries, field: str) -> None:
+        """
+        Parameters:
+        -----------
+        source : CompactSeries
+            The quotations, read in place.
+        field : str
+            `mid`, or `spread` for the difference between the ask and bid of a table C series.
+        """
+
+        self.source = source
+        self.field = field
+        self.minimum = SparseTable(np.minimum)
+        self.maximum = SparseTable(np.maximum)
+        self.indexed = 0
+        self.stale = True
+
+    def changed(self, position: int) -> None:
+        """
+        Notes a quotation written at `position` of the source: past the indexed ones it is picked up by extending
+        the levels, otherwise they are rebuilt.
+        """
+
+        if position < self.indexed:
+            self.stale = True
+
+    def extremes(self, first: date, last: date) -> Optional[tuple]:
+        """
+        Returns `(count, minimum, maximum)` of the quotations from `first` to `last` inclusive, or None when there
+        are none.
+        """
+
+        if self.stale:
+            self._rebuild()
+        elif len(self.source) > self.indexed:
+            self._extend()
+        days = np.frombuffer(self.source.days, dtype=np.int32)
+        start = int(np.searchsorted(days, first.toordinal(), side="left"))
+        end = int(np.searchsorted(days, last.toordinal(), side="right"))
+        if start >= end:
+            return None
+        first_block, end_block = -(-start // BLOCK), end // BLOCK
+        if first_block >= end_block:
+            window = self._values(start, end)
+            return end - start, float(window.min()), float(window.max())
+        minimum = self.minimum.query(first_block, end_block - 1)
+        maximum = self.maximum.query(first_block, end_block - 1)
+        edges = np.concatenate((self._values(start, first_block * BLOCK), self._values(end_block * BLOCK, end)))
+        if len(edges):
+            minimum, maximum = min(minimum, edges.min()), max(maximum, edges.max())
+        return end - start, float(minimum), float(maximum)
+
+    def _values(self, start: int, end: int) -> np.ndarray:
+        values = self.source.values
+        if self.field == "mid":
+            return np.frombuffer(values["mid"], dtype=np.float64)[start:end]
+        return (np.frombuffer(values["ask"], dtype=np.float64)[start:end]
+                - np.frombuffer(values["bid"], dtype=np.float64)[start:end])
+
+    def _rebuild(self) -> None:
+        values = self._values(0, len(self.source))
+        starts = np.arange(0, len(values), BLOCK)
+        if len(values):
+            self.minimum.build(np.minimum.reduceat(values, starts))
+            self.maximum.build(np.maximum.reduceat(values, starts))
+        else:
+            self.minimum.build(values)
+            self.maximum.build(values)
+        self.indexed = len(values)
+        self.stale = False
+
+    def _extend(self) -> None:
+        first_block = self.indexed // BLOCK
+        values = self._values(first_block * BLOCK, len(self.source))
+        starts = np.arange(0, len(values), BLOCK)
+        self.minimum.extend(np.minimum.reduceat(values, starts), first_block)
+        self.maximum.extend(np.maximum.reduceat(values, starts), first_block)
+        self.indexed = len(self.source)
+
+
+class RangeIndex:
+    """
+    The series of every currency, by table letter, currency code and field (`mid` or `spread`).
+    """
+
+    def __init__(self, lock: Optional[threading.RLock] = None) -> None:
+        """
+        Parameters:
+        -----------
+        lock : threading.RLock, optional
+            The lock of the owner of the compact series, held while they are changed, so no query reads them then.
+        """
+
+        self._series: dict = {}
+        self._lock = lock if lock is not None else threading.RLock()
+
+    def track(self, table: str, code: str, source: CompactSeries, position: Optional[int] = None) -> None:
+        """
+        Indexes a compact series of a currency, or notes the `position` of a quotation written to it (see
+        `CompactSeries.put`).
+        """
+
+        field = "mid" if "mid" in source.fields else "spread"
+        key = (table.upper(), code.upper(), field)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None or series.source is not source:
+                self._series[key] = Series(source, field)
+            elif position is not None:
+                series.changed(position)
+
+    def extremes(self, table: str, code: str, field: str, first: date, last: date) -> Optional[tuple]:
+        """
+        Returns `(count, minimum, maximum)` of a series from `first` to `last` inclusive, or None when nothing of it
+        is indexed in the window.
+        """
+
+        with self._lock:
+            series = self._series.get((table.upper(), code.upper(), field))
+            return series.extremes(first, last) if series is not None else None
+
+    def clear(self) -> None:
+        """
+        Forgets every series.
+        """
+
+        with self._lock:
+            self._series.clear()
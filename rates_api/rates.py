@@ -0,0 +1,511 @@
+"""
+Rate lookups shared by the views.
+Each lookup is answered from the response cache, then from the in-process table index and the local rate store, and
+only goes to the NBP API for tables that were not ingested yet. NBP is asked for whole tables, so one upstream call
+serves the lookups of every currency on the same dates. Expired `last/N` answers are served stale while NBP is
+unreachable or already being asked for them.
+"""
+
+import re
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Iterator
+
+from rest_framework.exceptions import NotFound
+
+from . import cache, nbp, publication, service, stats, tables
+from .models import Rate
+from .revalidate import Revalidator, Stale
+
+FIELDS = {"A": "mid", "C": "spread"}
+
+CODE = re.compile(r"[A-Za-z]{3}")
+
+DAY = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# NBP never goes longer than this without publishing a table, holidays included.
+LOOKBACK_DAYS = 14
+
+revalidations = Revalidator()
+
+
+def rate_on_date(table: str, code: str, day: str) -> dict:
+    """
+    Returns the rate of a currency on a given date.
+    Parameters:
+    -----------
+    table : str
+        The NBP table letter, `a` or `c`.
+    code : str
+        The currency code.
+    day : str
+        The date in the format yyyy-mm-dd.
+    Returns:
+    --------
+    dict
+        The rate in the shape of one element of the `rates` list of an NBP response.
+    Raises:
+    --------
+        NotFound: If NBP has no rate for the currency and date.
+    """
+
+    key = (table.upper(), code.upper(), day)
+    rate = cache.rates.get(key)
+    if rate is None:
+        effective_date = parse_date(day)
+        if effective_date is None:
+            service.no_data_raise()
+        if _known_missing(table, code, effective_date):
+            service.no_data_raise()
+        rate = tables.index.rate(table, code, effective_date)
+        if rate is None and not tables.index.has_table(table, effective_date):
+            stored = _stored(table, code).filter(effective_date=effective_date).first()
+            rate = stored.to_nbp() if stored is not None else None
+            if rate is None:
+                with _learning_missing(table, effective_date):
+                    tables.ingest(table, f"{effective_date.isoformat()}/")
+                rate = tables.index.rate(table, code, effective_date)
+        if rate is None:
+            service.no_data_raise()
+        cache.rates.set(key, rate, size=_size(1))
+    return rate
+
+
+async def arate_on_date(table: str, code: str, day: str) -> dict:
+    """
+    The async version of `rate_on_date`.
+    """
+
+    key = (table.upper(), code.upper(), day)
+    rate = await cache.rates.aget(key)
+    if rate is None:
+        effective_date = parse_date(day)
+        if effective_date is None:
+            service.no_data_raise()
+        if _known_missing(table, code, effective_date):
+            service.no_data_raise()
+        rate = tables.index.rate(table, code, effective_date)
+        if rate is None and not tables.index.has_table(table, effective_date):
+            stored = await _stored(table, code).filter(effective_date=effective_date).afirst()
+            rate = stored.to_nbp() if stored is not None else None
+            if rate is None:
+                with _learning_missing(table, effective_date):
+                    await tables.aingest(table, f"{effective_date.isoformat()}/")
+                rate = tables.index.rate(table, code, effective_date)
+        if rate is None:
+            service.no_data_raise()
+        await cache.rates.aset(key, rate, size=_size(1))
+    return rate
+
+
+def previous_rate(table: str, code: str, day: str) -> dict:
+    """
+    Returns the rate of a currency on a given date or, when NBP published none that day (a weekend or a holiday),
+    its rate from the nearest previous publication day.
+    Parameters:
+    -----------
+    table : str
+        The NBP table letter, `a` or `c`.
+    code : str
+        The currency code.
+    day : str
+        The date in the format yyyy-mm-dd.
+    Returns:
+    --------
+    dict
+        The rate in the shape of one element of the `rates` list of an NBP response, with its own effective date.
+    Raises:
+    --------
+        NotFound: If NBP has no rate for the currency on the date or in the days before it.
+    """
+
+    try:
+        return rate_on_date(table, code, day)
+    except NotFound:
+        effective_date = parse_date(day)
+        if effective_date is None or not CODE.fullmatch(code):
+            raise
+    key = (table.upper(), code.upper(), "previous", day)
+    rate = cache.rates.get(key)
+    if rate is None:
+        first = effective_date - timedelta(days=LOOKBACK_DAYS)
+        tables.ingest_range(table, first, effective_date)
+        earlier = tables.index.rates_between(table, code, first, effective_date)
+        if not earlier:
+            service.no_data_raise()
+        rate = earlier[-1]
+        cache.rates.set(key, rate, size=_size(1))
+    return rate
+
+
+async def aprevious_rate(table: str, code: str, day: str) -> dict:
+    """
+    The async version of `previous_rate`, fetching the days before the date in one range query.
+    """
+
+    try:
+        return await arate_on_date(table, code, day)
+    except NotFound:
+        effective_date = parse_date(day)
+        if effective_date is None or not CODE.fullmatch(code):
+            raise
+    key = (table.upper(), code.upper(), "previous", day)
+    rate = await cache.rates.aget(key)
+    if rate is None:
+        first = effective_date - timedelta(days=LOOKBACK_DAYS)
+        last = min(effective_date, publication.latest_publication(table))
+        if first <= last:
+            await tables.aingest(table, f"{first.isoformat()}/{last.isoformat()}/")
+        earlier = tables.index.rates_between(table, code, first, effective_date)
+        if not earlier:
+            service.no_data_raise()
+        rate = earlier[-1]
+        await cache.rates.aset(key, rate, size=_size(1))
+    return rate
+
+
+def last_rates(table: str, code: str, number: int) -> list:
+    """
+    Returns the last `number` rates of a currency.
+    Parameters:
+    -----------
+    table : str
+        The NBP table letter, `a` or `c`.
+    code : str
+        The currency code.
+    number : int
+        The number of quotations to retrieve.
+    Returns:
+    --------
+    list
+        The rates in ascending date order, in the shape of the `rates` list of an NBP response. A `Stale` list of
+        the last known good rates when they expired and NBP cannot be asked right now: the circuit breaker is open,
+        another request is refreshing them, or the refresh failed.
+    Raises:
+    --------
+        NotFound: If NBP has no rates for the currency.
+        UpstreamUnavailable: If NBP could not be reached and no stale rates are kept.
+    """
+
+    key = (table.upper(), code.upper(), "last", number)
+    rates = cache.rates.get(key)
+    if rates is not None:
+        return rates
+    stale = cache.rates.get(key, stale=True)
+    if stale is None:
+        return _fetch_last_rates(table, code, number)
+    if nbp.get_breaker().is_open() or not revalidations.claim(key):
+        revalidations.in_background(key, lambda: _fetch_last_rates(table, code, number))
+        return Stale(stale)
+    try:
+        return _fetch_last_rates(table, code, number)
+    except service.UpstreamUnavailable:
+        return Stale(stale)
+    finally:
+        revalidations.release(key)
+
+
+async def alast_rates(table: str, code: str, number: int) -> list:
+    """
+    The async version of `last_rates`. Stale rates are refreshed by a background thread.
+    """
+
+    key = (table.upper(), code.upper(), "last", number)
+    rates = await cache.rates.aget(key)
+    if rates is not None:
+        return rates
+    stale = await cache.rates.aget(key, stale=True)
+    if stale is None:
+        return await _afetch_last_rates(table, code, number)
+    if nbp.get_breaker().is_open() or not revalidations.claim(key):
+        revalidations.in_background(key, lambda: _fetch_last_rates(table, code, number))
+        return Stale(stale)
+    try:
+        return await _afetch_last_rates(table, code, number)
+    except service.UpstreamUnavailable:
+        return Stale(stale)
+    finally:
+        revalidations.release(key)
+
+
+def last_extremes(table: str, code: str, number: int) -> tuple:
+    """
+    Returns the minimum and maximum over the last `number` quotations of a currency: of its mid rates in table A,
+    of its ask - bid spreads in table C.
+    Parameters:
+    -----------
+    table : str
+        The NBP table letter, `a` or `c`.
+    code : str
+        The currency code.
+    number : int
+        The number of quotations.
+    Returns:
+    --------
+    tuple
+        `(minimum, maximum)`, answered by the range index of the table index.
+    Raises:
+    --------
+        NotFound: If NBP has no rates for the currency.
+    """
+
+    return extremes_of(table, code, last_rates(table, code, number))
+
+
+async def alast_extremes(table: str, code: str, number: int) -> tuple:
+    """
+    The async version of `last_extremes`.
+    """
+
+    return extremes_of(table, code, await alast_rates(table, code, number))
+
+
+def extremes_between(table: str, code: str, start: str, end: str) -> tuple:
+    """
+    Returns the minimum and maximum of the series of a currency (see `last_extremes`) over a date range of any
+    length.
+    Parameters:
+    -----------
+    table : str
+        The NBP table letter, `a` or `c`.
+    code : str
+        The currency code.
+    start : str
+        The first date of the range in the format yyyy-mm-dd.
+    end : str
+        The last date of the range in the format yyyy-mm-dd.
+    Returns:
+    --------
+    tuple
+        `(minimum, maximum)`.
+    Raises:
+    --------
+        BadRequest: If the range is malformed.
+        NotFound: If NBP has no rates for the currency in the range.
+    """
+
+    first, last = parse_range(start, end)
+    if not CODE.fullmatch(code):
+        service.no_data_raise()
+    tables.ingest_range(table, first, last)
+    found = tables.index.ranges.extremes(table, code, FIELDS[table.upper()], first, last)
+    if found is None:
+        service.no_data_raise()
+    return found[1], found[2]
+
+
+def rates_between(table: str, code: str, start: str, end: str) -> list:
+    """
+    Returns the rates of a currency over a date range of any length.
+    The range is fetched from NBP as whole tables, in windows of the size NBP accepts, concurrently.
+    Parameters:
+    -----------
+    table : str
+        The NBP table letter, `a` or `c`.
+    code : str
+        The currency code.
+    start : str
+        The first date of the range in the format yyyy-mm-dd.
+    end : str
+        The last date of the range in the format yyyy-mm-dd.
+    Returns:
+    --------
+    list
+        The rates in ascending date order, in the shape of the `rates` list of an NBP response.
+    Raises:
+    --------
+        ValidationError: If the range is malformed.
+        NotFound: If NBP has no rates for the currency in the range.
+    """
+
+    first, last = parse_range(start, end)
+    if not CODE.fullmatch(code):
+        service.no_data_raise()
+    key = (table.upper(), code.upper(), "range", first, last)
+    rates = cache.rates.get(key)
+    if rates is None:
+        tables.ingest_range(table, first, last)
+        rates = tables.index.rates_between(table, code, first, last)
+        if not rates:
+            service.no_data_raise()
+        if last < publication.latest_publication(table):
+            cache.rates.set(key, rates, size=_size(len(rates)))
+        else:
+            newest = date.fromisoformat(rates[-1]["effectiveDate"])
+            cache.rates.set(key, rates, size=_size(len(rates)), expires_at=cache.last_expiry(table, newest))
+    return rates
+
+
+def iter_rates_between(table: str, code: str, first: date, last: date) -> Iterator[list]:
+    """
+    Yields the rates of a currency over a date range in ascending date order, one chunk per fetch window, as
+    soon as each window is ingested. Only one window of rates is held at a time.
+    Parameters:
+    -----------
+    table : str
+        The NBP table letter, `a` or `c`.
+    code : str
+        The currency code.
+    first : date
+        The first date of the range, see `parse_range`.
+    last : date
+        The last date of the range.
+    Returns:
+    --------
+    Iterator[list]
+        The chunks of rates, in the shape of the `rates` list of an NBP response.
+    """
+
+    for window_start, window_end in tables.ingest_windows(table, first, last):
+        chunk = tables.index.rates_between(table, code, max(first, window_start), min(last, window_end))
+        if chunk:
+            yield chunk
+
+
+def parse_range(start: str, end: str) -> tuple:
+    """
+    Parses the dates of a range.
+    Raises:
+    --------
+        ValidationError: If a date is malformed or the range ends before it starts.
+    """
+
+    first, last = parse_date(start), parse_date(end)
+    if first is None or last is None or first > last:
+        service.bad_range_raise()
+    return first, last
+
+
+def extremes_of(table: str, code: str, rates: list) -> tuple:
+    """
+    Returns the minimum and maximum of the series (see `last_extremes`) of consecutive rates of a currency, from the
+    range index, or from the rates themselves when the index does not hold exactly them.
+    """
+
+    field = FIELDS[table.upper()]
+    first, last = (date.fromisoformat(rates[position]["effectiveDate"]) for position in (0, -1))
+    found = tables.index.ranges.extremes(table, code, field, first, last)
+    if found is not None and found[0] == len(rates):
+        return found[1], found[2]
+    values = stats.series(rates, "mid") if field == "mid" else stats.spreads(rates)
+    computed = stats.compute(values, ("min", "max"))
+    return computed["min"], computed["max"]
+
+
+def _fetch_last_rates(table: str, code: str, number: int) -> list:
+    """
+    Looks the last `number` rates of a currency up in the local rate store, or at NBP when the store is behind, and
+    caches them until the next publication.
+    """
+
+    if not CODE.fullmatch(code):
+        service.no_data_raise()
+    stored = list(_stored(table, code).order_by("-effective_date")[:number])
+    if _is_current(table, stored, number):
+        tables.index.add_stored(stored)
+        rates = [rate.to_nbp() for rate in reversed(stored)]
+    else:
+        rates = _rates_of(table, code, tables.ingest(table, f"last/{number}/"))
+    newest = date.fromisoformat(rates[-1]["effectiveDate"])
+    cache.rates.set((table.upper(), code.upper(), "last", number), rates, size=_size(len(rates)),
+                    expires_at=cache.last_expiry(table, newest))
+    return rates
+
+
+async def _afetch_last_rates(table: str, code: str, number: int) -> list:
+    """
+    The async version of `_fetch_last_rates`.
+    """
+
+    if not CODE.fullmatch(code):
+        service.no_data_raise()
+    stored = [rate async for rate in _stored(table, code).order_by("-effective_date")[:number]]
+    if _is_current(table, stored, number):
+        tables.index.add_stored(stored)
+        rates = [rate.to_nbp() for rate in reversed(stored)]
+    else:
+        rates = _rates_of(table, code, await tables.aingest(table, f"last/{number}/"))
+    newest = date.fromisoformat(rates[-1]["effectiveDate"])
+    await cache.rates.aset((table.upper(), code.upper(), "last", number), rates, size=_size(len(rates)),
+                           expires_at=cache.last_expiry(table, newest))
+    return rates
+
+
+def _stored(table: str, code: str):
+    return Rate.objects.filter(table=table.upper(), code=code.upper())
+
+
+def _is_current(table: str, stored: list, number: int) -> bool:
+    """
+    Tells whether the newest stored rates, newest first, are the last `number` rates NBP published: there are
+    enough of them, the newest is from the latest published table and the table numbers have no gaps.
+    """
+
+    if len(stored) < number or stored[0].effective_date < publication.latest_publication(table):
+        return False
+    for later, earlier in zip(stored, stored[1:]):
+        later_year, later_number = later.sequence
+        earlier_year, earlier_number = earlier.sequence
+        if (later_year, later_number) != (earlier_year, earlier_number + 1) \
+                and (later_year, later_number) != (earlier_year + 1, 1):
+            return False
+    return True
+
+
+def _known_missing(table: str, code: str, day: date) -> bool:
+    """
+    Tells whether a lookup is known to miss without asking NBP: the code is not a currency code, or the publication
+    calendar knows NBP published no table on the day.
+    """
+
+    return not CODE.fullmatch(code) or tables.index.calendar.is_missing(table, day)
+
+
+@contextmanager
+def _learning_missing(table: str, day: date):
+    """
+    Records in the publication calendar a day NBP answers with no table for, when a later table should already be
+    out, so the day is never asked for again.
+    """
+
+    try:
+        yield
+    except NotFound:
+        if day < publication.latest_publication(table):
+            tables.index.calendar.add_missing(table, day)
+        raise
+
+
+def _rates_of(table: str, code: str, published: list) -> list:
+    """
+    Picks the rates of one currency out of freshly ingested tables.
+    """
+
+    rates = [tables.index.rate(table, code, date.fromisoformat(table_data["effectiveDate"]))
+             for table_data in published]
+    rates = [rate for rate in rates if rate is not None]
+    if not rates:
+        service.no_data_raise()
+    return rates
+
+
+def parse_date(day: str):
+    """
+    Parses a date in the format yyyy-mm-dd, and only that one of the forms `date.fromisoformat` accepts, or returns
+    None.
+    """
+
+    if not DAY.fullmatch(day):
+        return None
+    try:
+        return date.fromisoformat(day)
+    except ValueError:
+        return None
+
+
+def _size(count: int) -> int:
+    """
+    Approximates the memory held by `count` cached rate dicts.
+    """
+
+    return 64 + 400 * count
@@ -0,0 +1,74 @@
+"""
+Renderers for exporting rate series as CSV or newline-delimited JSON.
+Besides rendering a response body like any DRF renderer, each of them can `stream` a series chunk by chunk, so long
+histories are written out as they are fetched instead of being assembled in memory first.
+"""
+
+import csv
+import io
+import json
+from typing import Iterable, Iterator, Sequence
+
+from rest_framework.renderers import BaseRenderer
+
+FIELDS = ("effectiveDate", "no", "mid", "bid", "ask")
+
+TABLE_FIELDS = {
+    "A": ("effectiveDate", "no", "mid"),
+    "C": ("effectiveDate", "no", "bid", "ask"),
+}
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    Renders a rate series as CSV, one rate per row.
+    """
+
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> str:
+        rows = data if isinstance(data, list) else [data]
+        fields = [field for field in FIELDS if field in rows[0]] if rows else []
+        if rows and not fields:
+            fields = list(rows[0])
+        return "".join(self.stream([rows], fields))
+
+    def stream(self, chunks: Iterable[list], fields: Sequence[str]) -> Iterator[str]:
+        """
+        Yields the header, then the rows of each chunk of rates as it arrives.
+        """
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        for chunk in chunks:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(chunk)
+        yield buffer.getvalue()
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renders a rate series as newline-delimited JSON, one rate per line.
+    """
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None) -> str:
+        if isinstance(data, list):
+            return "".join(self.stream([data]))
+        return json.dumps(data) + "\n"
+
+    def stream(self, chunks: Iterable[list]) -> Iterator[str]:
+        """
+        Yields the lines of each chunk of rates as it arrives.
+        """
+
+        for chunk in chunks:
+            yield "".join(json.dumps(rate) + "\n" for rate in chunk)
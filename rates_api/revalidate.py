@@ -0,0 +1,79 @@
+"""
+Stale-while-revalidate serving of expired answers.
+When an answer has expired and NBP cannot be asked right now (the circuit breaker is open) or is already being
+asked for it (another request is refreshing it), the last known good answer is served at once, marked as stale, and
+refreshed in a background thread. At most one refresh per answer runs at a time in a process.
+"""
+
+import threading
+from typing import Callable, Hashable, Optional
+
+from django.db import connection
+from rest_framework.exceptions import APIException
+
+
+class Stale(list):
+    """
+    A list of rates served after it expired, because no fresh one could be had in time.
+    """
+
+
+class Revalidator:
+    """
+    The refreshes of expired answers running in a process, by cache key.
+    """
+
+    def __init__(self) -> None:
+        self._running: dict = {}
+        self._lock = threading.Lock()
+
+    def claim(self, key: Hashable) -> bool:
+        """
+        Takes the refresh of `key` for the calling thread, unless a refresh of it is already running.
+        """
+
+        with self._lock:
+            if key in self._running:
+                return False
+            self._running[key] = None
+            return True
+
+    def release(self, key: Hashable) -> None:
+        """
+        Releases the refresh of `key` taken with `claim`.
+        """
+
+        with self._lock:
+            self._running.pop(key, None)
+
+    def in_background(self, key: Hashable, refresh: Callable[[], object]) -> None:
+        """
+        Runs `refresh` in a background thread, unless a refresh of `key` is already running. Its failures are
+        dropped: the stale answer keeps being served until a refresh succeeds.
+        """
+
+        if not self.claim(key):
+            return
+        thread = threading.Thread(target=self._run, args=(key, refresh), name=f"revalidate-{key}", daemon=True)
+        with self._lock:
+            self._running[key] = thread
+        thread.start()
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """
+        Waits for the background refreshes running now to finish.
+        """
+
+        with self._lock:
+            threads = [thread for thread in self._running.values() if thread is not None]
+        for thread in threads:
+            thread.join(timeout)
+
+    def _run(self, key: Hashable, refresh: Callable[[], object]) -> None:
+        try:
+            refresh()
+        except APIException:
+            pass
+        finally:
+            connection.close()
+            self.release(key)
@@ -0,0 +1,220 @@
+"""
+The OpenAPI schema of the API, generated once instead of on every hit.
+drf_yasg builds the schema by introspecting every view, which is too costly to repeat for each Swagger UI load or
+poll of the schema. The schema is instead read from the file written by `manage.py write_schema` (the
+`RATES_SCHEMA` setting), or generated on first use, validated, and served as a fixed JSON document, gzipped in
+advance and revalidated by its ETag.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import Counter
+from typing import Optional
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson
+from drf_yasg.errors import SwaggerValidationError
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.views import get_schema_view
+
+INFO = openapi.Info(
+    title="Exchange Rates API",
+    default_version="1.0.0",
+    description="API documentation for ExchangeRates App",
+)
+
+MAX_AGE = 3600
+
+METHODS = ("get", "put", "post", "delete", "options", "head", "patch")
+
+PATH_PARAMETER = re.compile(r"{([^}]+)}")
+
+
+class SchemaGenerator(OpenAPISchemaGenerator):
+    """
+    The drf_yasg generator, with unique operationIds: the ids it derives from the path prefix collide between
+    endpoints that only differ in their path parameters, so those get the parameters appended.
+    """
+
+    def get_schema(self, request=None, public=False) -> openapi.Swagger:
+        swagger = super().get_schema(request, public)
+        operations = [(path, operation) for path, item in swagger.paths.items() for _, operation in item.operations]
+        counts = Counter(operation.operation_id for _, operation in operations)
+        for path, operation in operations:
+            if counts[operation.operation_id] > 1:
+                operation.operation_id = "_".join([operation.operation_id, *PATH_PARAMETER.findall(path)])
+        return swagger
+
+
+schema_view = get_schema_view(INFO, public=True, generator_class=SchemaGenerator)
+_swagger_ui = schema_view.with_ui("swagger", cache_timeout=0)
+
+
+class Document:
+    """
+    A schema ready to be served: its JSON, the gzip of it and their ETag.
+    """
+
+    def __init__(self, content: bytes) -> None:
+        self.content = content
+        self.compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        self.etag = f'"{hashlib.sha1(content).hexdigest()}"'
+
+
+def generate() -> bytes:
+    """
+    Generates the schema of every endpoint by introspecting the views, and validates it.
+    Returns:
+    --------
+    bytes
+        The schema as compact JSON.
+    Raises:
+    --------
+        SwaggerValidationError: If the generated schema is not a valid Swagger 2.0 document.
+    """
+
+    swagger = SchemaGenerator(INFO).get_schema(request=None, public=True)
+    content = OpenAPICodecJson(validators=_validators()).encode(swagger)
+    validate(json.loads(content))
+    return content
+
+
+def validate(schema: dict) -> None:
+    """
+    Checks the structure of a Swagger 2.0 document: its version and info, that every operation has responses and a
+    unique operationId, that every path template parameter is declared as a required path parameter, and that
+    every `$ref` points to a definition of the document.
+    Raises:
+    --------
+        SwaggerValidationError: Listing every problem found.
+    """
+
+    problems = []
+    if schema.get("swagger") != "2.0":
+        problems.append("swagger: must be 2.0")
+    if not schema.get("info", {}).get("title") or not schema.get("info", {}).get("version"):
+        problems.append("info: needs a title and a version")
+    operation_ids = set()
+    for path, item in schema.get("paths", {}).items():
+        if not path.startswith("/"):
+            problems.append(f"{path}: must start with /")
+        templated = set(PATH_PARAMETER.findall(path))
+        shared = item.get("parameters", [])
+        for method in METHODS:
+            operation = item.get(method)
+            if operation is None:
+                continue
+            where = f"{method.upper()} {path}"
+            if not operation.get("responses"):
+                problems.append(f"{where}: has no responses")
+            operation_id = operation.get("operationId")
+            if operation_id in operation_ids:
+                problems.append(f"{where}: duplicate operationId {operation_id}")
+            operation_ids.add(operation_id)
+            declared = {parameter.get("name"): parameter for parameter in shared + operation.get("parameters", [])
+                        if parameter.get("in") == "path"}
+            for name in templated - set(declared):
+                problems.append(f"{where}: path parameter {name} is not declared")
+            for name, parameter in declared.items():
+                if name not in templated:
+                    problems.append(f"{where}: path parameter {name} is not in the path")
+                elif not parameter.get("required"):
+                    problems.append(f"{where}: path parameter {name} must be required")
+    for reference in _references(schema):
+        parts = reference.split("/")
+        if parts[0] != "#" or len(parts) != 3 or parts[2] not in schema.get(parts[1], {}):
+            problems.append(f"$ref {reference} does not resolve")
+    if problems:
+        raise SwaggerValidationError("spec validation failed: " + "; ".join(problems))
+
+
+_document: Optional[Document] = None
+_lock = threading.Lock()
+
+
+def get_document() -> Document:
+    """
+    Returns the schema served by the process: the `RATES_SCHEMA` file when it was written, or else the schema
+    generated on first use.
+    """
+
+    global _document
+    if _document is None:
+        with _lock:
+            if _document is None:
+                path = getattr(settings, "RATES_SCHEMA", None)
+                if path and os.path.exists(path):
+                    with open(path, "rb") as file:
+                        _document = Document(file.read())
+                else:
+                    _document = Document(generate())
+    return _document
+
+
+def reset() -> None:
+    """
+    Drops the schema of the process, so it is read or generated again on next use.
+    """
+
+    global _document
+    _document = None
+
+
+def serve(request: HttpRequest) -> HttpResponse:
+    """
+    Serves the schema as JSON, gzipped to clients that accept it, and answers 304 to clients that have it.
+    """
+
+    document = get_document()
+    if document.etag in parse_etags(request.headers.get("If-None-Match", "")):
+        response = HttpResponseNotModified()
+    elif "gzip" in request.headers.get("Accept-Encoding", ""):
+        response = HttpResponse(document.compressed, content_type="application/json")
+        response["Content-Encoding"] = "gzip"
+    else:
+        response = HttpResponse(document.content, content_type="application/json")
+    response["ETag"] = document.etag
+    response["Cache-Control"] = f"public, max-age={MAX_AGE}"
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+
+def swagger(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+    """
+    Serves the Swagger UI page, and the schema it loads (`?format=openapi`) with `serve`.
+    """
+
+    if request.GET.get("format") == "openapi":
+        return serve(request)
+    return _swagger_ui(request, *args, **kwargs)
+
+
+def _references(node) -> list:
+    if isinstance(node, dict):
+        found = [node["$ref"]] if isinstance(node.get("$ref"), str) else []
+        for value in node.values():
+            found.extend(_references(value))
+        return found
+    if isinstance(node, list):
+        return [reference for value in node for reference in _references(value)]
+    return []
+
+
+def _validators() -> list:
+    """
+    Returns the drf_yasg validators to run besides `validate`: swagger-spec-validator, when it is installed.
+    """
+
+    try:
+        import swagger_spec_validator  # noqa: F401
+    except ImportError:
+        return []
+    return ["ssv"]
@@ -0,0 +1,196 @@
+"""
+Compact in-process storage of rate series.
+Each (table, currency) series is held in parallel typed arrays: the effective dates as day ordinals, the table
+numbers, and one float array per rate field (`mid` for table A, `bid` and `ask` for table C). Dates are looked up by
+binary search over the ordinals. Series can be written to a snapshot file and mapped back into memory, so a worker
+starts with the whole history without parsing or copying it.
+"""
+
+import json
+import mmap
+import os
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+from typing import Optional
+
+FIELDS = {
+    "A": ("mid",),
+    "C": ("bid", "ask"),
+}
+
+MAGIC = b"NBPRATES"
+
+
+class CompactSeries:
+    """
+    The rates of one currency in one NBP table, in ascending date order.
+    Table numbers are stored without their `/A/NBP/2023` suffix, which follows from the table and the date.
+    """
+
+    def __init__(self, table: str, days=None, numbers=None, values: Optional[dict] = None) -> None:
+        """
+        Parameters:
+        -----------
+        table : str
+            The NBP table letter.
+        days, numbers, values : optional
+            Existing arrays (or read-only memory views of a snapshot) of the day ordinals, the table numbers and
+            the rate fields by name. A series built from memory views copies them on its first change.
+        """
+
+        self.table = table.upper()
+        self.fields = FIELDS[self.table]
+        self.days = days if days is not None else array("i")
+        self.numbers = numbers if numbers is not None else array("H")
+        self.values = values if values is not None else {field: array("d") for field in self.fields}
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def get(self, day: date) -> Optional[dict]:
+        """
+        Returns the rate of `day` in the shape of one element of the `rates` list of an NBP response, or None.
+        """
+
+        ordinal = day.toordinal()
+        position = bisect_left(self.days, ordinal)
+        if position == len(self.days) or self.days[position] != ordinal:
+            return None
+        return self._rate(position)
+
+    def value(self, day: date, field: str) -> Optional[float]:
+        """
+        Returns one field of the rate of `day`, or None.
+        """
+
+        ordinal = day.toordinal()
+        position = bisect_left(self.days, ordinal)
+        if position == len(self.days) or self.days[position] != ordinal:
+            return None
+        return self.values[field][position]
+
+    def between(self, start: date, end: date) -> list:
+        """
+        Returns the rates from `start` to `end` inclusive, in ascending date order.
+        """
+
+        first = bisect_left(self.days, start.toordinal())
+        last = bisect_right(self.days, end.toordinal())
+        return [self._rate(position) for position in range(first, last)]
+
+    def put(self, day: date, no: str, rate: dict, replace: bool = True) -> Optional[int]:
+        """
+        Records the rate of `day` from table `no`, keeping a rate already recorded for the day unless `replace`.
+        Returns the position of the rate, or None when the series is unchanged.
+        """
+
+        ordinal = day.toordinal()
+        position = bisect_left(self.days, ordinal)
+        known = position < len(self.days) and self.days[position] == ordinal
+        number = int(no.split("/", 1)[0])
+        if known and (not replace or self.numbers[position] == number
+                      and all(self.values[field][position] == rate[field] for field in self.fields)):
+            return None
+        self._make_writable()
+        if known:
+            self.numbers[position] = number
+            for field in self.fields:
+                self.values[field][position] = rate[field]
+        else:
+            self.days.insert(position, ordinal)
+            self.numbers.insert(position, number)
+            for field in self.fields:
+                self.values[field].insert(position, rate[field])
+        return position
+
+    def _rate(self, position: int) -> dict:
+        day = date.fromordinal(self.days[position])
+        data = {"no": f"{self.numbers[position]:03d}/{self.table}/NBP/{day.year}", "effectiveDate": day.isoformat()}
+        for field in self.fields:
+            data[field] = self.values[field][position]
+        return data
+
+    def _make_writable(self) -> None:
+        if isinstance(self.days, memoryview):
+            self.days = array("i", self.days)
+            self.numbers = array("H", self.numbers)
+            self.values = {field: array("d", values) for field, values in self.values.items()}
+
+
+def write_snapshot(path: str, series: dict) -> None:
+    """
+    Writes series to a snapshot file, replacing it atomically so workers mapping the previous one are unaffected.
+    Parameters:
+    -----------
+    path : str
+        The snapshot file.
+    series : dict
+        The `CompactSeries` by `(table, code)`.
+    """
+
+    entries = []
+    blocks = []
+    offset = 0
+    for (table, code), one in sorted(series.items()):
+        arrays = [("days", one.days, "i"), ("numbers", one.numbers, "H"),
+                  *((field, one.values[field], "d") for field in one.fields)]
+        offsets = {}
+        for name, values, typecode in arrays:
+            data = array(typecode, values).tobytes()
+            offsets[name] = offset
+            blocks.append(data + b"\0" * (-len(data) % 8))
+            offset += len(blocks[-1])
+        entries.append({"table": table, "code": code, "length": len(one), "offsets": offsets})
+    header = json.dumps({"byteorder": sys.byteorder, "series": entries}).encode()
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % 8)
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile("wb", dir=directory, delete=False) as file:
+        file.write(MAGIC)
+        file.write(len(header).to_bytes(8, "little"))
+        file.write(header)
+        for block in blocks:
+            file.write(block)
+    os.replace(file.name, path)
+
+
+def read_snapshot(path: str) -> dict:
+    """
+    Maps a snapshot file into memory.
+    Parameters:
+    -----------
+    path : str
+        The snapshot file written by `write_snapshot`.
+    Returns:
+    --------
+    dict
+        The `CompactSeries` by `(table, code)`, reading straight from the mapped file until they are changed.
+    Raises:
+    --------
+        ValueError: If the file is not a snapshot or was written on a machine of another byte order.
+    """
+
+    with open(path, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    if view[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a rates snapshot")
+    length = int.from_bytes(view[len(MAGIC):len(MAGIC) + 8], "little")
+    start = len(MAGIC) + 8 + length
+    header = json.loads(bytes(view[len(MAGIC) + 8:start]))
+    if header["byteorder"] != sys.byteorder:
+        raise ValueError(f"{path} was written with another byte order")
+    series = {}
+    for entry in header["series"]:
+        count, offsets = entry["length"], entry["offsets"]
+
+        def cast(name: str, typecode: str) -> memoryview:
+            begin = start + offsets[name]
+            return view[begin:begin + count * array(typecode).itemsize].cast(typecode)
+
+        series[(entry["table"], entry["code"])] = CompactSeries(
+            entry["table"], cast("days", "i"), cast("numbers", "H"),
+            {field: cast(field, "d") for field in FIELDS[entry["table"]]})
+    return series
@@ -4,7 +4,19 @@ Functions that raise specific exceptions with appropriate error messages.
 
 from requests import Response
 
-from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+
+NO_DATA = "404 NotFound - Not Found - Brak danych"
+
+
+class UpstreamUnavailable(APIException):
+    """
+    Raised when the NBP API cannot be reached or does not answer in time.
+    """
+
+    status_code = 503
+    default_detail = "503 ServiceUnavailable - NBP API is unavailable"
+    default_code = "upstream_unavailable"
 
 
 def not_found_raise(response: Response) -> None:
@@ -26,16 +38,30 @@ def not_found_raise(response: Response) -> None:
     raise NotFound(data)
 
 
-def bad_request_raise(number: int, response: Response) -> None:
+def no_data_raise() -> None:
+    """
+    Raises a `NotFound` 404 exception with the message NBP answers with when it has no data, for lookups that
+    are known to miss without asking NBP.
+    Returns:
+    -----------
+        None
+    Raises:
+    -----------
+        NotFound: Always.
+    """
+
+    raise NotFound(NO_DATA)
+
+
+def bad_request_raise(number: int) -> None:
     """
     Raises a ValidationError exception with an appropriate error message and code 400
     when an invalid number of quotations is specified.
+    The messages are the ones NBP answers with, so invalid requests never go upstream.
     Parameters:
     -----------
     number : int
         An integer that represents the number of quotations to retrieve.
-    response: Response
-        A response object that contains metadata about the response from an API.
     Returns:
     --------
         None
@@ -48,6 +74,89 @@ def bad_request_raise(number: int, response: Response) -> None:
         message = "400 BadRequest - Liczba wyników nie może być mniejsza niż 1 / " \
                   "The number of quotations cannot be less than one"
     else:
-        message = response.content
+        message = "400 BadRequest - Przekroczony limit 255 wyników / " \
+                  "Maximum size of 255 data series has been exceeded"
     data = {"detail": message}
     raise ValidationError(data, code=400)
+
+
+def bad_range_raise() -> None:
+    """
+    Raises a ValidationError exception with code 400 when a date range is malformed or ends before it starts,
+    with the message NBP answers with.
+    Returns:
+    --------
+        None
+    Raises:
+    --------
+        ValidationError: Always.
+    """
+
+    data = {"detail": "400 BadRequest - Błędny zakres dat / Invalid date range"}
+    raise ValidationError(data, code=400)
+
+
+def unavailable_raise(exc: Exception) -> None:
+    """
+    Raises an `UpstreamUnavailable` 503 exception for a failed call to the NBP API.
+    Parameters:
+    -----------
+    exc : Exception
+        The network error raised by the HTTP client.
+    Returns:
+    --------
+        None
+    Raises:
+    --------
+        UpstreamUnavailable: Always.
+    """
+
+    raise UpstreamUnavailable() from exc
+
+
+def circuit_open_raise() -> None:
+    """
+    Raises an `UpstreamUnavailable` 503 exception for a call refused by the open circuit breaker.
+    Returns:
+    --------
+        None
+    Raises:
+    --------
+        UpstreamUnavailable: Always.
+    """
+
+    raise UpstreamUnavailable("503 ServiceUnavailable - NBP API is unavailable, calls are paused after repeated "
+                              "failures")
+
+
+def upstream_error_raise(response: Response) -> None:
+    """
+    Raises an `UpstreamUnavailable` 503 exception for an NBP answer that is neither data nor one of its "no data"
+    or "bad request" messages, e.g. an error page of a failing proxy.
+    Parameters:
+    -----------
+    response : Response
+        The upstream response.
+    Returns:
+    --------
+        None
+    Raises:
+    --------
+        UpstreamUnavailable: Always.
+    """
+
+    raise UpstreamUnavailable(f"503 ServiceUnavailable - NBP API answered with status {response.status_code}")
+
+
+def busy_raise() -> None:
+    """
+    Raises an `UpstreamUnavailable` 503 exception for a call the NBP call limits left no room for in time.
+    Returns:
+    --------
+        None
+    Raises:
+    --------
+        UpstreamUnavailable: Always.
+    """
+
+    raise UpstreamUnavailable("503 ServiceUnavailable - Too many calls to NBP API are waiting, try again later")
@@ -0,0 +1,94 @@
+"""
+Single-flight coalescing of identical upstream fetches.
+While a fetch for a key is in flight, concurrent callers asking for the same key wait for it and share its result
+(or its exception) instead of starting their own. Works across threads for the sync views and across tasks of one
+event loop for the async views.
+"""
+
+import asyncio
+import threading
+import weakref
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+
+class _Call:
+    """
+    One in-flight sync call and its outcome.
+    """
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    A group of in-flight calls, keyed by what they fetch.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict = {}
+        self._lock = threading.Lock()
+        self._async_calls: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Runs `fn` unless a call with the same `key` is already in flight, in which case its outcome is shared.
+        Parameters:
+        -----------
+        key : Hashable
+            What the call fetches, e.g. the upstream path.
+        fn : Callable
+            The function performing the fetch.
+        Returns:
+        --------
+        Any
+            The result of the call that ran.
+        Raises:
+        --------
+            Whatever the call that ran raised.
+        """
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable]) -> Any:
+        """
+        The async version of `do`, coalescing the tasks of the running event loop. The call runs in a task of its
+        own, so a caller being cancelled, the one that started it included, leaves it running for the others.
+        """
+
+        loop = asyncio.get_running_loop()
+        calls = self._async_calls.setdefault(loop, {})
+        task = calls.get(key)
+        if task is None:
+            task = calls[key] = loop.create_task(fn())
+            task.add_done_callback(lambda done: self._finished(calls, key, done))
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _finished(calls: dict, key: Hashable, task: asyncio.Task) -> None:
+        if calls.get(key) is task:
+            del calls[key]
+        if not task.cancelled():
+            # Retrieved, so an error nobody waited for any more is not reported as never retrieved.
+            task.exception()
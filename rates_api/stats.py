@@ -0,0 +1,186 @@
+"""
+Vectorized statistics over rate series.
+A series is loaded once into a contiguous float array and every selected metric is computed from it with array
+operations, never with per-rate Python loops. The kernel works on one series or on a 2-D array of equally long
+series, one per row, so many series are analysed in a single pass.
+"""
+
+from typing import Iterable, Sequence
+
+import numpy as np
+from rest_framework.exceptions import ValidationError
+
+METRICS = ("min", "max", "mean", "stdev", "percentiles", "log_returns", "rolling_mean", "volatility",
+           "rolling_volatility", "max_spread")
+
+# The metrics of the mid rates the statistics endpoints read: `max_spread` is only defined on table C spreads.
+QUERY_METRICS = tuple(metric for metric in METRICS if metric != "max_spread")
+
+ROLLING_METRICS = ("rolling_mean", "rolling_volatility")
+
+DEFAULT_METRICS = ("min", "max", "mean", "stdev", "percentiles", "volatility")
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+
+DEFAULT_WINDOW = 5
+
+
+def series(rates_data: Iterable[dict], field: str) -> np.ndarray:
+    """
+    Loads one field of a list of NBP rates into a contiguous float array.
+    """
+
+    rates_data = list(rates_data)
+    return np.fromiter((rate_data[field] for rate_data in rates_data), dtype=np.float64, count=len(rates_data))
+
+
+def spreads(rates_data: Iterable[dict]) -> np.ndarray:
+    """
+    Loads the ask - bid spreads of a list of table C rates into a contiguous float array.
+    """
+
+    rates_data = list(rates_data)
+    return series(rates_data, "ask") - series(rates_data, "bid")
+
+
+def compute(values: np.ndarray, metrics: Sequence[str] = DEFAULT_METRICS,
+            percentiles: Sequence[float] = DEFAULT_PERCENTILES, window: int = DEFAULT_WINDOW) -> dict:
+    """
+    Computes the selected metrics of a series.
+    Parameters:
+    -----------
+    values : np.ndarray
+        The series, or a 2-D array with one series per row; metrics are computed along the last axis.
+    metrics : Sequence[str]
+        The metrics to compute, out of `METRICS`. `max_spread` expects `values` to be ask - bid spreads.
+    percentiles : Sequence[float]
+        The percentiles computed by the `percentiles` metric, between 0 and 100.
+    window : int
+        The number of quotations of the rolling metrics.
+    Returns:
+    --------
+    dict
+        The value of each metric: a float (or one per series) for aggregates, a mapping like `{"p50": ...}` for
+        `percentiles`, and a list for `log_returns` and the rolling metrics. Undefined values, like the deviation
+        of a single rate, are None.
+    """
+
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    result = {}
+    needs_returns = {"log_returns", "volatility", "rolling_volatility"} & set(metrics)
+    returns = np.diff(np.log(values), axis=-1) if needs_returns else None
+    for metric in metrics:
+        if metric == "min":
+            result[metric] = _plain(values.min(axis=-1))
+        elif metric == "max":
+            result[metric] = _plain(values.max(axis=-1))
+        elif metric == "mean":
+            result[metric] = _plain(values.mean(axis=-1))
+        elif metric == "stdev":
+            result[metric] = _plain(_stdev(values))
+        elif metric == "percentiles":
+            points = np.percentile(values, percentiles, axis=-1)
+            result[metric] = {_label(percentile): _plain(point) for percentile, point in zip(percentiles, points)}
+        elif metric == "log_returns":
+            result[metric] = _plain(returns)
+        elif metric == "rolling_mean":
+            result[metric] = _plain(rolling_mean(values, window))
+        elif metric == "volatility":
+            result[metric] = _plain(_stdev(returns))
+        elif metric == "rolling_volatility":
+            result[metric] = _plain(rolling_stdev(returns, window))
+        elif metric == "max_spread":
+            result[metric] = _plain(values.max(axis=-1, initial=0))
+    return result
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Returns the means of every `window` consecutive values, from cumulative sums.
+    """
+
+    if values.shape[-1] < window:
+        return values[..., :0]
+    sums = _cumsum(values)
+    return (sums[..., window:] - sums[..., :-window]) / window
+
+
+def rolling_stdev(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Returns the sample standard deviations of every `window` consecutive values, from cumulative sums.
+    """
+
+    if values.shape[-1] < window or window < 2:
+        return values[..., :0]
+    sums = _cumsum(values)
+    squares = _cumsum(values * values)
+    total = sums[..., window:] - sums[..., :-window]
+    total_squares = squares[..., window:] - squares[..., :-window]
+    variance = (total_squares - total * total / window) / (window - 1)
+    return np.sqrt(np.maximum(variance, 0))
+
+
+def parse_options(query: dict, number: int) -> tuple:
+    """
+    Reads the metrics, percentiles and rolling window from the query of a statistics request.
+    Parameters:
+    -----------
+    query : dict
+        The query parameters: `metrics` and `percentiles` as comma-separated lists, and `window`.
+    number : int
+        The length of the series, bounding the window of the rolling metrics.
+    Returns:
+    --------
+    tuple
+        `(metrics, percentiles, window)` to pass to `compute`.
+    Raises:
+    --------
+        ValidationError: If a metric is unknown, or a percentile or the window of a selected rolling metric is out of
+        range.
+    """
+
+    metrics = _split(query.get("metrics")) or DEFAULT_METRICS
+    unknown = [metric for metric in metrics if metric not in QUERY_METRICS]
+    if unknown:
+        raise ValidationError({"detail": f"400 BadRequest - Unknown metrics: {', '.join(unknown)}; "
+                                         f"choose from {', '.join(QUERY_METRICS)}"})
+    try:
+        percentiles = tuple(float(value) for value in _split(query.get("percentiles"))) or DEFAULT_PERCENTILES
+        window = int(query.get("window", DEFAULT_WINDOW))
+    except ValueError:
+        raise ValidationError({"detail": "400 BadRequest - `percentiles` and `window` must be numbers"})
+    if not all(0 <= percentile <= 100 for percentile in percentiles):
+        raise ValidationError({"detail": "400 BadRequest - Percentiles must be between 0 and 100"})
+    if set(ROLLING_METRICS) & set(metrics) and not 2 <= window <= max(number, 2):
+        raise ValidationError({"detail": "400 BadRequest - `window` must be between 2 and the number of quotations"})
+    return metrics, percentiles, window
+
+
+def _stdev(values: np.ndarray) -> np.ndarray:
+    if values.shape[-1] < 2:
+        return np.full(values.shape[:-1], np.nan)
+    return values.std(axis=-1, ddof=1)
+
+
+def _cumsum(values: np.ndarray) -> np.ndarray:
+    padding = [(0, 0)] * (values.ndim - 1) + [(1, 0)]
+    return np.cumsum(np.pad(values, padding), axis=-1)
+
+
+def _split(value) -> tuple:
+    return tuple(part.strip() for part in value.split(",") if part.strip()) if value else ()
+
+
+def _label(percentile: float) -> str:
+    return f"p{percentile:g}"
+
+
+def _plain(value):
+    """
+    Turns a numpy result into JSON-serializable floats, with None for undefined values.
+    """
+
+    array = np.asarray(value, dtype=np.float64)
+    if array.ndim == 0:
+        return None if np.isnan(array) else float(array)
+    return np.where(np.isnan(array), None, array).tolist()
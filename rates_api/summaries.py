@@ -0,0 +1,80 @@
+"""
+Builders of the endpoint bodies from the rates returned by the lookups in `rates`.
+They are shared by the sync, async and batch views so every path answers with the same body.
+"""
+
+from . import stats
+
+
+def currency_date_data(code: str, date: str, rate: dict) -> dict:
+    """
+    Builds the body of the currency-date endpoint from the rate of the currency on the date.
+    """
+
+    average_rate = rate["mid"]
+    return {f"the average {code.upper()} exchange rate dated {date}": average_rate}
+
+
+def last_quotations_data(code: str, number: int, extremes: tuple) -> dict:
+    """
+    Builds the body of the last-quotations endpoint from the minimum and maximum of the last table A rates.
+    """
+
+    min_average_rate, max_average_rate = extremes
+    return {
+        f"the average {code.upper()} exchange rate for the last {number} quotations":
+            {"minimum": min_average_rate,
+             "maximum": max_average_rate}
+    }
+
+
+def difference_rate_data(code: str, number: int, max_spread: float) -> dict:
+    """
+    Builds the body of the difference-rate endpoint from the biggest ask - bid spread of the last table C rates.
+    """
+
+    # Rounding is monotonic, so rounding the biggest spread equals taking the biggest rounded spread.
+    max_difference_rate = round(max(max_spread, 0), 4)
+    return {
+        f"the biggest {code.upper()} exchange rate difference for the last {number} quotations":
+            max_difference_rate}
+
+
+def range_extremes_data(code: str, start: str, end: str, extremes: tuple) -> dict:
+    """
+    Builds the body of the date-range extremes endpoint from the minimum and maximum of the table A rates.
+    """
+
+    min_average_rate, max_average_rate = extremes
+    return {
+        f"the average {code.upper()} exchange rate from {start} to {end}":
+            {"minimum": min_average_rate,
+             "maximum": max_average_rate}
+    }
+
+
+def range_difference_data(code: str, start: str, end: str, max_spread: float) -> dict:
+    """
+    Builds the body of the date-range difference endpoint from the biggest ask - bid spread of the table C rates.
+    """
+
+    return {f"the biggest {code.upper()} exchange rate difference from {start} to {end}": round(max(max_spread, 0), 4)}
+
+
+def date_range_data(code: str, start: str, end: str, rates_data: list) -> dict:
+    """
+    Builds the body of the date-range endpoint with the table A rates of the currency in the range.
+    """
+
+    return {f"the average {code.upper()} exchange rates from {start} to {end}": rates_data}
+
+
+def statistics_data(code: str, label: str, rates_data: list, metrics: tuple, percentiles: tuple,
+                    window: int) -> dict:
+    """
+    Builds the body of the statistics endpoints with the selected metrics of the given table A rates, `label`
+    describing the series, e.g. `the last 10 quotations`.
+    """
+
+    statistics = stats.compute(stats.series(rates_data, "mid"), metrics, percentiles, window)
+    return {f"the {code.upper()} exchange rate statistics for {label}": {"count": len(rates_data), **statistics}}
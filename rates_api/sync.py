@@ -0,0 +1,147 @@
+"""
+Incremental synchronisation of the local rate store with NBP.
+Only the tables published after the date the store is known complete through are fetched, window by window in date
+order, and that date is advanced after every stored window, so an interrupted run resumes where it stopped. The
+popular `last/N` answers are then computed once into the shared cache, ahead of the first request after a
+publication.
+"""
+
+from datetime import date, timedelta
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db.models import Max
+from rest_framework.exceptions import NotFound
+
+from . import cache, publication, rates, tables
+from .models import Rate, SyncState
+
+DEFAULTS = {
+    "LAST": (10, 30, 90, 255),
+    "SINCE_DAYS": 366,
+    "LOCK_TIMEOUT": 3600,
+}
+
+LOCK_KEY = "sync_rates:lock"
+
+
+def options() -> dict:
+    """
+    Returns the `RATES_SYNC` setting merged over the defaults.
+    """
+
+    return {**DEFAULTS, **getattr(settings, "RATES_SYNC", {})}
+
+
+def newest_stored(table: str) -> Optional[date]:
+    """
+    Returns the effective date of the newest stored table, or None when none is stored.
+    """
+
+    return Rate.objects.filter(table=table.upper()).aggregate(newest=Max("effective_date"))["newest"]
+
+
+def synced_through(table: str) -> Optional[date]:
+    """
+    Returns the date through which every table is stored, or None before the first sync.
+    """
+
+    state = SyncState.objects.filter(table=table.upper()).first()
+    return state.synced_through if state is not None else None
+
+
+def sync_table(table: str, since: Optional[date] = None,
+               progress: Callable[[str], None] = lambda message: None) -> int:
+    """
+    Fetches and stores the tables published after the date the store is complete through.
+    Parameters:
+    -----------
+    table : str
+        The NBP table letter, `a` or `c`.
+    since : date, optional
+        The first date to fetch on the first sync, by default `SINCE_DAYS` before the latest publication.
+    progress : Callable
+        Told about every stored window.
+    Returns:
+    --------
+    int
+        The number of tables fetched.
+    Raises:
+    --------
+        UpstreamUnavailable: If NBP could not be reached; the windows stored before stay recorded as synced.
+    """
+
+    latest = publication.latest_publication(table)
+    through = synced_through(table)
+    if through is not None:
+        first = through + timedelta(days=1)
+    else:
+        first = since or latest - timedelta(days=options()["SINCE_DAYS"])
+    window_days = {**tables.RANGE_DEFAULTS, **getattr(settings, "RATES_RANGE", {})}["WINDOW_DAYS"]
+    fetched = 0
+    while first <= latest:
+        last = min(first + timedelta(days=window_days - 1), latest)
+        try:
+            published = tables.ingest(table, f"{first.isoformat()}/{last.isoformat()}/")
+        except NotFound:
+            published = []
+        fetched += len(published)
+        # NBP may publish the latest table late, so a window ending with it only counts when the table is in.
+        if last < latest or any(table_data["effectiveDate"] == latest.isoformat() for table_data in published):
+            SyncState.objects.update_or_create(table=table.upper(), defaults={"synced_through": last})
+        progress(f"Table {table.upper()}: {len(published)} tables from {first} to {last}")
+        first = last + timedelta(days=1)
+    return fetched
+
+
+def shared_cache() -> bool:
+    """
+    Tells whether the cache backend of the rate lookups is shared with other processes, so the answers `warm`
+    computes from a command reach the web workers.
+    """
+
+    return not isinstance(caches[cache._options()["ALIAS"]], (LocMemCache, DummyCache))
+
+
+def warm(table: str, numbers: tuple) -> int:
+    """
+    Computes the `last/N` answers of every currency of the newest stored table into the cache: the minimum and
+    maximum for table A, the biggest spread for table C. Other processes only see them with a `shared_cache`.
+    Returns:
+    --------
+    int
+        The number of answers computed.
+    """
+
+    newest = newest_stored(table)
+    if newest is None:
+        return 0
+    codes = Rate.objects.filter(table=table.upper(), effective_date=newest).values_list("code", flat=True)
+    warmed = 0
+    for code in codes:
+        for number in numbers:
+            try:
+                rates.last_extremes(table, code, number)
+            except NotFound:
+                continue
+            warmed += 1
+    return warmed
+
+
+def acquire() -> bool:
+    """
+    Takes the lock that keeps two runs, on any node sharing the cache, from syncing at the same time.
+    """
+
+    return caches[cache._options()["ALIAS"]].add(LOCK_KEY, True, timeout=options()["LOCK_TIMEOUT"])
+
+
+def release() -> None:
+    """
+    Releases the lock taken by `acquire`.
+    """
+
+    caches[cache._options()["ALIAS"]].delete(LOCK_KEY)
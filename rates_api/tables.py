@@ -0,0 +1,332 @@
+"""
+Whole-table ingestion from the NBP API.
+NBP serves complete tables (every currency of table A or C for a day), so one upstream call answers the lookups of
+all currencies on that day. Ingested tables are kept in an in-process index of compact per-currency series, with a
+range-query index of each series, and persisted to the local rate store.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from json import JSONDecodeError
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.db import connection
+from rest_framework.exceptions import NotFound
+
+from . import cache, metrics, nbp, publication, service
+from .models import Rate
+from .ranges import RangeIndex
+from .series import CompactSeries, read_snapshot, write_snapshot
+from .singleflight import SingleFlight
+
+EPOCH = date(2002, 1, 2)
+
+RANGE_DEFAULTS = {
+    "WINDOW_DAYS": 93,
+    "WORKERS": 4,
+}
+
+
+class TableIndex:
+    """
+    An in-process index of ingested NBP tables by table letter, currency code and effective date.
+    Its `ranges` answer the extremes of the indexed series over any window, and its `calendar` tells which days NBP
+    published tables on.
+    """
+
+    def __init__(self) -> None:
+        self._series: dict = {}
+        self._windows: set = set()
+        self._lock = threading.RLock()
+        self.ranges = RangeIndex(self._lock)
+        self.calendar = publication.Calendar()
+
+    def add(self, table: str, tables: list) -> list:
+        """
+        Indexes the tables of an NBP `exchangerates/tables` response.
+        Parameters:
+        -----------
+        table : str
+            The NBP table letter.
+        tables : list
+            The parsed NBP response, one element per published table.
+        Returns:
+        --------
+        list
+            The unsaved `Rate` rows of every currency in the tables.
+        """
+
+        table = table.upper()
+        rows = []
+        with self._lock:
+            for published in tables:
+                effective_date = date.fromisoformat(published["effectiveDate"])
+                self.calendar.add_published(table, (effective_date,))
+                for rate in published["rates"]:
+                    data = {"no": published["no"], "effectiveDate": published["effectiveDate"]}
+                    data.update((key, rate[key]) for key in ("mid", "bid", "ask") if key in rate)
+                    series = self._series_of(table, rate["code"])
+                    self.ranges.track(table, rate["code"], series, series.put(effective_date, published["no"], data))
+                    rows.append(Rate.from_nbp(table, rate["code"], data))
+            if tables:
+                self.calendar.add_span(table, date.fromisoformat(tables[0]["effectiveDate"]),
+                                       date.fromisoformat(tables[-1]["effectiveDate"]))
+        return rows
+
+    def add_stored(self, rows: list) -> None:
+        """
+        Indexes rates read from the local rate store, without recording their tables as ingested.
+        """
+
+        with self._lock:
+            for row in rows:
+                data = row.to_nbp()
+                series = self._series_of(row.table, row.code)
+                self.ranges.track(row.table, row.code, series,
+                                  series.put(row.effective_date, row.no, data, replace=False))
+
+    def rate(self, table: str, code: str, day: date) -> Optional[dict]:
+        """
+        Returns the indexed rate of a currency on a date, or None when it is not indexed.
+        """
+
+        with self._lock:
+            series = self._series.get((table.upper(), code.upper()))
+            return series.get(day) if series is not None else None
+
+    def rates_between(self, table: str, code: str, start: date, end: date) -> list:
+        """
+        Returns the indexed rates of a currency from `start` to `end` inclusive, in ascending date order.
+        """
+
+        with self._lock:
+            series = self._series.get((table.upper(), code.upper()))
+            return series.between(start, end) if series is not None else []
+
+    def has_window(self, table: str, window: tuple) -> bool:
+        """
+        Tells whether every table published in the date `window` has been ingested.
+        """
+
+        return (table.upper(), window) in self._windows
+
+    def add_window(self, table: str, window: tuple) -> None:
+        """
+        Records that every table published in the date `window` has been ingested.
+        """
+
+        with self._lock:
+            self._windows.add((table.upper(), window))
+
+    def has_table(self, table: str, day: date) -> bool:
+        """
+        Tells whether the table published on `day` has been ingested.
+        """
+
+        return self.calendar.is_published(table, day)
+
+    def clear(self) -> None:
+        """
+        Forgets every ingested table.
+        """
+
+        with self._lock:
+            self._series.clear()
+            self.calendar.clear()
+            self._windows.clear()
+            self.ranges.clear()
+
+    def load_snapshot(self, path: str) -> None:
+        """
+        Indexes the series of a snapshot file, mapping it into memory. Every table with a rate in the snapshot is
+        recorded as ingested.
+        """
+
+        loaded = read_snapshot(path)
+        with self._lock:
+            for (table, code), series in loaded.items():
+                self._series[(table, code)] = series
+                self.calendar.add_published(table, map(date.fromordinal, series.days))
+                self.ranges.track(table, code, series)
+
+    def save_snapshot(self, path: str) -> None:
+        """
+        Writes every indexed series to a snapshot file.
+        """
+
+        with self._lock:
+            write_snapshot(path, self._series)
+
+    def _series_of(self, table: str, code: str) -> CompactSeries:
+        series = self._series.get((table, code))
+        if series is None:
+            series = self._series[(table, code)] = CompactSeries(table)
+        return series
+
+
+index = TableIndex()
+flights = SingleFlight()
+
+
+def ingest(table: str, path: str) -> list:
+    """
+    Fetches whole tables from NBP, indexes them and persists their rates.
+    Concurrent calls for the same tables share one upstream fetch.
+    Parameters:
+    -----------
+    table : str
+        The NBP table letter, `a` or `c`.
+    path : str
+        The path of the tables below the API root, e.g. `2023-01-02/`, `last/10/` or `2023-01-02/2023-03-31/`.
+    Returns:
+    --------
+    list
+        The parsed NBP response, one element per published table in ascending date order.
+    Raises:
+    --------
+        NotFound: If NBP published no table for the requested dates.
+    """
+
+    path = f"tables/{table.lower()}/{path}"
+    return flights.do(path, lambda: _ingest(table, path))
+
+
+async def aingest(table: str, path: str) -> list:
+    """
+    The async version of `ingest`, fetching through the non-blocking client.
+    """
+
+    path = f"tables/{table.lower()}/{path}"
+    return await flights.ado(path, lambda: _aingest(table, path))
+
+
+def windows(start: date, end: date, days: int) -> list:
+    """
+    Splits the dates from `start` to `end` into the windows of `days` days that NBP range queries accept.
+    Windows are aligned on a fixed grid from the first NBP table, so lookups of overlapping ranges fetch, coalesce
+    and record the same windows.
+    """
+
+    start = max(start, EPOCH)
+    first = (start - EPOCH).days // days
+    last = (end - EPOCH).days // days
+    return [(EPOCH + timedelta(days=number * days), EPOCH + timedelta(days=(number + 1) * days - 1))
+            for number in range(first, last + 1)]
+
+
+def ingest_range(table: str, start: date, end: date) -> None:
+    """
+    Makes sure every table published from `start` to `end` is ingested, fetching the missing windows concurrently.
+    Parameters:
+    -----------
+    table : str
+        The NBP table letter, `a` or `c`.
+    start : date
+        The first date of the range.
+    end : date
+        The last date of the range.
+    Raises:
+    --------
+        UpstreamUnavailable: If NBP could not be reached for one of the windows.
+    """
+
+    for _ in ingest_windows(table, start, end):
+        pass
+
+
+def ingest_windows(table: str, start: date, end: date) -> Iterator[tuple]:
+    """
+    Ingests the tables published from `start` to `end` like `ingest_range`, yielding each window in date order
+    as soon as it and the windows before it are ingested, so callers can consume a long range while the rest of
+    it is still being fetched.
+    """
+
+    options = {**RANGE_DEFAULTS, **getattr(settings, "RATES_RANGE", {})}
+    latest = publication.latest_publication(table)
+    ranges = windows(start, min(end, latest), options["WINDOW_DAYS"])
+    with ThreadPoolExecutor(max_workers=options["WORKERS"]) as pool:
+        futures = [None if index.has_window(table, window) else pool.submit(_ingest_window, table, window, latest)
+                   for window in ranges]
+        try:
+            for window, future in zip(ranges, futures):
+                if future is not None:
+                    future.result()
+                yield window
+        finally:
+            for future in futures:
+                if future is not None:
+                    future.cancel()
+
+
+def _ingest_window(table: str, window: tuple, latest: date) -> None:
+    first, last = window
+    try:
+        ingest(table, f"{first.isoformat()}/{min(last, latest).isoformat()}/")
+    except NotFound:
+        pass
+    finally:
+        connection.close()
+    # The latest table may be published late, so only the days before it are known to be complete.
+    index.calendar.add_span(table, first, min(last, latest - timedelta(days=1)))
+    if last <= latest:
+        index.add_window(table, window)
+
+
+def _ingest(table: str, path: str) -> list:
+    tables = cache.responses.get((path,))
+    if tables is None:
+        response = nbp.get_client().get(path)
+        with metrics.decoding(path):
+            tables = _parse(response)
+        cache.responses.set((path,), tables, size=0, expires_at=_expiry(table, path, tables))
+        Rate.objects.bulk_create(index.add(table, tables), ignore_conflicts=True)
+    elif not _indexed(table, tables):
+        index.add(table, tables)
+    return tables
+
+
+async def _aingest(table: str, path: str) -> list:
+    tables = await cache.responses.aget((path,))
+    if tables is None:
+        response = await nbp.get_async_client().get(path)
+        with metrics.decoding(path):
+            tables = _parse(response)
+        await cache.responses.aset((path,), tables, size=0, expires_at=_expiry(table, path, tables))
+        await Rate.objects.abulk_create(index.add(table, tables), ignore_conflicts=True)
+    elif not _indexed(table, tables):
+        index.add(table, tables)
+    return tables
+
+
+def _indexed(table: str, tables: list) -> bool:
+    """
+    Tells whether every table of a cached response is already in the index. The rates of a cached response were
+    stored by the process that fetched it, so a hit is only indexed, when another worker fetched it.
+    """
+
+    return all(index.has_table(table, date.fromisoformat(published["effectiveDate"])) for published in tables)
+
+
+def _expiry(table: str, path: str, tables: list) -> Optional[float]:
+    """
+    Returns when a shared NBP response stops being current: never once every table it asked for is published,
+    with the next table for `last/N` and for ranges reaching the newest tables.
+    """
+
+    newest = date.fromisoformat(tables[-1]["effectiveDate"])
+    dates = path.split("/")[2:-1]
+    if dates[0] != "last" and newest >= min(date.fromisoformat(dates[-1]), publication.latest_publication(table)):
+        return None
+    return cache.last_expiry(table, newest)
+
+
+def _parse(response) -> list:
+    try:
+        return response.json()
+    except JSONDecodeError:
+        # NBP answers "no data" and bad requests with a plain text 404 or 400; anything else is an upstream failure.
+        if response.status_code in (400, 404):
+            service.not_found_raise(response)
+        service.upstream_error_raise(response)
@@ -1,10 +1,77 @@
-from unittest.mock import patch, Mock
+import asyncio
+import gzip
+import hmac
+import io
+import json
+import marshal
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+from datetime import date, datetime, timedelta
+from typing import Optional
+from unittest.mock import AsyncMock, patch, Mock
 
+import aiohttp
+import fakeredis
+import numpy as np
+import requests
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from drf_yasg.errors import SwaggerValidationError
+from rest_framework.exceptions import NotFound
 from rest_framework.test import APIClient, APITestCase
 
+from . import (breaker, cache, limiter, metrics, nbp, profiler, publication, ranges, rates, schema, series, service,
+               stats, sync, tables)
+from .models import Rate
+from .singleflight import SingleFlight
 
-class BaseAPITestCase:
+
+def nbp_tables(payload: dict) -> Mock:
+    """
+    Builds a mocked NBP response with one whole table per rate of the given single-currency `payload`.
+    """
+
+    tables = []
+    for rate in payload["rates"]:
+        data = {key: value for key, value in rate.items() if key not in ("no", "effectiveDate")}
+        data.update(currency=payload["currency"], code=payload["code"])
+        tables.append({"table": payload["table"], "no": rate["no"], "effectiveDate": rate["effectiveDate"],
+                       "rates": [data]})
+    response = Mock(ok=True, content=b"[]")
+    response.json.return_value = tables
+    return response
+
+
+def reset_lookups() -> None:
+    """
+    Empties the rate and response caches and the table index.
+    """
+
+    cache.rates.clear()
+    cache.responses.clear()
+    tables.index.clear()
+
+
+class FreshLookups:
+    """
+    A mixin starting every test with empty caches and an empty table index, so no lookup is answered from an
+    earlier test.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        reset_lookups()
+
+
+class BaseAPITestCase(FreshLookups):
     """
     A base test case class for testing API endpoints using the Django APIClient.
     """
@@ -14,6 +81,7 @@ class BaseAPITestCase:
         Set up the test case by instantiating the APIClient and setting the url_name to an empty string.
         """
 
+        super().setUp()
         self.client = APIClient()
         self.url_name = ""
 
@@ -53,7 +121,7 @@ class BaseAPITestCase:
         self.assertIn(message, response.data["detail"])
 
 
-class AverageRateCurrencyDateTest(APITestCase):
+class AverageRateCurrencyDateTest(FreshLookups, APITestCase):
     """
     Test for AverageRateCurrencyDate class.
     This class defines a set of test cases for the "currency-date" endpoint of the rates API,
@@ -65,6 +133,7 @@ class AverageRateCurrencyDateTest(APITestCase):
         Initializes the client and the URL name to be used in the tests.
         """
 
+        super().setUp()
         self.client = APIClient()
         self.url_name = "rates-api:currency-date"
 
@@ -132,7 +201,7 @@ class AverageRateLastQuotationsTest(BaseAPITestCase, APITestCase):
         self.assertIn("minimum", response.data[message])
         self.assertIn("maximum", response.data[message])
 
-    @patch("requests.get")
+    @patch("rates_api.nbp.NBPClient.get")
     def test_average_rate_last_quotations_mock_valid(self, mock_get):
         """
         Test that the API returns the correct average exchange rate when the response is mocked.
@@ -152,8 +221,7 @@ class AverageRateLastQuotationsTest(BaseAPITestCase, APITestCase):
                 "maximum": max_mock_result
             }
         }
-        mock_get.return_value = Mock(ok=True)
-        mock_get.return_value.json.return_value = mock_response
+        mock_get.return_value = nbp_tables(mock_response)
         url = reverse(self.url_name, args=["gbp", 3])
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
@@ -186,7 +254,7 @@ class DifferenceRateLastQuotationsTest(BaseAPITestCase, APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(message, response.data)
 
-    @patch("requests.get")
+    @patch("rates_api.nbp.NBPClient.get")
     def test_difference_rate_last_quotations_mock_valid(self, mock_get):
         """
         Tests whether the endpoint returns the expected result for a valid request with mocked quotations.
@@ -199,10 +267,2117 @@ class DifferenceRateLastQuotationsTest(BaseAPITestCase, APITestCase):
                              {"no": "078/C/NBP/2023", "effectiveDate": "2023-04-21", "bid": 5.1706, "ask": 5.2750},
                              {"no": "079/C/NBP/2023", "effectiveDate": "2023-04-24", "bid": 5.1540, "ask": 5.2582}]}
         max_mock_result = max([5.2931 - 5.1883, 5.2750 - 5.1706, 5.2582 - 5.1540])
-        mock_get.return_value = Mock(ok=True)
-        mock_get.return_value.json.return_value = mock_response
+        mock_get.return_value = nbp_tables(mock_response)
         url = reverse(self.url_name, args=["gbp", 3])
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data,
                          {"the biggest GBP exchange rate difference for the last 3 quotations": max_mock_result})
+
+
+class NBPClientTest(SimpleTestCase):
+    """
+    Test for NBPClient class.
+    This class checks that upstream calls share one pooled session with timeouts, retries and latency reporting.
+    """
+
+    def setUp(self) -> None:
+        """
+        Builds a client with a small pool and no backoff.
+        """
+
+        self.client = nbp.NBPClient(base_url="http://nbp.test/api/exchangerates/", pool_size=4,
+                                    connect_timeout=1, read_timeout=2, retries=3, backoff_factor=0)
+
+    def test_session_is_pooled_with_retries(self):
+        """
+        Tests that the mounted adapter keeps the configured pool size and retry policy.
+        """
+
+        adapter = self.client.session.get_adapter("http://nbp.test/")
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter.max_retries.total, 3)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+
+    def test_get_passes_timeouts_and_reports_latency(self):
+        """
+        Tests that the call uses the configured timeouts and that its latency is recorded and reported.
+        """
+
+        calls = []
+        self.client.add_listener(lambda path, latency, status: calls.append((path, latency, status)))
+        with patch.object(self.client.session, "get", return_value=Mock(status_code=200)) as mock_get:
+            response = self.client.get("rates/a/gbp/2023-01-02/")
+        mock_get.assert_called_once_with("http://nbp.test/api/exchangerates/rates/a/gbp/2023-01-02/",
+                                         params={"format": "json"}, timeout=(1, 2))
+        self.assertGreaterEqual(response.latency, 0)
+        self.assertEqual(calls, [("rates/a/gbp/2023-01-02/", response.latency, 200)])
+
+    def test_get_network_error(self):
+        """
+        Tests that a network failure is surfaced as a 503 instead of an unhandled error.
+        """
+
+        with patch.object(self.client.session, "get", side_effect=requests.ConnectTimeout()):
+            with self.assertRaises(service.UpstreamUnavailable):
+                self.client.get("rates/a/gbp/2023-01-02/")
+
+    def test_get_client_is_shared(self):
+        """
+        Tests that the views share one client per process.
+        """
+
+        self.assertIs(nbp.get_client(), nbp.get_client())
+
+
+class RateCacheTest(SimpleTestCase):
+    """
+    Test for RateCache class.
+    This class checks LRU eviction, the memory bound and per-entry expiry.
+    """
+
+    def test_evicts_least_recently_used(self):
+        """
+        Tests that the least recently read entry is evicted first when the entry bound is reached.
+        """
+
+        rate_cache = cache.RateCache(max_entries=2, max_bytes=100)
+        rate_cache.set("gbp", 1, size=1)
+        rate_cache.set("eur", 2, size=1)
+        rate_cache.get("gbp")
+        rate_cache.set("usd", 3, size=1)
+        self.assertEqual(rate_cache.get("gbp"), 1)
+        self.assertIsNone(rate_cache.get("eur"))
+        self.assertEqual(rate_cache.get("usd"), 3)
+
+    def test_memory_bound(self):
+        """
+        Tests that entries are evicted to keep the accounted size within the byte bound.
+        """
+
+        rate_cache = cache.RateCache(max_entries=10, max_bytes=10)
+        rate_cache.set("gbp", 1, size=6)
+        rate_cache.set("eur", 2, size=6)
+        rate_cache.set("usd", 3, size=11)
+        self.assertIsNone(rate_cache.get("gbp"))
+        self.assertIsNone(rate_cache.get("usd"))
+        self.assertEqual(rate_cache.size, 6)
+
+    def test_expiry(self):
+        """
+        Tests that an expired entry is dropped while an entry without expiry is kept.
+        """
+
+        rate_cache = cache.RateCache(max_entries=10, max_bytes=100)
+        rate_cache.set("gbp", 1, size=1, expires_at=time.time() - 1)
+        rate_cache.set("eur", 2, size=1)
+        self.assertIsNone(rate_cache.get("gbp"))
+        self.assertEqual(rate_cache.get("eur"), 2)
+        self.assertEqual(len(rate_cache), 1)
+
+
+class PublicationTest(SimpleTestCase):
+    """
+    Test for the NBP publication schedule.
+    """
+
+    def test_latest_and_next_publication(self):
+        """
+        Tests the newest published table and the next publication around a weekend.
+        """
+
+        friday_morning = datetime(2023, 4, 21, 10, 0, tzinfo=publication.WARSAW)
+        saturday = datetime(2023, 4, 22, 13, 0, tzinfo=publication.WARSAW)
+        self.assertEqual(publication.latest_publication("a", friday_morning), date(2023, 4, 20))
+        self.assertEqual(publication.latest_publication("c", friday_morning), date(2023, 4, 21))
+        self.assertEqual(publication.latest_publication("a", saturday), date(2023, 4, 21))
+        self.assertEqual(publication.next_publication("a", saturday),
+                         datetime(2023, 4, 24, 12, 15, tzinfo=publication.WARSAW))
+
+
+class CachedLookupTest(FreshLookups, APITestCase):
+    """
+    Test that repeated lookups are served from the response cache instead of NBP.
+    """
+
+    def setUp(self) -> None:
+        """
+        Initializes the client.
+        """
+
+        super().setUp()
+        self.client = APIClient()
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_past_date_cached(self, mock_get):
+        """
+        Tests that a past-dated rate is fetched from NBP only once.
+        """
+
+        mock_get.return_value = nbp_tables({
+            "table": "A", "currency": "funt szterling", "code": "GBP",
+            "rates": [{"no": "001/A/NBP/2023", "effectiveDate": "2023-01-02", "mid": 5.2768}]})
+        url = reverse("rates-api:currency-date", args=["gbp", "2023-01-02"])
+        self.client.get(url)
+        response = self.client.get(url)
+        self.assertEqual(response.data, {"the average GBP exchange rate dated 2023-01-02": 5.2768})
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_last_quotations_expire_with_next_table(self, mock_get):
+        """
+        Tests that a `last/N` answer is cached until the next publication of its table.
+        """
+
+        mock_get.return_value = nbp_tables({
+            "table": "A", "currency": "funt szterling", "code": "GBP",
+            "rates": [{"no": "079/A/NBP/2023", "effectiveDate": "2023-04-24", "mid": 5.2176}]})
+        monday = datetime(2023, 4, 24, 13, 0, tzinfo=publication.WARSAW)
+        url = reverse("rates-api:last-quotations", args=["gbp", 1])
+        with patch("rates_api.publication.now", return_value=monday):
+            self.client.get(url)
+        expires_at = cache.rates.local._entries[("A", "GBP", "last", 1)][2]
+        self.assertEqual(expires_at, datetime(2023, 4, 25, 12, 15, tzinfo=publication.WARSAW).timestamp())
+
+
+class RateStoreTest(FreshLookups, APITestCase):
+    """
+    Test that the views answer from the local rate store and persist what they fetch from NBP.
+    """
+
+    def setUp(self) -> None:
+        """
+        Initializes the client.
+        """
+
+        super().setUp()
+        self.client = APIClient()
+
+    def test_write_ahead_log(self):
+        """
+        Tests that SQLite databases are used in write-ahead-log mode, so reads never wait on the ingesting workers.
+        """
+
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            self.assertEqual(cursor.fetchone()[0], "wal")
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_currency_date_from_store(self, mock_get):
+        """
+        Tests that a stored rate is answered without calling NBP.
+        """
+
+        Rate.objects.create(table="A", code="GBP", effective_date="2023-01-02", no="001/A/NBP/2023", mid=5.2768)
+        url = reverse("rates-api:currency-date", args=["gbp", "2023-01-02"])
+        response = self.client.get(url)
+        self.assertEqual(response.data, {"the average GBP exchange rate dated 2023-01-02": 5.2768})
+        mock_get.assert_not_called()
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_fetched_rates_are_stored(self, mock_get):
+        """
+        Tests that rates fetched from NBP are persisted.
+        """
+
+        mock_get.return_value = nbp_tables({
+            "table": "C", "currency": "funt szterling", "code": "GBP",
+            "rates": [{"no": "077/C/NBP/2023", "effectiveDate": "2023-04-20", "bid": 5.1883, "ask": 5.2931},
+                      {"no": "078/C/NBP/2023", "effectiveDate": "2023-04-21", "bid": 5.1706, "ask": 5.2750}]})
+        self.client.get(reverse("rates-api:difference-rate", args=["gbp", 2]))
+        stored = Rate.objects.filter(table="C", code="GBP").order_by("effective_date")
+        self.assertEqual([rate.no for rate in stored], ["077/C/NBP/2023", "078/C/NBP/2023"])
+        self.assertEqual(stored[1].ask, 5.2750)
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_last_quotations_from_store(self, mock_get):
+        """
+        Tests that the last quotations are answered from the store only when it holds the latest tables
+        without gaps.
+        """
+
+        for no, day, mid in [("077", "2023-04-20", 5.2296), ("078", "2023-04-21", 5.2086),
+                             ("079", "2023-04-24", 5.2176)]:
+            Rate.objects.create(table="A", code="GBP", effective_date=day, no=f"{no}/A/NBP/2023", mid=mid)
+        url = reverse("rates-api:last-quotations", args=["gbp", 3])
+        with patch("rates_api.publication.latest_publication", return_value=date(2023, 4, 24)):
+            response = self.client.get(url)
+        mock_get.assert_not_called()
+        self.assertEqual(response.data["the average GBP exchange rate for the last 3 quotations"],
+                         {"minimum": 5.2086, "maximum": 5.2296})
+
+        reset_lookups()
+        Rate.objects.filter(no="078/A/NBP/2023").delete()
+        mock_get.return_value = nbp_tables({
+            "table": "A", "currency": "funt szterling", "code": "GBP",
+            "rates": [{"no": "078/A/NBP/2023", "effectiveDate": "2023-04-21", "mid": 5.2086},
+                      {"no": "079/A/NBP/2023", "effectiveDate": "2023-04-24", "mid": 5.2176}]})
+        with patch("rates_api.publication.latest_publication", return_value=date(2023, 4, 24)):
+            self.client.get(reverse("rates-api:last-quotations", args=["gbp", 2]))
+        mock_get.assert_called_once()
+
+
+class TableIngestionTest(FreshLookups, APITestCase):
+    """
+    Test that lookups are served from whole NBP tables shared by every currency.
+    """
+
+    def setUp(self) -> None:
+        """
+        Initializes the client.
+        """
+
+        super().setUp()
+        self.client = APIClient()
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_one_table_fetch_serves_every_currency(self, mock_get):
+        """
+        Tests that lookups of several currencies on one date share a single upstream call, and that a currency
+        missing from an ingested table is answered with a 404 locally.
+        """
+
+        mock_get.return_value = Mock(ok=True, content=b"[]")
+        mock_get.return_value.json.return_value = [
+            {"table": "A", "no": "001/A/NBP/2023", "effectiveDate": "2023-01-02",
+             "rates": [{"currency": "funt szterling", "code": "GBP", "mid": 5.2768},
+                       {"currency": "euro", "code": "EUR", "mid": 4.6784}]}]
+        gbp = self.client.get(reverse("rates-api:currency-date", args=["gbp", "2023-01-02"]))
+        eur = self.client.get(reverse("rates-api:currency-date", args=["eur", "2023-01-02"]))
+        missing = self.client.get(reverse("rates-api:currency-date", args=["xyz", "2023-01-02"]))
+        mock_get.assert_called_once_with("tables/a/2023-01-02/")
+        self.assertEqual(gbp.data, {"the average GBP exchange rate dated 2023-01-02": 5.2768})
+        self.assertEqual(eur.data, {"the average EUR exchange rate dated 2023-01-02": 4.6784})
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(missing.data["detail"], service.NO_DATA)
+        self.assertEqual(Rate.objects.filter(effective_date="2023-01-02").count(), 2)
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_cached_response_is_not_ingested_again(self, mock_get):
+        """
+        Tests that a response served from the cache is neither indexed nor stored again once the index holds it,
+        and is indexed when it does not.
+        """
+
+        mock_get.return_value = nbp_range("tables/a/2023-01-02/2023-01-06/")
+        tables.ingest("a", "2023-01-02/2023-01-06/")
+        with patch("rates_api.tables.index.add", wraps=tables.index.add) as add, \
+                patch("rates_api.models.Rate.objects.bulk_create") as bulk_create:
+            tables.ingest("a", "2023-01-02/2023-01-06/")
+            add.assert_not_called()
+            tables.index.clear()
+            tables.ingest("a", "2023-01-02/2023-01-06/")
+            add.assert_called_once()
+        bulk_create.assert_not_called()
+        mock_get.assert_called_once()
+        self.assertEqual(tables.index.rate("a", "gbp", date(2023, 1, 4))["mid"], 0.4)
+
+
+class AsyncViewsTest(FreshLookups, TestCase):
+    """
+    Test for the async views served under ASGI.
+    """
+
+    def setUp(self) -> None:
+        """
+        Initializes the async client.
+        """
+
+        super().setUp()
+        self.async_client = AsyncClient()
+
+    @patch("rates_api.nbp.AsyncNBPClient.get", new_callable=AsyncMock)
+    async def test_async_endpoints(self, mock_get):
+        """
+        Tests that the async endpoints answer like their sync counterparts.
+        """
+
+        mock_get.return_value = nbp_tables({
+            "table": "C", "currency": "funt szterling", "code": "GBP",
+            "rates": [{"no": "077/C/NBP/2023", "effectiveDate": "2023-04-20", "bid": 5.1883, "ask": 5.2931},
+                      {"no": "078/C/NBP/2023", "effectiveDate": "2023-04-21", "bid": 5.1706, "ask": 5.2750}]})
+        response = await self.async_client.get(reverse("rates-api:async-difference-rate", args=["gbp", 2]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(),
+                         {"the biggest GBP exchange rate difference for the last 2 quotations": 0.1048})
+        mock_get.assert_awaited_once_with("tables/c/last/2/")
+        await nbp.close_async_client()
+
+    def test_session_closed_under_wsgi(self):
+        """
+        Tests that an async view served under WSGI, on an event loop of its own, closes the client of that loop.
+        """
+
+        clients = []
+
+        async def upstream(client, path):
+            clients.append(client)
+            return nbp_tables({"table": "A", "currency": "funt szterling", "code": "GBP",
+                               "rates": [{"no": "001/A/NBP/2023", "effectiveDate": "2023-01-02", "mid": 5.2768}]})
+
+        with patch("rates_api.nbp.AsyncNBPClient.get", autospec=True, side_effect=upstream):
+            response = Client().get(reverse("rates-api:async-currency-date", args=["gbp", "2023-01-02"]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(clients), 1)
+        self.assertTrue(clients[0].session.closed)
+
+    async def test_async_errors(self):
+        """
+        Tests that API errors are rendered with their status code and detail.
+        """
+
+        response = await self.async_client.get(reverse("rates-api:async-last-quotations", args=["gbp", 0]))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("The number of quotations cannot be less than one", response.json()["detail"])
+
+
+class FakeUpstream:
+    """
+    Stands in for the response context manager of `aiohttp.ClientSession.get`.
+    """
+
+    def __init__(self, status: int, body: bytes = b"[]") -> None:
+        self.status = status
+        self.body = body
+
+    async def __aenter__(self) -> "FakeUpstream":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        pass
+
+    async def read(self) -> bytes:
+        return self.body
+
+
+class AsyncNBPClientTest(SimpleTestCase):
+    """
+    Test for AsyncNBPClient class.
+    """
+
+    async def asyncSetUp(self) -> None:
+        self.client = nbp.AsyncNBPClient(base_url="http://nbp.test/api/exchangerates/", pool_size=4,
+                                         connect_timeout=1, read_timeout=2, retries=2, backoff_factor=0)
+
+    async def test_get_retries_transient_errors(self):
+        """
+        Tests that a transient 503 is retried and the final response carries its latency.
+        """
+
+        await self.asyncSetUp()
+        with patch.object(self.client.session, "get", side_effect=[FakeUpstream(503), FakeUpstream(200)]) as get:
+            response = await self.client.get("tables/a/last/1/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+        get.assert_called_with("http://nbp.test/api/exchangerates/tables/a/last/1/", params={"format": "json"})
+        self.assertGreaterEqual(response.latency, 0)
+        await self.client.session.close()
+
+    async def test_get_network_error(self):
+        """
+        Tests that a network failure is surfaced as a 503.
+        """
+
+        await self.asyncSetUp()
+        with patch.object(self.client.session, "get", side_effect=aiohttp.ClientConnectionError()):
+            with self.assertRaises(service.UpstreamUnavailable):
+                await self.client.get("tables/a/last/1/")
+        await self.client.session.close()
+
+
+class SingleFlightTest(SimpleTestCase):
+    """
+    Test for SingleFlight class.
+    This class checks that concurrent identical fetches are coalesced into one call.
+    """
+
+    def test_threads_share_one_call(self):
+        """
+        Tests that threads asking for the same key while a call is in flight share its result.
+        """
+
+        flights = SingleFlight()
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return ["table"]
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flights.do("tables/a/last/10/", fetch)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flights.do("tables/a/last/10/", fetch)))
+                     for _ in range(4)]
+        for follower in followers:
+            follower.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [["table"]] * 5)
+        self.assertEqual(flights.do("tables/a/last/10/", lambda: ["fresh"]), ["fresh"])
+
+    def test_threads_share_errors(self):
+        """
+        Tests that the exception of the call that ran is raised to every caller.
+        """
+
+        flights = SingleFlight()
+
+        def fetch():
+            raise service.UpstreamUnavailable()
+
+        with self.assertRaises(service.UpstreamUnavailable):
+            flights.do("tables/a/last/10/", fetch)
+
+    async def test_tasks_share_one_call(self):
+        """
+        Tests that tasks of one event loop asking for the same key share one call.
+        """
+
+        flights = SingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return ["table"]
+
+        results = await asyncio.gather(*(flights.ado("tables/c/last/10/", fetch) for _ in range(5)))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [["table"]] * 5)
+
+    async def test_cancelled_leader(self):
+        """
+        Tests that cancelling the task which started a call leaves it running for the tasks waiting for it.
+        """
+
+        flights = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return ["table"]
+
+        leader = asyncio.create_task(flights.ado("tables/a/last/10/", fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.ado("tables/a/last/10/", fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        self.assertEqual(await follower, ["table"])
+        self.assertTrue(leader.cancelled())
+
+
+class BatchRatesTest(FreshLookups, TransactionTestCase):
+    """
+    Test for BatchRates class.
+    This class checks that a batch is deduplicated, fetched with one upstream call per table and answered per item.
+    """
+
+    def setUp(self) -> None:
+        """
+        Initializes the client.
+        """
+
+        super().setUp()
+        self.client = APIClient()
+        self.url = reverse("rates-api:batch")
+
+    @staticmethod
+    def upstream(path: str) -> Mock:
+        """
+        Answers the table fetches of the batch.
+        """
+
+        table_rates = [{"currency": "funt szterling", "code": "GBP", "mid": 5.2768},
+                       {"currency": "euro", "code": "EUR", "mid": 4.6784}]
+        if path == "tables/a/2023-01-02/":
+            tables_data = [{"table": "A", "no": "001/A/NBP/2023", "effectiveDate": "2023-01-02", "rates": table_rates}]
+        else:
+            tables_data = [{"table": "A", "no": "078/A/NBP/2023", "effectiveDate": "2023-04-21", "rates": table_rates},
+                           {"table": "A", "no": "079/A/NBP/2023", "effectiveDate": "2023-04-24",
+                            "rates": [dict(rate, mid=rate["mid"] + 0.1) for rate in table_rates]}]
+        response = Mock(ok=True, content=b"[]")
+        response.json.return_value = tables_data
+        return response
+
+    @patch("rates_api.publication.latest_publication", return_value=date(2023, 4, 24))
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_batch(self, mock_get, mock_latest):
+        """
+        Tests the results of a mixed batch and that it needs one upstream call per distinct table fetch.
+        """
+
+        mock_get.side_effect = self.upstream
+        items = [{"code": "gbp", "date": "2023-01-02"},
+                 {"code": "eur", "date": "2023-01-02"},
+                 {"code": "gbp", "date": "2023-01-02"},
+                 {"code": "gbp", "number": 2},
+                 {"code": "eur", "number": 1},
+                 {"code": "xyz", "date": "2023-01-02"},
+                 {"code": "gbp", "number": 0},
+                 {"code": "gbp"}]
+        response = self.client.post(self.url, {"items": items}, format="json")
+        self.assertEqual(response.status_code, 200)
+        results = response.data["results"]
+        self.assertEqual(results[0], {"item": items[0],
+                                      "result": {"the average GBP exchange rate dated 2023-01-02": 5.2768}})
+        self.assertEqual(results[1]["result"], {"the average EUR exchange rate dated 2023-01-02": 4.6784})
+        self.assertEqual(results[2]["result"], results[0]["result"])
+        self.assertEqual(results[3]["result"],
+                         {"the average GBP exchange rate for the last 2 quotations":
+                              {"minimum": 5.2768, "maximum": 5.2768 + 0.1}})
+        self.assertEqual(results[4]["result"],
+                         {"the average EUR exchange rate for the last 1 quotations":
+                              {"minimum": 4.6784 + 0.1, "maximum": 4.6784 + 0.1}})
+        self.assertEqual(results[5]["error"], {"status": 404, "detail": service.NO_DATA})
+        self.assertEqual(results[6]["error"]["status"], 400)
+        self.assertEqual(results[7]["error"]["status"], 400)
+        self.assertEqual(sorted(call.args[0] for call in mock_get.call_args_list),
+                         ["tables/a/2023-01-02/", "tables/a/last/2/"])
+
+    def test_batch_invalid_body(self):
+        """
+        Tests that a body without a list of items is rejected.
+        """
+
+        response = self.client.post(self.url, {"items": "gbp"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+class ConvertAmountsTest(FreshLookups, TransactionTestCase):
+    """
+    Test for ConvertAmounts class.
+    This class checks the cross rates and converted amounts on a date and over a range, and the validation of the body.
+    """
+
+    def setUp(self) -> None:
+        """
+        Initializes the client.
+        """
+
+        super().setUp()
+        self.client = APIClient()
+        self.url = reverse("rates-api:convert")
+
+    @staticmethod
+    def upstream(path: str) -> Mock:
+        """
+        Answers the table fetches with USD and EUR rates, EUR missing from the table of 2023-01-03.
+        """
+
+        days = {"2023-01-02": [4.4018, 4.6899], "2023-01-03": [4.4168, None], "2023-01-04": [4.3910, 4.6713]}
+        first, last = path.split("/")[2], path.rstrip("/").split("/")[-1]
+        tables_data = []
+        for number, (day, (usd, eur)) in enumerate(days.items(), start=1):
+            if first <= day <= last:
+                table_rates = [{"currency": "dolar amerykański", "code": "USD", "mid": usd}]
+                if eur is not None:
+                    table_rates.append({"currency": "euro", "code": "EUR", "mid": eur})
+                tables_data.append({"table": "A", "no": f"00{number}/A/NBP/2023", "effectiveDate": day,
+                                    "rates": table_rates})
+        response = Mock(ok=bool(tables_data), status_code=200 if tables_data else 404, content=b"[]")
+        response.json.return_value = tables_data
+        return response
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_convert_date(self, mock_get):
+        """
+        Tests the cross rates and amounts on a date, the zloty included, with one upstream call for every currency.
+        """
+
+        mock_get.side_effect = self.upstream
+        response = self.client.post(self.url, {"base": "usd", "targets": ["eur", "pln", "usd"], "amounts": [1, 250.5],
+                                               "date": "2023-01-02"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["base"], "USD")
+        [conversion] = response.data["conversions"]
+        self.assertEqual(conversion["effectiveDate"], "2023-01-02")
+        self.assertAlmostEqual(conversion["rates"]["EUR"], 4.4018 / 4.6899)
+        self.assertEqual(conversion["rates"]["PLN"], 4.4018)
+        self.assertEqual(conversion["rates"]["USD"], 1.0)
+        self.assertEqual(conversion["amounts"]["EUR"], [round(4.4018 / 4.6899, 4), round(250.5 * 4.4018 / 4.6899, 4)])
+        self.assertEqual(conversion["amounts"]["PLN"], [4.4018, round(250.5 * 4.4018, 4)])
+        self.assertEqual(conversion["amounts"]["USD"], [1.0, 250.5])
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_convert_range(self, mock_get):
+        """
+        Tests that a range is fetched once and converted on the dates quoting every currency.
+        """
+
+        mock_get.side_effect = self.upstream
+        response = self.client.post(self.url, {"base": "pln", "targets": ["eur", "usd"], "amounts": [100],
+                                               "start": "2023-01-02", "end": "2023-01-04"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        conversions = response.data["conversions"]
+        self.assertEqual([conversion["effectiveDate"] for conversion in conversions], ["2023-01-02", "2023-01-04"])
+        self.assertEqual(conversions[1]["amounts"], {"EUR": [round(100 / 4.6713, 4)], "USD": [round(100 / 4.3910, 4)]})
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_convert_missing(self, mock_get):
+        """
+        Tests that a currency not quoted on the date is not found.
+        """
+
+        mock_get.side_effect = self.upstream
+        response = self.client.post(self.url, {"base": "usd", "targets": ["eur"], "amounts": [1],
+                                               "date": "2023-01-03"}, format="json")
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(RATES_CONVERT={"MAX_TARGETS": 2, "MAX_VALUES": 3})
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_convert_invalid(self, mock_get):
+        """
+        Tests that malformed bodies and conversions beyond the limits are rejected.
+        """
+
+        mock_get.side_effect = self.upstream
+        for body in ({"targets": ["eur"], "amounts": [1], "date": "2023-01-02"},
+                     {"base": "usd", "targets": [], "amounts": [1], "date": "2023-01-02"},
+                     {"base": "usd", "targets": ["eur"], "amounts": ["1"], "date": "2023-01-02"},
+                     {"base": "usd", "targets": ["eur"], "amounts": [1]},
+                     {"base": "usd", "targets": ["eur", "pln", "usd"], "amounts": [1], "date": "2023-01-02"},
+                     {"base": "usd", "targets": ["eur", "pln"], "amounts": [1, 2], "date": "2023-01-02"}):
+            response = self.client.post(self.url, body, format="json")
+            self.assertEqual(response.status_code, 400, body)
+
+    @override_settings(RATES_CONVERT={"MAX_VALUES": 1000})
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_convert_too_long_range(self, mock_get):
+        """
+        Tests that a range which could exceed the values allowed is rejected before anything is fetched from NBP.
+        """
+
+        response = self.client.post(self.url, {"base": "eur", "targets": ["usd", "gbp"], "amounts": [1, 2],
+                                               "start": "2020-01-01", "end": "2023-01-01"}, format="json")
+        self.assertEqual(response.status_code, 400)
+        mock_get.assert_not_called()
+
+
+def nbp_range(path: str) -> Mock:
+    """
+    Builds a mocked NBP response for a `tables/a/<start>/<end>/` path, with one GBP rate per weekday whose mid
+    encodes the date, in tables numbered by weekday of the year.
+    """
+
+    start, end = (date.fromisoformat(part) for part in path.split("/")[2:4])
+    tables_data = []
+    for offset in range((end - start).days + 1):
+        day = start + timedelta(days=offset)
+        if day.weekday() < 5:
+            number = np.busday_count(date(day.year, 1, 1), day) + 1
+            tables_data.append({"table": "A", "no": f"{number:03d}/A/NBP/{day.year}",
+                                "effectiveDate": day.isoformat(),
+                                "rates": [{"currency": "funt szterling", "code": "GBP", "mid": day.day / 10}]})
+    response = Mock(ok=True, content=b"[]")
+    response.json.return_value = tables_data
+    return response
+
+
+@override_settings(RATES_RANGE={"WINDOW_DAYS": 10, "WORKERS": 3})
+class AverageRateDateRangeTest(FreshLookups, TransactionTestCase):
+    """
+    Test for AverageRateDateRange class.
+    This class checks that long ranges are fetched in aligned windows and merged in date order.
+    """
+
+    def setUp(self) -> None:
+        """
+        Initializes the client.
+        """
+
+        super().setUp()
+        self.client = APIClient()
+
+    def test_windows_are_aligned(self):
+        """
+        Tests that ranges are split on a fixed grid of windows.
+        """
+
+        self.assertEqual(tables.windows(date(2002, 1, 5), date(2002, 1, 13), 10),
+                         [(date(2002, 1, 2), date(2002, 1, 11)), (date(2002, 1, 12), date(2002, 1, 21))])
+        self.assertEqual(tables.windows(date(1999, 1, 1), date(2002, 1, 3), 10),
+                         [(date(2002, 1, 2), date(2002, 1, 11))])
+
+    @patch("rates_api.publication.latest_publication", return_value=date(2023, 6, 30))
+    @patch("rates_api.nbp.NBPClient.get", side_effect=nbp_range)
+    def test_date_range(self, mock_get, mock_latest):
+        """
+        Tests that a range spanning several windows returns every rate in order and that an overlapping range is
+        answered from the windows already ingested.
+        """
+
+        response = self.client.get(reverse("rates-api:date-range", args=["gbp", "2023-01-02", "2023-02-10"]))
+        self.assertEqual(response.status_code, 200)
+        series = response.data["the average GBP exchange rates from 2023-01-02 to 2023-02-10"]
+        days = [rate["effectiveDate"] for rate in series]
+        self.assertEqual(days, sorted(days))
+        self.assertEqual(days[0], "2023-01-02")
+        self.assertEqual(days[-1], "2023-02-10")
+        self.assertEqual(len(days), 30)
+        self.assertEqual(mock_get.call_count, len(tables.windows(date(2023, 1, 2), date(2023, 2, 10), 10)))
+
+        calls = mock_get.call_count
+        self.client.get(reverse("rates-api:date-range", args=["gbp", "2023-01-10", "2023-02-01"]))
+        self.assertEqual(mock_get.call_count, calls)
+
+    def test_invalid_range(self):
+        """
+        Tests that a range ending before it starts is rejected without calling NBP.
+        """
+
+        response = self.client.get(reverse("rates-api:date-range", args=["gbp", "2023-02-10", "2023-01-02"]))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Invalid date range", response.data["detail"])
+
+    @patch("rates_api.publication.latest_publication", return_value=date(2023, 6, 30))
+    @patch("rates_api.nbp.NBPClient.get", side_effect=nbp_range)
+    def test_date_range_csv(self, mock_get, mock_latest):
+        """
+        Tests that `?format=csv` streams the range as CSV rows in date order.
+        """
+
+        response = self.client.get(reverse("rates-api:date-range", args=["gbp", "2023-01-02", "2023-02-10"]),
+                                    {"format": "csv"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertTrue(response["Content-Type"].startswith("text/csv"))
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], "effectiveDate,no,mid")
+        self.assertEqual(len(lines), 31)
+        self.assertEqual(lines[1], "2023-01-02,001/A/NBP/2023,0.2")
+        self.assertTrue(lines[-1].startswith("2023-02-10,"))
+
+    @patch("rates_api.publication.latest_publication", return_value=date(2023, 6, 30))
+    @patch("rates_api.nbp.NBPClient.get", side_effect=nbp_range)
+    def test_date_range_ndjson(self, mock_get, mock_latest):
+        """
+        Tests that `?format=ndjson` streams one JSON rate per line in date order.
+        """
+
+        response = self.client.get(reverse("rates-api:date-range", args=["gbp", "2023-01-02", "2023-01-31"]),
+                                   {"format": "ndjson"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        rates_data = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([rate["effectiveDate"] for rate in rates_data][:2], ["2023-01-02", "2023-01-03"])
+        self.assertEqual(len(rates_data), 22)
+        self.assertEqual(rates_data[0], {"no": "001/A/NBP/2023", "effectiveDate": "2023-01-02", "mid": 0.2})
+
+    def test_invalid_range_csv(self):
+        """
+        Tests that a malformed range is still rejected before streaming starts.
+        """
+
+        response = self.client.get(reverse("rates-api:date-range", args=["gbp", "2023-02-10", "2023-01-02"]),
+                                   {"format": "csv"})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.streaming)
+
+
+class StatisticsTest(FreshLookups, APITestCase):
+    """
+    Test for the vectorized statistics kernel and the statistics views.
+    """
+
+    RATES = {"table": "A", "currency": "funt szterling", "code": "GBP",
+             "rates": [{"no": f"00{day}/A/NBP/2023", "effectiveDate": f"2023-01-0{day}", "mid": mid}
+                       for day, mid in zip(range(2, 7), (5.0, 5.2, 5.1, 5.4, 5.3))]}
+
+    def setUp(self) -> None:
+        """
+        Initializes the client.
+        """
+
+        super().setUp()
+        self.client = APIClient()
+
+    def test_kernel(self):
+        """
+        Tests the metrics of one series against their definitions.
+        """
+
+        values = np.array([5.0, 5.2, 5.1, 5.4, 5.3])
+        result = stats.compute(values, stats.METRICS, percentiles=(50, 100), window=2)
+        self.assertEqual(result["min"], 5.0)
+        self.assertEqual(result["max"], 5.4)
+        self.assertAlmostEqual(result["mean"], 5.2)
+        self.assertAlmostEqual(result["stdev"], float(np.std(values, ddof=1)))
+        self.assertEqual(result["percentiles"], {"p50": 5.2, "p100": 5.4})
+        returns = [float(np.log(after / before)) for before, after in zip(values, values[1:])]
+        self.assertEqual(len(result["log_returns"]), 4)
+        for computed, expected in zip(result["log_returns"], returns):
+            self.assertAlmostEqual(computed, expected)
+        for computed, expected in zip(result["rolling_mean"], (5.1, 5.15, 5.25, 5.35)):
+            self.assertAlmostEqual(computed, expected)
+        self.assertAlmostEqual(result["volatility"], float(np.std(returns, ddof=1)))
+        for computed, expected in zip(result["rolling_volatility"],
+                                      (np.std(returns[i:i + 2], ddof=1) for i in range(3))):
+            self.assertAlmostEqual(computed, float(expected))
+
+    def test_kernel_many_series(self):
+        """
+        Tests that a 2-D array is analysed one series per row and that undefined values are None.
+        """
+
+        result = stats.compute(np.array([[1.0, 3.0], [2.0, 2.0]]), ("mean", "max"))
+        self.assertEqual(result, {"mean": [2.0, 2.0], "max": [3.0, 2.0]})
+        self.assertEqual(stats.compute(np.array([4.0]), ("stdev", "volatility")), {"stdev": None, "volatility": None})
+
+    def test_max_spread_matches_rounded_loop(self):
+        """
+        Tests that the vectorized biggest spread equals the biggest of the spreads rounded one by one.
+        """
+
+        rng = np.random.default_rng(0)
+        bids = rng.uniform(3, 5, 500).round(4)
+        asks = (bids + rng.uniform(0, 0.2, 500)).round(4)
+        rates_data = [{"bid": float(bid), "ask": float(ask)} for bid, ask in zip(bids, asks)]
+        expected = max(round(rate["ask"] - rate["bid"], 4) for rate in rates_data)
+        body = stats.compute(stats.spreads(rates_data), ("max_spread",))
+        self.assertEqual(round(body["max_spread"], 4), expected)
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_last_quotations_statistics(self, mock_get):
+        """
+        Tests that the endpoint returns the selected metrics of the last N quotations.
+        """
+
+        mock_get.return_value = nbp_tables(self.RATES)
+        response = self.client.get(reverse("rates-api:last-quotations-statistics", args=["gbp", 5]),
+                                   {"metrics": "min,max,rolling_mean", "window": "2"})
+        self.assertEqual(response.status_code, 200)
+        body = response.data["the GBP exchange rate statistics for the last 5 quotations"]
+        self.assertEqual(body["count"], 5)
+        self.assertEqual((body["min"], body["max"]), (5.0, 5.4))
+        self.assertEqual(len(body["rolling_mean"]), 4)
+        self.assertNotIn("stdev", body)
+
+    def test_invalid_options(self):
+        """
+        Tests that unknown metrics and out-of-range windows are rejected without calling NBP.
+        """
+
+        url = reverse("rates-api:last-quotations-statistics", args=["gbp", 5])
+        response = self.client.get(url, {"metrics": "min,median"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("median", response.data["detail"])
+        self.assertEqual(self.client.get(url, {"metrics": "rolling_mean", "window": "6"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"percentiles": "101"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"metrics": "max_spread"}).status_code, 400)
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_fewer_quotations_than_the_window(self, mock_get):
+        """
+        Tests that the default window only bounds the rolling metrics, so fewer quotations than it are analysed.
+        """
+
+        mock_get.return_value = nbp_tables({**self.RATES, "rates": self.RATES["rates"][-3:]})
+        response = self.client.get(reverse("rates-api:last-quotations-statistics", args=["gbp", 3]))
+        self.assertEqual(response.status_code, 200)
+        body = response.data["the GBP exchange rate statistics for the last 3 quotations"]
+        self.assertEqual((body["count"], body["min"], body["max"]), (3, 5.1, 5.4))
+
+
+class RangeIndexTest(FreshLookups, TransactionTestCase):
+    """
+    Test for the range-query index of the rate series and the routes it backs.
+    """
+
+    def setUp(self) -> None:
+        """
+        Initializes the client.
+        """
+
+        super().setUp()
+        self.client = APIClient()
+
+    @patch("rates_api.ranges.BLOCK", 4)
+    def test_queries_match_brute_force(self):
+        """
+        Tests every window of a series grown by appends and by out-of-order inserts against a linear scan.
+        """
+
+        rng = np.random.default_rng(1)
+        values = rng.uniform(3, 5, 40).tolist()
+        days = [date(2023, 1, 1) + timedelta(days=offset) for offset in range(40)]
+        source = series.CompactSeries("a")
+        index = ranges.RangeIndex()
+        for day, value in list(zip(days, values))[10:] + list(zip(days, values))[:10]:
+            index.track("a", "gbp", source, source.put(day, f"001/A/NBP/{day.year}", {"mid": value}))
+            self.assertEqual(index.extremes("a", "gbp", "mid", day, day), (1, value, value))
+        for first in range(40):
+            for last in range(first, 40):
+                window = values[first:last + 1]
+                self.assertEqual(index.extremes("a", "gbp", "mid", days[first], days[last]),
+                                 (len(window), min(window), max(window)))
+        self.assertIsNone(index.extremes("a", "gbp", "mid", date(2022, 1, 1), date(2022, 12, 31)))
+
+    @patch("rates_api.ranges.BLOCK", 4)
+    def test_appends_extend_in_place(self):
+        """
+        Tests that days appended to a series extend its levels without rebuilding them, and that a changed day
+        does.
+        """
+
+        source = series.CompactSeries("a")
+        index = ranges.RangeIndex()
+        days = [date(2023, 1, 1) + timedelta(days=offset) for offset in range(30)]
+        with patch("rates_api.ranges.Series._rebuild", autospec=True, side_effect=ranges.Series._rebuild) as rebuild:
+            for offset, day in enumerate(days):
+                index.track("a", "gbp", source, source.put(day, "001/A/NBP/2023", {"mid": 4 + offset % 7}))
+                self.assertEqual(index.extremes("a", "gbp", "mid", days[0], day), (offset + 1, 4, 4 + min(offset, 6)))
+            self.assertEqual(rebuild.call_count, 1)
+            index.track("a", "gbp", source, source.put(days[3], "001/A/NBP/2023", {"mid": 4 + 3 % 7}))
+            self.assertEqual(index.extremes("a", "gbp", "mid", days[0], days[-1]), (30, 4, 10))
+            self.assertEqual(rebuild.call_count, 1)
+            index.track("a", "gbp", source, source.put(days[3], "001/A/NBP/2023", {"mid": 11}))
+            self.assertEqual(index.extremes("a", "gbp", "mid", days[0], days[-1]), (30, 4, 11))
+            self.assertEqual(rebuild.call_count, 2)
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_last_quotations_use_the_index(self, mock_get):
+        """
+        Tests that the last-quotations and difference routes answer from the indexed series.
+        """
+
+        mock_get.return_value = nbp_tables({
+            "table": "C", "currency": "funt szterling", "code": "GBP",
+            "rates": [{"no": "001/C/NBP/2023", "effectiveDate": "2023-01-02", "bid": 5.2, "ask": 5.3},
+                      {"no": "002/C/NBP/2023", "effectiveDate": "2023-01-03", "bid": 5.1, "ask": 5.35}]})
+        with patch("rates_api.ranges.RangeIndex.extremes", wraps=tables.index.ranges.extremes) as extremes:
+            response = self.client.get(reverse("rates-api:difference-rate", args=["gbp", 2]))
+        self.assertEqual(response.data, {"the biggest GBP exchange rate difference for the last 2 quotations": 0.25})
+        extremes.assert_called_once_with("c", "gbp", "spread", date(2023, 1, 2), date(2023, 1, 3))
+
+    @patch("rates_api.publication.latest_publication", return_value=date(2023, 6, 30))
+    @patch("rates_api.nbp.NBPClient.get", side_effect=nbp_range)
+    @override_settings(RATES_RANGE={"WINDOW_DAYS": 10, "WORKERS": 3})
+    def test_date_range_extremes(self, mock_get, mock_latest):
+        """
+        Tests the extremes of a date range longer than 255 quotations.
+        """
+
+        response = self.client.get(reverse("rates-api:date-range-extremes", args=["gbp", "2022-01-01", "2023-03-31"]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"the average GBP exchange rate from 2022-01-01 to 2023-03-31":
+                                         {"minimum": 0.1, "maximum": 3.1}})
+        self.assertEqual(tables.index.ranges.extremes("a", "gbp", "mid", date(2022, 1, 1), date(2023, 3, 31))[0],
+                         325)
+
+
+class CompactSeriesTest(FreshLookups, TestCase):
+    """
+    Test for the compact series of the table index and their memory-mapped snapshot.
+    """
+
+    def test_lookups(self):
+        """
+        Tests that rates put out of order are found by date and listed in date order.
+        """
+
+        one = series.CompactSeries("c")
+        for day in (3, 5, 2):
+            one.put(date(2023, 1, day), f"00{day}/C/NBP/2023", {"bid": day + 0.5, "ask": day + 0.75})
+        one.put(date(2023, 1, 3), "003/C/NBP/2023", {"bid": 1.0, "ask": 2.0}, replace=False)
+        self.assertEqual(one.get(date(2023, 1, 3)),
+                         {"no": "003/C/NBP/2023", "effectiveDate": "2023-01-03", "bid": 3.5, "ask": 3.75})
+        self.assertIsNone(one.get(date(2023, 1, 4)))
+        self.assertEqual(one.value(date(2023, 1, 5), "ask"), 5.75)
+        self.assertEqual([rate["effectiveDate"] for rate in one.between(date(2023, 1, 1), date(2023, 1, 4))],
+                         ["2023-01-02", "2023-01-03"])
+
+    def test_snapshot(self):
+        """
+        Tests that a snapshot is mapped back with the same rates, feeds the range index and copies a series on
+        its first change.
+        """
+
+        tables.index.add("a", nbp_range("tables/a/2023-01-02/2023-01-31/").json())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "rates.snapshot")
+            tables.index.save_snapshot(path)
+            expected = tables.index.rates_between("a", "gbp", date(2023, 1, 1), date(2023, 1, 31))
+            tables.index.clear()
+            tables.index.load_snapshot(path)
+            self.assertEqual(tables.index.rates_between("a", "gbp", date(2023, 1, 1), date(2023, 1, 31)), expected)
+            self.assertTrue(tables.index.has_table("a", date(2023, 1, 2)))
+            self.assertEqual(tables.index.ranges.extremes("a", "gbp", "mid", date(2023, 1, 2), date(2023, 1, 31)),
+                             (22, 0.2, 3.1))
+            tables.index.add("a", nbp_range("tables/a/2023-02-01/2023-02-01/").json())
+            self.assertEqual(tables.index.rate("a", "gbp", date(2023, 2, 1))["mid"], 0.1)
+            self.assertEqual(len(tables.index.rates_between("a", "gbp", date(2023, 1, 1), date(2023, 2, 1))), 23)
+
+    def test_snapshot_memory(self):
+        """
+        Tests that mapping a snapshot of 35 currencies over 25 years and querying the extremes of each of them
+        allocates a small fraction of the snapshot size, the rates being read from the mapped file.
+        """
+
+        first, count = date(2002, 1, 2).toordinal(), 6214
+        values = np.random.default_rng(1).uniform(1, 5, count)
+        written = {("A", f"C{number:02d}"): series.CompactSeries("a", array("i", range(first, first + count)),
+                                                                 array("H", [1] * count), {"mid": array("d", values)})
+                   for number in range(35)}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "rates.snapshot")
+            series.write_snapshot(path, written)
+            tracemalloc.start()
+            try:
+                tables.index.load_snapshot(path)
+                for _, code in written:
+                    found = tables.index.ranges.extremes("a", code, "mid", date.fromordinal(first + 3),
+                                                         date.fromordinal(first + count - 5))
+                    self.assertEqual(found, (count - 7, values[3:-4].min(), values[3:-4].max()))
+                allocated = tracemalloc.get_traced_memory()[0]
+            finally:
+                tracemalloc.stop()
+            self.assertLess(allocated, os.path.getsize(path))
+            tables.index.clear()
+
+    def test_snapshot_command(self):
+        """
+        Tests that the snapshot command writes the stored rates.
+        """
+
+        Rate.objects.bulk_create(tables.TableIndex().add("a", nbp_range("tables/a/2023-01-02/2023-01-06/").json()))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "rates.snapshot")
+            call_command("snapshot_rates", path=path, stdout=io.StringIO())
+            self.assertEqual(len(series.read_snapshot(path)[("A", "GBP")]), 5)
+
+
+def nbp_missing(path: str = "") -> Mock:
+    """
+    Builds the mocked non-JSON answer NBP gives when it has no table for the requested dates.
+    """
+
+    response = Mock(ok=False, status_code=404, content=b"404 NotFound - Not Found - Brak danych")
+    response.json.side_effect = json.JSONDecodeError("Expecting value", "", 0)
+    return response
+
+
+@override_settings(RATES_RANGE={"WINDOW_DAYS": 10, "WORKERS": 3})
+class PublicationCalendarTest(FreshLookups, TransactionTestCase):
+    """
+    Test that lookups known to miss are answered without calling NBP and that the nearest previous rate is found.
+    """
+
+    def setUp(self) -> None:
+        """
+        Initializes the client.
+        """
+
+        super().setUp()
+        self.client = APIClient()
+
+    @patch("rates_api.nbp.NBPClient.get", side_effect=nbp_missing)
+    def test_weekend_and_malformed_code(self, mock_get):
+        """
+        Tests that weekends and malformed currency codes are answered locally.
+        """
+
+        response = self.client.get(reverse("rates-api:currency-date", args=["gbp", "2023-01-01"]))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data["detail"], service.NO_DATA)
+        response = self.client.get(reverse("rates-api:last-quotations", args=["non-existent-code", 10]))
+        self.assertEqual(response.status_code, 404)
+        mock_get.assert_not_called()
+
+    @patch("rates_api.nbp.AsyncNBPClient.get", side_effect=AssertionError)
+    @patch("rates_api.nbp.NBPClient.get", side_effect=nbp_missing)
+    def test_malformed_date(self, mock_get, mock_async_get):
+        """
+        Tests that malformed dates, alone or in a batch, are answered locally without calling NBP.
+        """
+
+        response = self.client.get(reverse("rates-api:currency-date", args=["gbp", "2023-13-45"]))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post(reverse("rates-api:batch"), {"items": [{"code": "gbp", "date": "01.02.2023"},
+                                                                           {"code": "gbp", "date": "20230102"}]},
+                                    format="json")
+        for result in response.data["results"]:
+            self.assertEqual(result["error"], {"status": 404, "detail": service.NO_DATA})
+        with self.assertRaises(NotFound):
+            asyncio.run(rates.arate_on_date("a", "gbp", "not-a-date"))
+        mock_get.assert_not_called()
+
+    @patch("rates_api.publication.latest_publication", return_value=date(2023, 6, 30))
+    @patch("rates_api.nbp.NBPClient.get", side_effect=nbp_missing)
+    def test_holiday_is_learnt(self, mock_get, mock_latest):
+        """
+        Tests that a past weekday NBP has no table for is asked for once.
+        """
+
+        url = reverse("rates-api:currency-date", args=["gbp", "2023-05-03"])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(reverse("rates-api:currency-date", args=["eur", "2023-05-03"])).status_code,
+                         404)
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch("rates_api.publication.latest_publication", return_value=date(2023, 5, 3))
+    @patch("rates_api.nbp.NBPClient.get", side_effect=nbp_missing)
+    def test_latest_day_is_not_learnt(self, mock_get, mock_latest):
+        """
+        Tests that the day of the newest expected table is asked for again, as NBP may publish it late.
+        """
+
+        url = reverse("rates-api:currency-date", args=["gbp", "2023-05-03"])
+        self.client.get(url)
+        self.client.get(url)
+        self.assertEqual(mock_get.call_count, 2)
+
+    def test_gaps_between_ingested_tables(self):
+        """
+        Tests that the days between two consecutive tables of one response are known as not published.
+        """
+
+        response = nbp_range("tables/a/2023-05-01/2023-05-05/")
+        response.json.return_value = [table for table in response.json.return_value
+                                      if table["effectiveDate"] != "2023-05-03"]
+        tables.index.add("a", response.json())
+        self.assertTrue(tables.index.calendar.is_missing("a", date(2023, 5, 3)))
+        self.assertFalse(tables.index.calendar.is_missing("a", date(2023, 5, 4)))
+        self.assertFalse(tables.index.calendar.is_missing("a", date(2023, 5, 8)))
+
+    @patch("rates_api.publication.latest_publication", return_value=date(2023, 6, 30))
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_nearest_previous_rate(self, mock_get, mock_latest):
+        """
+        Tests that a weekend date is answered with the rate of the previous Friday in the nearest mode.
+        """
+
+        mock_get.side_effect = lambda path: nbp_range(path) if path.count("/") == 4 else nbp_missing()
+        url = reverse("rates-api:currency-date", args=["gbp", "2023-01-08"])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        response = self.client.get(url, {"nearest": "previous"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"the average GBP exchange rate dated 2023-01-06": 0.6})
+        self.assertEqual(self.client.get(reverse("rates-api:currency-date", args=["gbp", "2023-01-05"]),
+                                         {"nearest": "previous"}).data,
+                         {"the average GBP exchange rate dated 2023-01-05": 0.5})
+
+    @patch("rates_api.publication.latest_publication", return_value=date(2023, 6, 30))
+    @patch("rates_api.nbp.AsyncNBPClient.get", new_callable=AsyncMock)
+    async def test_async_nearest_previous_rate(self, mock_get, mock_latest):
+        """
+        Tests that the async route answers a weekend date with the rate of the previous Friday in the nearest mode.
+        """
+
+        mock_get.side_effect = lambda path: nbp_range(path) if path.count("/") == 4 else nbp_missing()
+        url = reverse("rates-api:async-currency-date", args=["gbp", "2023-01-08"])
+        self.assertEqual((await AsyncClient().get(url)).status_code, 404)
+        response = await AsyncClient().get(url, {"nearest": "previous"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"the average GBP exchange rate dated 2023-01-06": 0.6})
+        mock_get.assert_awaited_with("tables/a/2022-12-25/2023-01-08/")
+        await nbp.close_async_client()
+
+
+class SharedCacheTest(FreshLookups, TestCase):
+    """
+    Test that rate lookups and NBP responses are shared by the workers through Django's cache framework.
+    """
+
+    def test_workers_share_a_file_cache(self):
+        """
+        Tests that what one worker caches is read by another one, and that bumping the version drops it.
+        """
+
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                                                      "LOCATION": directory}}):
+            first = cache.SharedCache("rates", cache.RateCache(max_entries=10, max_bytes=10000))
+            second = cache.SharedCache("rates", cache.RateCache(max_entries=10, max_bytes=10000))
+            rates_data = [{"no": f"{day:03d}/A/NBP/2023", "effectiveDate": f"2023-01-{day:02d}", "mid": day / 7}
+                          for day in range(2, 31)]
+            first.set(("A", "GBP", "last", 29), rates_data, size=100)
+            self.assertEqual(second.get(("A", "GBP", "last", 29)), rates_data)
+            self.assertEqual(len(second), 1)
+            with override_settings(RATES_CACHE={"VERSION": 2}):
+                self.assertIsNone(cache.SharedCache("rates").get(("A", "GBP", "last", 29)))
+
+    def test_workers_share_a_redis_cache(self):
+        """
+        Tests the Redis backend against an in-memory stand-in server.
+        """
+
+        server = fakeredis.FakeServer()
+        with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache",
+                                                   "LOCATION": "redis://stand-in:6379",
+                                                   "OPTIONS": {"connection_class": fakeredis.FakeConnection,
+                                                               "server": server}}}):
+            first = cache.SharedCache("rates", cache.RateCache(max_entries=10, max_bytes=10000))
+            second = cache.SharedCache("rates", cache.RateCache(max_entries=10, max_bytes=10000))
+            first.set(("A", "GBP", "2023-01-02"), {"no": "001/A/NBP/2023", "mid": 5.2768}, size=1)
+            self.assertEqual(second.get(("A", "GBP", "2023-01-02")), {"no": "001/A/NBP/2023", "mid": 5.2768})
+            self.assertEqual(len(fakeredis.FakeStrictRedis(server=server).keys("*rates:*")), 1)
+
+    def test_expired_and_unsafe_keys(self):
+        """
+        Tests that expired entries are not shared and that keys backends reject are hashed.
+        """
+
+        shared = cache.SharedCache("rates")
+        shared.set(("A", "GBP", "last", 1), [{"mid": 1.0}], size=1, expires_at=time.time() - 1)
+        self.assertIsNone(shared.get(("A", "GBP", "last", 1)))
+        key = shared.key(("A", "non existent code", "2023-01-02"))
+        self.assertRegex(key, r"^rates:\d+:\d+:[0-9a-f]{40}$")
+        shared.set(("A", "non existent code", "2023-01-02"), {"mid": 1.0}, size=1)
+        self.assertEqual(shared.get(("A", "non existent code", "2023-01-02")), {"mid": 1.0})
+
+    def test_clear_drops_only_its_entries(self):
+        """
+        Tests that clearing a cache drops its entries for every process and leaves the other keys of the backend.
+        """
+
+        backend = caches["default"]
+        backend.set("other-app:key", "kept")
+        cache.responses.set(("tables/a/2023-01-02/",), [{"no": "001/A/NBP/2023"}], size=0)
+        cache.rates.set(("A", "GBP", "2023-01-02"), {"mid": 5.2768}, size=1)
+        cache.rates.clear()
+        self.assertIsNone(cache.rates.get(("A", "GBP", "2023-01-02")))
+        self.assertIsNone(cache.SharedCache("rates").get(("A", "GBP", "2023-01-02")))
+        self.assertEqual(cache.responses.get(("tables/a/2023-01-02/",)), [{"no": "001/A/NBP/2023"}])
+        self.assertEqual(backend.get("other-app:key"), "kept")
+
+    @patch("rates_api.cache.SharedCache.set", side_effect=AssertionError)
+    @patch("rates_api.cache.SharedCache.get", side_effect=AssertionError)
+    @patch("rates_api.nbp.AsyncNBPClient.get", new_callable=AsyncMock)
+    async def test_async_lookups_leave_the_loop(self, mock_get, mock_cache_get, mock_cache_set):
+        """
+        Tests that the async lookups read and write the shared cache through the async API of the backend, whose
+        calls run off the event loop.
+        """
+
+        mock_get.return_value = nbp_tables({"table": "A", "currency": "funt szterling", "code": "GBP",
+                                            "rates": [{"no": "001/A/NBP/2023", "effectiveDate": "2023-01-02",
+                                                       "mid": 5.2768}]})
+        threads = []
+        original = LocMemCache.get
+
+        def backend_get(backend, *args, **kwargs):
+            threads.append(threading.get_ident())
+            return original(backend, *args, **kwargs)
+
+        with patch.object(LocMemCache, "get", backend_get):
+            self.assertEqual((await rates.arate_on_date("a", "gbp", "2023-01-02"))["mid"], 5.2768)
+            cache.rates.local.clear()
+            self.assertEqual((await rates.arate_on_date("a", "gbp", "2023-01-02"))["mid"], 5.2768)
+        self.assertEqual(mock_get.await_count, 1)
+        self.assertTrue(threads)
+        self.assertNotIn(threading.get_ident(), threads)
+        await nbp.close_async_client()
+
+    def test_large_values_are_compressed(self):
+        """
+        Tests that large values are stored compressed and read back unchanged.
+        """
+
+        tables_data = nbp_range("tables/a/2023-01-02/2023-03-31/").json()
+        payload = cache._encode(tables_data, None)
+        self.assertTrue(payload.startswith(b"z"))
+        self.assertLess(len(payload), len(json.dumps(tables_data)) / 3)
+        self.assertEqual(cache._decode(payload), (None, tables_data))
+
+    @patch("rates_api.nbp.NBPClient.get", side_effect=nbp_range)
+    def test_responses_are_shared(self, mock_get):
+        """
+        Tests that a worker with a cold table index ingests a table another worker fetched without calling NBP.
+        """
+
+        tables.ingest("a", "2023-01-02/2023-01-06/")
+        tables.index.clear()
+        cache.rates.local.clear()
+        tables.ingest("a", "2023-01-02/2023-01-06/")
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(tables.index.rate("a", "gbp", date(2023, 1, 4))["mid"], 0.4)
+
+
+@override_settings(RATES_RANGE={"WINDOW_DAYS": 30, "WORKERS": 3})
+class SyncRatesTest(FreshLookups, TestCase):
+    """
+    Test for the `sync_rates` management command.
+    """
+
+    def sync(self, *args, errors: Optional[io.StringIO] = None) -> str:
+        """
+        Runs the command for table A and returns its output.
+        """
+
+        output = io.StringIO()
+        call_command("sync_rates", "--tables", "a", *args, stdout=output, stderr=errors or io.StringIO())
+        return output.getvalue()
+
+    @patch("rates_api.publication.latest_publication", return_value=date(2023, 3, 31))
+    @patch("rates_api.nbp.NBPClient.get", side_effect=nbp_range)
+    def test_incremental_sync_and_warm(self, mock_get, mock_latest):
+        """
+        Tests that a first sync stores every table since the given date, pre-computes the last/N answers from the
+        store into a shared cache, and that a second sync fetches nothing.
+        """
+
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                                                      "LOCATION": directory}}):
+            output = self.sync("--since", "2023-01-02", "--last", "10,30")
+            self.assertEqual(Rate.objects.filter(table="A").count(), 65)
+            self.assertEqual(sync.synced_through("a"), date(2023, 3, 31))
+            self.assertIn("2 answers pre-computed", output)
+            self.assertEqual([call.args[0] for call in mock_get.call_args_list],
+                             ["tables/a/2023-01-02/2023-01-31/", "tables/a/2023-02-01/2023-03-02/",
+                              "tables/a/2023-03-03/2023-03-31/"])
+            cache.rates.local.clear()
+            self.assertEqual(cache.rates.get(("A", "GBP", "last", 10))[-1]["effectiveDate"], "2023-03-31")
+
+            self.sync("--no-warm")
+            self.assertEqual(mock_get.call_count, 3)
+
+    @patch("rates_api.publication.latest_publication", return_value=date(2023, 1, 31))
+    @patch("rates_api.nbp.NBPClient.get", side_effect=nbp_range)
+    def test_no_warm_in_a_local_cache(self, mock_get, mock_latest):
+        """
+        Tests that with a cache local to the process the store is synced but no answer is pre-computed, with a
+        warning.
+        """
+
+        errors = io.StringIO()
+        output = self.sync("--since", "2023-01-02", errors=errors)
+        self.assertEqual(sync.synced_through("a"), date(2023, 1, 31))
+        self.assertNotIn("pre-computed", output)
+        self.assertIn("local to this process", errors.getvalue())
+        self.assertIsNone(cache.rates.get(("A", "GBP", "last", 10)))
+
+    @patch("rates_api.publication.latest_publication", return_value=date(2023, 3, 31))
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_resume_after_interruption(self, mock_get, mock_latest):
+        """
+        Tests that a sync stopped by an unreachable NBP resumes after the last stored window.
+        """
+
+        mock_get.side_effect = [nbp_range("tables/a/2023-01-02/2023-01-31/"),
+                                service.UpstreamUnavailable()]
+        with self.assertRaises(CommandError):
+            self.sync("--since", "2023-01-02", "--no-warm")
+        self.assertEqual(sync.synced_through("a"), date(2023, 1, 31))
+
+        mock_get.side_effect = nbp_range
+        self.sync("--no-warm")
+        self.assertEqual(mock_get.call_args_list[2].args[0], "tables/a/2023-02-01/2023-03-02/")
+        self.assertEqual(sync.synced_through("a"), date(2023, 3, 31))
+
+    def test_overlapping_runs(self):
+        """
+        Tests that a run started while another one holds the lock does nothing.
+        """
+
+        self.assertTrue(sync.acquire())
+        try:
+            self.assertIn("Another sync is running", self.sync())
+        finally:
+            sync.release()
+
+
+ARCHIVE_A = """data;1USD;100HUF;1EUR;nr tabeli;pełny numer tabeli
+;dolar amerykański;forint (Węgry);euro;;
+20230102;4,3960;1,1716;4,6784;1;001/A/NBP/2023
+20230103;4,4475;1,1715;;2;002/A/NBP/2023
+
+kod ISO;USD;HUF;EUR;;
+nazwa waluty;dolar amerykański;forint (Węgry);euro;;
+liczba jednostek;1;100;1;;
+"""
+
+ARCHIVE_C = """data notowania;data publikacji;1USD;;100JPY;;numer tabeli
+;;kupno;sprzedaż;kupno;sprzedaż;
+20221230;20230102;4,3522;4,4402;3,3167;3,3837;1
+"""
+
+
+class ArchiveImportTest(TestCase):
+    """
+    Test for the `import_archive` management command.
+    """
+
+    def write(self, name: str, content: str) -> str:
+        """
+        Writes an archive file in the NBP encoding and returns its path.
+        """
+
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, name)
+        with open(path, "w", encoding="cp1250") as file:
+            file.write(content)
+        return path
+
+    def test_import_table_a(self):
+        """
+        Tests that rates are stored per unit, that missing quotations are skipped, and that importing a file again
+        changes nothing.
+        """
+
+        path = self.write("archiwum_tab_a_2023.csv", ARCHIVE_A)
+        output = io.StringIO()
+        call_command("import_archive", path, "--batch-size", "2", stdout=output)
+        self.assertIn("Imported 5 rates", output.getvalue())
+        huf = Rate.objects.get(table="A", code="HUF", effective_date=date(2023, 1, 2))
+        self.assertEqual((huf.no, huf.mid), ("001/A/NBP/2023", 0.011716))
+        self.assertFalse(Rate.objects.filter(code="EUR", effective_date=date(2023, 1, 3)).exists())
+
+        Rate.objects.filter(code="USD", effective_date=date(2023, 1, 2)).delete()
+        call_command("import_archive", path, stdout=io.StringIO())
+        self.assertEqual(Rate.objects.count(), 5)
+
+    def test_import_table_c(self):
+        """
+        Tests that table C rates take their bid and ask from the column pair and their date from the publication.
+        """
+
+        call_command("import_archive", self.write("archiwum_tab_c_2023.csv", ARCHIVE_C), stdout=io.StringIO())
+        jpy = Rate.objects.get(table="C", code="JPY")
+        self.assertEqual((jpy.effective_date, jpy.no, jpy.bid, jpy.ask),
+                         (date(2023, 1, 2), "001/C/NBP/2023", 0.033167, 0.033837))
+
+    def test_invalid_file(self):
+        """
+        Tests that a file without an NBP table in its name or without currency columns is rejected.
+        """
+
+        with self.assertRaises(CommandError):
+            call_command("import_archive", self.write("rates.csv", ARCHIVE_A), stdout=io.StringIO())
+        with self.assertRaises(CommandError):
+            call_command("import_archive", self.write("archiwum_tab_a_2023.csv", "data;kurs\n"),
+                         stdout=io.StringIO())
+
+    def test_malformed_rate(self):
+        """
+        Tests that a rate which is not a number is reported with its row and column.
+        """
+
+        path = self.write("archiwum_tab_a_2023.csv", ARCHIVE_A.replace("1,1715", "1,17x5"))
+        with self.assertRaisesRegex(CommandError, "'1,17x5' in row 4, column 3"):
+            call_command("import_archive", path, stdout=io.StringIO())
+
+
+class ConditionalRequestTest(FreshLookups, APITestCase):
+    """
+    Test for the validators and conditional GETs of the rate endpoints.
+    """
+
+    def setUp(self) -> None:
+        """
+        Initializes the client.
+        """
+
+        super().setUp()
+        self.client = APIClient()
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_past_date(self, mock_get):
+        """
+        Tests that the rate of a past date is immutable and revalidated without any lookup.
+        """
+
+        mock_get.return_value = nbp_tables({
+            "table": "A", "currency": "funt szterling", "code": "GBP",
+            "rates": [{"no": "001/A/NBP/2023", "effectiveDate": "2023-01-02", "mid": 5.2768}]})
+        url = reverse("rates-api:currency-date", args=["gbp", "2023-01-02"])
+        response = self.client.get(url)
+        self.assertEqual(response["ETag"], 'W/"A:GBP:2023-01-02:2023-01-02:001/A/NBP/2023"')
+        self.assertEqual(response["Last-Modified"], "Mon, 02 Jan 2023 11:15:00 GMT")
+        self.assertIn("immutable", response["Cache-Control"])
+
+        reset_lookups()
+        for header, value in (("HTTP_IF_NONE_MATCH", response["ETag"]),
+                              ("HTTP_IF_MODIFIED_SINCE", response["Last-Modified"])):
+            not_modified = self.client.get(url, **{header: value})
+            self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"A:EUR:2023-01-02:2023-01-02:1"').status_code, 200)
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_modified_since_before_publication(self, mock_get):
+        """
+        Tests that a copy of a past date older than its table, and a date without a table, are not answered with 304.
+        """
+
+        mock_get.return_value = nbp_tables({
+            "table": "A", "currency": "funt szterling", "code": "GBP",
+            "rates": [{"no": "001/A/NBP/2023", "effectiveDate": "2023-01-02", "mid": 5.2768}]})
+        url = reverse("rates-api:currency-date", args=["gbp", "2023-01-02"])
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE="Thu, 01 Jan 1970 00:00:00 GMT")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"the average GBP exchange rate dated 2023-01-02": 5.2768})
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE="Mon, 02 Jan 2023 11:00:00 GMT").status_code, 200)
+
+        weekend = reverse("rates-api:currency-date", args=["gbp", "2023-01-07"])
+        response = self.client.get(weekend, HTTP_IF_MODIFIED_SINCE="Mon, 09 Jan 2023 12:00:00 GMT")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_last_quotations_until_next_table(self, mock_get):
+        """
+        Tests that a `last/N` answer is cached until the next publication and revalidated without any lookup until
+        then, and that a copy older than the latest table is answered in full.
+        """
+
+        mock_get.return_value = nbp_tables({
+            "table": "A", "currency": "funt szterling", "code": "GBP",
+            "rates": [{"no": "079/A/NBP/2023", "effectiveDate": "2023-04-24", "mid": 5.2176}]})
+        url = reverse("rates-api:last-quotations", args=["gbp", 1])
+        monday = datetime(2023, 4, 24, 13, 0, tzinfo=publication.WARSAW)
+        with patch("rates_api.publication.now", return_value=monday):
+            response = self.client.get(url)
+            self.assertEqual(response["ETag"], 'W/"A:GBP:last/1:2023-04-24:079/A/NBP/2023"')
+            self.assertEqual(response["Cache-Control"], "public, max-age=83700")
+            cache.rates.clear()
+            cache.responses.clear()
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(mock_get.call_count, 1)
+
+        mock_get.return_value = nbp_tables({
+            "table": "A", "currency": "funt szterling", "code": "GBP",
+            "rates": [{"no": "080/A/NBP/2023", "effectiveDate": "2023-04-25", "mid": 5.2034}]})
+        with patch("rates_api.publication.now", return_value=monday + timedelta(days=1)):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["ETag"], 'W/"A:GBP:last/1:2023-04-25:080/A/NBP/2023"')
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    """
+    Test for the circuit breaker around the NBP client.
+    """
+
+    def setUp(self) -> None:
+        """
+        Builds a client whose breaker opens after two failures for 30 seconds.
+        """
+
+        self.breaker = breaker.CircuitBreaker(failures=2, reset_after=30)
+        self.client = nbp.NBPClient(base_url="http://nbp.test/api/exchangerates/", pool_size=4, connect_timeout=1,
+                                    read_timeout=2, retries=0, backoff_factor=0, breaker=self.breaker)
+
+    @patch("rates_api.breaker.time.monotonic", return_value=100)
+    def test_open_and_reset(self, mock_monotonic):
+        """
+        Tests that repeated failures open the breaker so calls fail without going upstream, and that after the reset
+        delay one trial call goes through and closes it again.
+        """
+
+        with patch.object(self.client.session, "get", side_effect=requests.ConnectTimeout()) as mock_get:
+            for _ in range(3):
+                with self.assertRaises(service.UpstreamUnavailable):
+                    self.client.get("tables/a/last/1/")
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertTrue(self.breaker.is_open())
+
+        mock_monotonic.return_value = 131
+        with patch.object(self.client.session, "get", return_value=Mock(status_code=404)) as mock_get:
+            self.client.get("tables/a/last/1/")
+            self.client.get("tables/a/last/1/")
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertFalse(self.breaker.is_open())
+
+    @patch("rates_api.breaker.time.monotonic", return_value=100)
+    def test_failed_trial(self, mock_monotonic):
+        """
+        Tests that a failing trial call opens the breaker again at once.
+        """
+
+        with patch.object(self.client.session, "get", return_value=Mock(status_code=503)):
+            self.client.get("tables/a/last/1/")
+            self.client.get("tables/a/last/1/")
+            mock_monotonic.return_value = 131
+            self.client.get("tables/a/last/1/")
+        self.assertTrue(self.breaker.is_open())
+
+    @patch("rates_api.breaker.time.monotonic", return_value=100)
+    def test_interrupted_trial(self, mock_monotonic):
+        """
+        Tests that a trial call cancelled before it is recorded is given back, so the next call is the trial.
+        """
+
+        for _ in range(2):
+            self.breaker.record_failure()
+        mock_monotonic.return_value = 131
+        with patch.object(self.client.session, "get", side_effect=asyncio.CancelledError()):
+            with self.assertRaises(asyncio.CancelledError):
+                self.client.get("tables/a/last/1/")
+        self.assertFalse(self.breaker.is_open())
+        with patch.object(self.client.session, "get", return_value=Mock(status_code=200)) as mock_get:
+            self.client.get("tables/a/last/1/")
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertTrue(self.breaker.allow())
+
+    @patch("rates_api.breaker.time.monotonic", return_value=100)
+    def test_trial_timeout(self, mock_monotonic):
+        """
+        Tests that a trial call never recorded is given up on after the trial timeout.
+        """
+
+        for _ in range(2):
+            self.breaker.record_failure()
+        mock_monotonic.return_value = 131
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.assertTrue(self.breaker.is_open())
+        mock_monotonic.return_value = 131 + self.breaker.trial_timeout
+        self.assertFalse(self.breaker.is_open())
+        self.assertTrue(self.breaker.allow())
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_error_page_is_unavailable(self, mock_get):
+        """
+        Tests that a non-JSON error answer other than NBP's "no data" is a 503 instead of a 404.
+        """
+
+        mock_get.return_value = Mock(ok=False, status_code=502, content=b"<html>Bad Gateway</html>")
+        mock_get.return_value.json.side_effect = json.JSONDecodeError("Expecting value", "", 0)
+        with self.assertRaises(service.UpstreamUnavailable):
+            tables.ingest("a", "last/1/")
+        mock_get.return_value = nbp_missing()
+        with self.assertRaises(NotFound):
+            tables.ingest("a", "last/1/")
+
+
+class StaleWhileRevalidateTest(FreshLookups, TransactionTestCase):
+    """
+    Test that expired `last/N` answers are served stale while NBP is unreachable.
+    """
+
+    def setUp(self) -> None:
+        """
+        Initializes the client and caches an expired answer.
+        """
+
+        super().setUp()
+        self.client = APIClient()
+        nbp.reset_client()
+        self.latest = publication.latest_publication("a")
+        cache.rates.set(("A", "GBP", "last", 1), [{"no": "001/A/NBP/2023", "effectiveDate": "2023-01-02",
+                                                   "mid": 5.2768}], size=100, expires_at=time.time() - 1)
+        self.url = reverse("rates-api:last-quotations", args=["gbp", 1])
+
+    def tearDown(self) -> None:
+        """
+        Drops the circuit breaker.
+        """
+
+        nbp.reset_client()
+
+    def fresh(self) -> Mock:
+        """
+        Builds the NBP answer with the latest table.
+        """
+
+        return nbp_tables({"table": "A", "currency": "funt szterling", "code": "GBP",
+                           "rates": [{"no": "099/A/NBP/2023", "effectiveDate": self.latest.isoformat(),
+                                      "mid": 5.0}]})
+
+    @patch("rates_api.nbp.NBPClient.get")
+    def test_open_breaker(self, mock_get):
+        """
+        Tests that with the breaker open the stale answer is served at once and refreshed in the background.
+        """
+
+        mock_get.return_value = self.fresh()
+        for _ in range(nbp.get_breaker().failures):
+            nbp.get_breaker().record_failure()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data, {"the average GBP exchange rate for the last 1 quotations":
+                                         {"minimum": 5.2768, "maximum": 5.2768}})
+        self.assertEqual(response["Warning"], '110 - "Response is Stale"')
+        self.assertEqual(response["Cache-Control"], "public, max-age=0")
+
+        rates.revalidations.wait()
+        response = self.client.get(self.url)
+        self.assertNotIn("Warning", response)
+        self.assertEqual(response.data["the average GBP exchange rate for the last 1 quotations"]["minimum"], 5.0)
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch("rates_api.nbp.NBPClient.get", side_effect=service.UpstreamUnavailable())
+    def test_failed_refresh(self, mock_get):
+        """
+        Tests that the stale answer is served when refreshing it fails, and that no answer is a 503.
+        """
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Warning"], '110 - "Response is Stale"')
+        response = self.client.get(reverse("rates-api:last-quotations", args=["gbp", 2]))
+        self.assertEqual(response.status_code, 503)
+
+
+class LimiterTest(SimpleTestCase):
+    """
+    Test for the limits on the calls to NBP.
+    """
+
+    @patch("rates_api.limiter.time.monotonic", return_value=100)
+    def test_token_bucket(self, mock_monotonic):
+        """
+        Tests that a burst is let through at once, that later calls are spaced by the rate, and that a call whose
+        token comes after its deadline takes nothing.
+        """
+
+        bucket = limiter.TokenBucket(rate=2, burst=2)
+        self.assertEqual([bucket.reserve(deadline=110) for _ in range(3)], [0, 0, 0.5])
+        self.assertIsNone(bucket.reserve(deadline=100.5))
+        mock_monotonic.return_value = 101
+        self.assertEqual(bucket.reserve(deadline=101), 0)
+
+    def test_shared_bucket(self):
+        """
+        Tests that workers sharing the cache share one budget, a call over it waiting for the next second.
+        """
+
+        first, second = limiter.SharedBucket(rate=2), limiter.SharedBucket(rate=2)
+        with patch("rates_api.limiter.time.time", return_value=1000.5), \
+                patch("rates_api.limiter.time.monotonic", return_value=50):
+            self.assertEqual([first.reserve(deadline=50.1), second.reserve(deadline=50.1)], [0, 0])
+            self.assertIsNone(first.reserve(deadline=50.1))
+            self.assertEqual(second.reserve(deadline=51), 0.5)
+
+    @patch("rates_api.limiter.SharedBucket.reserve", side_effect=AssertionError)
+    async def test_async_shared_bucket(self, mock_reserve):
+        """
+        Tests that an async limiter takes its calls from the shared budget through the async API of the cache, off
+        the event loop.
+        """
+
+        threads = []
+        original = LocMemCache.add
+
+        def backend_add(backend, *args, **kwargs):
+            threads.append(threading.get_ident())
+            return original(backend, *args, **kwargs)
+
+        limits = limiter.AsyncLimiter(max_in_flight=2, max_queue=2, max_wait=0.1,
+                                      bucket=limiter.SharedBucket(rate=1, prefix="async_calls"))
+        with patch.object(LocMemCache, "add", backend_add):
+            async with limits.slot():
+                pass
+            with self.assertRaises(service.UpstreamUnavailable):
+                async with limits.slot():
+                    pass
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.get_ident(), threads)
+
+    def test_in_flight_and_queue(self):
+        """
+        Tests that a call waits for a free slot up to its deadline, and that a call finding the queue full is
+        rejected at once.
+        """
+
+        limits = limiter.Limiter(max_in_flight=1, max_queue=1, max_wait=0.05,
+                                 bucket=limiter.TokenBucket(rate=100, burst=100))
+        with limits.slot():
+            with self.assertRaises(service.UpstreamUnavailable):
+                with limits.slot():
+                    pass
+            limits.waiting = 1
+            started = time.monotonic()
+            with self.assertRaises(service.UpstreamUnavailable):
+                with limits.slot():
+                    pass
+            self.assertLess(time.monotonic() - started, 0.05)
+        limits.waiting = 0
+        with limits.slot():
+            pass
+
+    def test_client_rejects_over_budget(self):
+        """
+        Tests that a call the budget has no token for before its deadline is rejected without going upstream.
+        """
+
+        client = nbp.NBPClient(base_url="http://nbp.test/api/exchangerates/", pool_size=4, connect_timeout=1,
+                               read_timeout=2, retries=0, backoff_factor=0,
+                               limiter=limiter.Limiter(max_in_flight=4, max_queue=10, max_wait=0.1,
+                                                       bucket=limiter.TokenBucket(rate=1, burst=1)))
+        with patch.object(client.session, "get", return_value=Mock(status_code=200)) as mock_get:
+            client.get("tables/a/last/1/")
+            with self.assertRaises(service.UpstreamUnavailable):
+                client.get("tables/a/last/1/")
+        self.assertEqual(mock_get.call_count, 1)
+
+    @patch("rates_api.breaker.time.monotonic", return_value=100)
+    def test_rejection_leaves_breaker(self, mock_monotonic):
+        """
+        Tests that a call rejected by the limits while the breaker waits for its trial call does not take it.
+        """
+
+        circuit = breaker.CircuitBreaker(failures=1, reset_after=30)
+        limits = limiter.Limiter(max_in_flight=1, max_queue=0, max_wait=0.1,
+                                 bucket=limiter.TokenBucket(rate=100, burst=100))
+        client = nbp.NBPClient(base_url="http://nbp.test/api/exchangerates/", pool_size=4, connect_timeout=1,
+                               read_timeout=2, retries=0, backoff_factor=0, breaker=circuit, limiter=limits)
+        circuit.record_failure()
+        mock_monotonic.return_value = 131
+        with patch.object(client.session, "get", return_value=Mock(status_code=200)) as mock_get:
+            with self.assertRaises(service.UpstreamUnavailable):
+                client.get("tables/a/last/1/")
+            self.assertFalse(circuit.is_open())
+            limits.max_queue = 1
+            client.get("tables/a/last/1/")
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertTrue(circuit.allow())
+
+
+class MetricsTest(FreshLookups, APITestCase):
+    """
+    Test the recorded metrics and their Prometheus export.
+    """
+
+    def setUp(self) -> None:
+        """
+        Empties the metrics and builds a fresh NBP client.
+        """
+
+        super().setUp()
+        self.client = APIClient()
+        metrics.clear()
+        nbp.reset_client()
+        self.addCleanup(nbp.reset_client)
+
+    def test_histogram_export(self):
+        """
+        Tests that observations land in cumulative buckets with their sum and count.
+        """
+
+        histogram = metrics.Histogram("test_seconds", "A test histogram.", ("kind",), buckets=(0.1, 1))
+        metrics.REGISTRY.remove(histogram)
+        histogram.observe(0.05, "a")
+        histogram.observe(0.5, "a")
+        histogram.observe(5, "a")
+        self.assertEqual(list(histogram.samples()), [
+            'test_seconds_bucket{kind="a",le="0.1"} 1',
+            'test_seconds_bucket{kind="a",le="1"} 2',
+            'test_seconds_bucket{kind="a",le="+Inf"} 3',
+            'test_seconds_sum{kind="a"} 5.55',
+            'test_seconds_count{kind="a"} 3',
+        ])
+
+    def test_workers_are_summed(self):
+        """
+        Tests that with a metrics directory every worker exports the metrics of all of them, and that the counts of
+        an exited worker are kept.
+        """
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(RATES_METRICS={"DIRECTORY": directory}), \
+                patch("rates_api.metrics._start_flushing"):
+            metrics.errors.inc("rates-api:batch", "NotFound", amount=2)
+            metrics.requests.observe(0.05, "rates-api:batch", "POST", "200")
+            metrics.flush()
+            os.rename(os.path.join(directory, f"worker-{os.getpid()}.json"), os.path.join(directory, "worker-1.json"))
+            metrics.clear()
+            metrics.errors.inc("rates-api:batch", "NotFound")
+            exported = self.client.get("/metrics").content.decode()
+            self.assertIn('rates_errors_total{view="rates-api:batch",type="NotFound"} 3', exported)
+            self.assertIn('rates_request_duration_seconds_count{view="rates-api:batch",method="POST",status="200"} 1',
+                          exported)
+            metrics.fold(1)
+            self.assertEqual(os.listdir(directory), ["exited.json"])
+            self.assertEqual(self.client.get("/metrics").content.decode().count(
+                'rates_errors_total{view="rates-api:batch",type="NotFound"} 3'), 1)
+            metrics.clear_directory()
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_endpoint_labels(self):
+        """
+        Tests that NBP paths are labelled by kind of query rather than by date.
+        """
+
+        self.assertEqual(metrics.endpoint_of("tables/a/2023-01-02/"), ("tables/date", "a"))
+        self.assertEqual(metrics.endpoint_of("tables/c/last/10/"), ("tables/last", "c"))
+        self.assertEqual(metrics.endpoint_of("tables/a/2023-01-02/2023-03-31/"), ("tables/range", "a"))
+        self.assertEqual(metrics.endpoint_of("rates/a/gbp/2023-01-02/"), ("rates/date", "a"))
+
+    def test_request_is_recorded(self):
+        """
+        Tests that a lookup records its NBP call, the decoding of the answer, the view time and the cache lookups.
+        """
+
+        upstream = nbp_tables({
+            "table": "A", "currency": "funt szterling", "code": "GBP",
+            "rates": [{"no": "001/A/NBP/2023", "effectiveDate": "2023-01-02", "mid": 5.2768}]})
+        upstream.status_code = 200
+        url = reverse("rates-api:currency-date", args=["gbp", "2023-01-02"])
+        with patch("requests.Session.get", return_value=upstream):
+            self.client.get(url)
+            self.client.get(url)
+        self.assertEqual(metrics.upstream.count("tables/date", "a", "200"), 1)
+        self.assertEqual(metrics.decode.count("tables/date", "a"), 1)
+        self.assertEqual(metrics.requests.count("rates-api:currency-date", "GET", "200"), 2)
+        self.assertEqual(metrics.compute.count("rates-api:currency-date"), 2)
+        self.assertEqual(metrics.cache_lookups.value("rates", "local"), 1)
+        response = self.client.get("/metrics")
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+        self.assertIn('rates_nbp_request_duration_seconds_count{endpoint="tables/date",table="a",status="200"} 1',
+                      response.content.decode())
+
+    def test_errors_are_counted_by_type(self):
+        """
+        Tests that failed requests are counted by view and exception type.
+        """
+
+        with patch("requests.Session.get", side_effect=requests.ConnectionError()):
+            response = self.client.get(reverse("rates-api:currency-date", args=["gbp", "2023-01-02"]))
+        self.assertEqual(response.status_code, 503)
+        self.client.get(reverse("rates-api:last-quotations", args=["gbp", 0]))
+        self.assertEqual(metrics.errors.value("rates-api:currency-date", "UpstreamUnavailable"), 1)
+        self.assertEqual(metrics.errors.value("rates-api:last-quotations", "ValidationError"), 1)
+        self.assertEqual(metrics.upstream.count("tables/date", "a", "error"), 1)
+
+
+@override_settings(RATES_PROFILER={"TOKEN": "secret", "INTERVAL": 0.001})
+class ProfilerTest(FreshLookups, APITestCase):
+    """
+    Test the profiling of flagged requests and the export of their profiles.
+    """
+
+    def setUp(self) -> None:
+        """
+        Empties the profiles and mocks a slow NBP answer.
+        """
+
+        super().setUp()
+        self.client = APIClient()
+        profiler.calls.clear()
+        profiler.get_sampler().clear()
+        nbp.reset_client()
+        self.addCleanup(nbp.reset_client)
+        upstream = nbp_tables({
+            "table": "A", "currency": "funt szterling", "code": "GBP",
+            "rates": [{"no": "001/A/NBP/2023", "effectiveDate": "2023-01-02", "mid": 5.2768}]})
+        upstream.status_code = 200
+
+        def slow_get(*args, **kwargs):
+            time.sleep(0.05)
+            return upstream
+
+        patcher = patch("requests.Session.get", side_effect=slow_get)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.url = reverse("rates-api:currency-date", args=["gbp", "2023-01-02"])
+
+    def test_flagged_request_stacks(self):
+        """
+        Tests that the stacks of a flagged request are sampled and exported as collapsed stacks of its view.
+        """
+
+        self.client.get(self.url, HTTP_X_PROFILE="secret")
+        response = self.client.get("/profiles", HTTP_X_PROFILE="secret")
+        lines = response.content.decode().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.startswith("rates-api:currency-date;") for line in lines))
+        self.assertTrue(any("rates_api.tables:_ingest" in line for line in lines))
+
+    def test_unflagged_request_is_not_profiled(self):
+        """
+        Tests that requests without the token are neither profiled nor allowed to read the profiles.
+        """
+
+        with patch("rates_api.profiler.hmac.compare_digest", wraps=hmac.compare_digest) as compared:
+            self.client.get(self.url, HTTP_X_PROFILE="wrong")
+            self.assertEqual(profiler.get_sampler().views, {})
+            self.assertEqual(self.client.get("/profiles").status_code, 404)
+            self.assertEqual(self.client.get("/profiles", HTTP_X_PROFILE="secreT").status_code, 404)
+        compared.assert_any_call(b"wrong", b"secret")
+        compared.assert_any_call(b"secreT", b"secret")
+
+    @override_settings(RATES_PROFILER={"TOKEN": "secret", "MODE": "pstats"})
+    def test_pstats_export(self):
+        """
+        Tests that traced requests are exported as pstats data, and emptied on reset.
+        """
+
+        self.client.get(self.url, HTTP_X_PROFILE="secret")
+        response = self.client.get("/profiles", {"format": "pstats", "reset": 1}, HTTP_X_PROFILE="secret")
+        functions = {name for _, _, name in marshal.loads(response.content)}
+        self.assertIn("_ingest", functions)
+        self.assertEqual(profiler.calls.views, {})
+
+
+class SchemaTest(SimpleTestCase):
+    """
+    Test the precomputed OpenAPI schema, its validation and the command writing it.
+    """
+
+    def setUp(self) -> None:
+        """
+        Points the schema file to a temporary directory and drops the schema of the process.
+        """
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "openapi.json")
+        settings = override_settings(RATES_SCHEMA=self.path)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        schema.reset()
+        self.addCleanup(schema.reset)
+
+    def test_generated_schema_is_valid(self):
+        """
+        Tests that the generated schema passes validation, with unique operationIds.
+        """
+
+        document = json.loads(schema.generate())
+        schema.validate(document)
+        self.assertIn("/exchanges/{code}/{number}/", document["paths"])
+
+    def test_validate_reports_problems(self):
+        """
+        Tests that undeclared path parameters, duplicate operationIds and dangling references are reported.
+        """
+
+        document = {"swagger": "2.0", "info": {"title": "API", "version": "1"}, "paths": {
+            "/a/{code}/": {"get": {"operationId": "read", "responses": {"200": {"$ref": "#/responses/Missing"}}}},
+            "/b/": {"get": {"operationId": "read", "responses": {"200": {"description": ""}}}}}}
+        with self.assertRaises(SwaggerValidationError) as raised:
+            schema.validate(document)
+        message = str(raised.exception)
+        self.assertIn("path parameter code is not declared", message)
+        self.assertIn("duplicate operationId read", message)
+        self.assertIn("$ref #/responses/Missing does not resolve", message)
+
+    def test_served_compressed_and_revalidated(self):
+        """
+        Tests that the schema is served gzipped to clients accepting it and answered 304 when unchanged.
+        """
+
+        client = Client()
+        plain = client.get("/api/swagger/", {"format": "openapi"})
+        compressed = client.get(reverse("openapi-schema"), HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertEqual(compressed["ETag"], plain["ETag"])
+        response = client.get(reverse("openapi-schema"), HTTP_IF_NONE_MATCH=plain["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_write_schema_command(self):
+        """
+        Tests that the command writes the schema the workers then serve, and that `--check` spots a stale file.
+        """
+
+        with self.assertRaises(CommandError):
+            call_command("write_schema", check=True, stdout=io.StringIO())
+        call_command("write_schema", stdout=io.StringIO())
+        call_command("write_schema", check=True, stdout=io.StringIO())
+        with open(self.path, "wb") as file:
+            file.write(b'{"swagger": "2.0"}')
+        self.assertEqual(schema.get_document().content, b'{"swagger": "2.0"}')
+        with self.assertRaises(CommandError):
+            call_command("write_schema", check=True, stdout=io.StringIO())
@@ -4,13 +4,43 @@ URL configuration for rates_api app.
 
 from django.urls import path
 
-from . import views
+from . import async_views, views
 
 app_name = "rates-api"
 urlpatterns = [
+    path("async/difference/<str:code>/<int:number>/",
+         async_views.AsyncDifferenceRateLastQuotations.as_view(),
+         name="async-difference-rate"),
+    path("async/<str:code>/<int:number>/",
+         async_views.AsyncAverageRateLastQuotations.as_view(),
+         name="async-last-quotations"),
+    path("async/<str:code>/<str:date>/",
+         async_views.AsyncAverageRateCurrencyDate.as_view(),
+         name="async-currency-date"),
+    path("batch/",
+         views.BatchRates.as_view(),
+         name="batch"),
+    path("convert/",
+         views.ConvertAmounts.as_view(),
+         name="convert"),
     path("difference/<str:code>/<int:number>/",
          views.DifferenceRateLastQuotations.as_view(),
          name="difference-rate"),
+    path("difference/<str:code>/<str:start>/<str:end>/",
+         views.DateRangeDifference.as_view(),
+         name="date-range-difference"),
+    path("extremes/<str:code>/<str:start>/<str:end>/",
+         views.DateRangeExtremes.as_view(),
+         name="date-range-extremes"),
+    path("statistics/<str:code>/<int:number>/",
+         views.LastQuotationsStatistics.as_view(),
+         name="last-quotations-statistics"),
+    path("statistics/<str:code>/<str:start>/<str:end>/",
+         views.DateRangeStatistics.as_view(),
+         name="date-range-statistics"),
+    path("<str:code>/<str:start>/<str:end>/",
+         views.AverageRateDateRange.as_view(),
+         name="date-range"),
     path("<str:code>/<int:number>/",
          views.AverageRateLastQuotations.as_view(),
          name="last-quotations"),
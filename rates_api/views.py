@@ -1,15 +1,20 @@
 """
 Django views for the currency exchange rates application.
-These views use the requests library to interact with the NBP API to retrieve exchange rate data.
+These views retrieve exchange rate data through the lookups in `rates`, which answer from the cache and the local
+rate store and fall back to the NBP API.
 """
 
-import requests
-from requests import JSONDecodeError
-
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import AllowAny
+from rest_framework.settings import api_settings
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from . import service
+from . import batch, conditional, convert, rates, service, stats
+from .renderers import TABLE_FIELDS, CSVRenderer, NDJSONRenderer
+from .summaries import (currency_date_data, date_range_data, difference_rate_data, last_quotations_data,
+                        range_difference_data, range_extremes_data, statistics_data)
 
 
 class AverageRateCurrencyDate(APIView):
@@ -23,7 +28,8 @@ class AverageRateCurrencyDate(APIView):
         Parameters:
         -----------
         request : HttpRequest
-            The request object.
+            The request object. With `?nearest=previous` in its query, a date NBP published no table on (a weekend
+            or a holiday) is answered with the rate of the nearest previous publication day.
         code : str
             The currency code to retrieve the exchange rate for.
         date : str
@@ -31,21 +37,23 @@ class AverageRateCurrencyDate(APIView):
         Returns:
         --------
         Response
-            A JSON response containing the average exchange rate for the specified currency and date.
+            A JSON response containing the average exchange rate for the specified currency and date, keyed by the
+            date of the rate, with validators of its NBP table; or a 304 response when the client's copy is current.
         Raises:
         -------
-        JSONDecodeError
-            If the response from the API cannot be decoded to JSON.
+            NotFound: If NBP has no rate for the given currency and date.
         """
 
-        url = f"http://api.nbp.pl/api/exchangerates/rates/a/{code}/{date}/?format=json"
-        response = requests.get(url)
-        try:
-            average_rate = response.json()["rates"][0]["mid"]
-            data = {f"the average {code.upper()} exchange rate dated {date}": average_rate}
-            return Response(data)
-        except JSONDecodeError:
-            service.not_found_raise(response)
+        nearest = request.query_params.get("nearest") == "previous"
+        conditional_get = conditional.for_date(request, "a", code, date, nearest)
+        unchanged = conditional_get.unchanged()
+        if unchanged is not None:
+            return unchanged
+        if nearest:
+            rate = rates.previous_rate("a", code, date)
+            return conditional_get.respond(Response(currency_date_data(code, rate["effectiveDate"], rate)), rate)
+        rate = rates.rate_on_date("a", code, date)
+        return conditional_get.respond(Response(currency_date_data(code, date, rate)), rate)
 
 
 class AverageRateLastQuotations(APIView):
@@ -70,34 +78,24 @@ class AverageRateLastQuotations(APIView):
         --------
         Response
             A JSON response containing the calculated average exchange rate, minimum, and maximum for the given
-            currency code and number of quotations.
+            currency code and number of quotations, with validators of the newest NBP table and a `Warning` when it
+            is served stale during an NBP outage; or a 304 response when the client's copy is current.
         Raises:
         --------
             NotFound: If the requested data was not found in the response.
             BadRequest: If the request parameters are invalid.
         """
 
-        url = f"http://api.nbp.pl/api/exchangerates/rates/a/{code}/last/{number}/?format=json"
-        response = requests.get(url)
         if 1 <= number <= 255:
-            average_rates = []
-            try:
-                average_rates_data = response.json()["rates"]
-                for average_rate_data in average_rates_data:
-                    average_rate = average_rate_data["mid"]
-                    average_rates.append(average_rate)
-                min_average_rate = min(average_rates)
-                max_average_rate = max(average_rates)
-                data = {
-                    f"the average {code.upper()} exchange rate for the last {number} quotations":
-                        {"minimum": min_average_rate,
-                         "maximum": max_average_rate}
-                }
-                return Response(data)
-            except JSONDecodeError:
-                service.not_found_raise(response)
+            conditional_get = conditional.for_last(request, "a", code, number)
+            unchanged = conditional_get.unchanged()
+            if unchanged is not None:
+                return unchanged
+            quotations = rates.last_rates("a", code, number)
+            response = Response(last_quotations_data(code, number, rates.extremes_of("a", code, quotations)))
+            return conditional_get.respond(response, quotations[-1], stale=isinstance(quotations, rates.Stale))
         else:
-            service.bad_request_raise(number, response)
+            service.bad_request_raise(number)
 
 
 class DifferenceRateLastQuotations(APIView):
@@ -121,30 +119,261 @@ class DifferenceRateLastQuotations(APIView):
         --------
         Response
             A Response object that contains the biggest difference between the bid and ask rates for a given currency code over a specified
-            number of quotations.
+            number of quotations, with validators of the newest NBP table and a `Warning` when it is served stale
+            during an NBP outage; or a 304 response when the client's copy is current.
         Raises:
         --------
             NotFound: If the requested data was not found in the response.
             BadRequest: If the request parameters are invalid.
         """
 
-        url = f"http://api.nbp.pl/api/exchangerates/rates/c/{code}/last/{number}/?format=json"
-        response = requests.get(url)
         if 1 <= number <= 255:
-            max_difference_rate = 0
-            try:
-                rates_data = response.json()["rates"]
-                for rate_data in rates_data:
-                    bid_rate = rate_data["bid"]
-                    ask_rate = rate_data["ask"]
-                    difference_rate = round(ask_rate - bid_rate, 4)
-                    if difference_rate > max_difference_rate:
-                        max_difference_rate = difference_rate
-                data = {
-                    f"the biggest {code.upper()} exchange rate difference for the last {number} quotations":
-                        max_difference_rate}
-                return Response(data)
-            except JSONDecodeError:
-                service.not_found_raise(response)
+            conditional_get = conditional.for_last(request, "c", code, number)
+            unchanged = conditional_get.unchanged()
+            if unchanged is not None:
+                return unchanged
+            quotations = rates.last_rates("c", code, number)
+            response = Response(difference_rate_data(code, number, rates.extremes_of("c", code, quotations)[1]))
+            return conditional_get.respond(response, quotations[-1], stale=isinstance(quotations, rates.Stale))
         else:
-            service.bad_request_raise(number, response)
+            service.bad_request_raise(number)
+
+
+class AverageRateDateRange(APIView):
+    """
+    A class-based view to retrieve the average exchange rates of a currency over a date range of any length.
+    With `?format=csv` or `?format=ndjson` the series is streamed window by window as it is fetched.
+    """
+
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, CSVRenderer, NDJSONRenderer]
+
+    def get(self, request, code: str, start: str, end: str) -> Response:
+        """
+        Retrieve the average exchange rates for a given currency code between two dates.
+        Parameters:
+        -----------
+        request : HttpRequest
+            The request object.
+        code : str
+            The currency code to retrieve the exchange rates for.
+        start : str
+            The first date of the range in the format yyyy-mm-dd.
+        end : str
+            The last date of the range in the format yyyy-mm-dd.
+        Returns:
+        --------
+        Response
+            A JSON response containing the rates published in the range, in ascending date order, or a streamed
+            CSV or NDJSON export of them (empty when NBP has no rates for the currency in the range).
+        Raises:
+        --------
+            BadRequest: If the range is malformed.
+            NotFound: If NBP has no rates for the currency in the range.
+        """
+
+        renderer = request.accepted_renderer
+        if isinstance(renderer, (CSVRenderer, NDJSONRenderer)):
+            first, last = rates.parse_range(start, end)
+            chunks = rates.iter_rates_between("a", code, first, last)
+            if isinstance(renderer, CSVRenderer):
+                stream = renderer.stream(chunks, TABLE_FIELDS["A"])
+            else:
+                stream = renderer.stream(chunks)
+            return StreamingHttpResponse(stream, content_type=f"{renderer.media_type}; charset={renderer.charset}")
+        return Response(date_range_data(code, start, end, rates.rates_between("a", code, start, end)))
+
+
+class DateRangeExtremes(APIView):
+    """
+    A view that retrieves the minimum and maximum average exchange rate of a currency over a date range of any
+    length, answered by the range index of the ingested series.
+    """
+
+    def get(self, request, code: str, start: str, end: str) -> Response:
+        """
+        Retrieves the minimum and maximum average exchange rate for a given currency code between two dates.
+        Parameters:
+        -----------
+        request : HttpRequest
+            The request object.
+        code : str
+            The currency code to retrieve the exchange rates for.
+        start : str
+            The first date of the range in the format yyyy-mm-dd.
+        end : str
+            The last date of the range in the format yyyy-mm-dd.
+        Returns:
+        --------
+        Response
+            A JSON response containing the minimum and maximum average exchange rate in the range.
+        Raises:
+        --------
+            BadRequest: If the range is malformed.
+            NotFound: If NBP has no rates for the currency in the range.
+        """
+
+        return Response(range_extremes_data(code, start, end, rates.extremes_between("a", code, start, end)))
+
+
+class DateRangeDifference(APIView):
+    """
+    A view that retrieves the biggest difference between the bid and ask rates of a currency over a date range of
+    any length, answered by the range index of the ingested series.
+    """
+
+    def get(self, request, code: str, start: str, end: str) -> Response:
+        """
+        Retrieves the biggest difference between the bid and ask rates for a given currency code between two dates.
+        Parameters:
+        -----------
+        request : HttpRequest
+            The request object.
+        code : str
+            The currency code to retrieve the exchange rates for.
+        start : str
+            The first date of the range in the format yyyy-mm-dd.
+        end : str
+            The last date of the range in the format yyyy-mm-dd.
+        Returns:
+        --------
+        Response
+            A JSON response containing the biggest difference between the bid and ask rates in the range.
+        Raises:
+        --------
+            BadRequest: If the range is malformed.
+            NotFound: If NBP has no rates for the currency in the range.
+        """
+
+        return Response(range_difference_data(code, start, end, rates.extremes_between("c", code, start, end)[1]))
+
+
+class LastQuotationsStatistics(APIView):
+    """
+    A view that computes statistics of the average exchange rates of a currency over its last N quotations.
+    """
+
+    def get(self, request, code: str, number: int) -> Response:
+        """
+        Computes the selected statistics of the last N average exchange rates of a currency.
+        Parameters:
+        -----------
+        request : HttpRequest
+            The request object, optionally with `metrics` (comma-separated, see `stats.QUERY_METRICS`), `percentiles`
+            (comma-separated, 0 to 100) and `window` (the number of quotations of the rolling metrics) in its query.
+        code : str
+            The currency code to compute the statistics for.
+        number: int
+            The number of quotations to retrieve.
+        Returns:
+        --------
+        Response
+            A JSON response containing the number of quotations and the value of each selected metric.
+        Raises:
+        --------
+            NotFound: If the requested data was not found in the response.
+            BadRequest: If the request parameters are invalid.
+        """
+
+        if not 1 <= number <= 255:
+            service.bad_request_raise(number)
+        metrics, percentiles, window = stats.parse_options(request.query_params, number)
+        return Response(statistics_data(code, f"the last {number} quotations", rates.last_rates("a", code, number),
+                                        metrics, percentiles, window))
+
+
+class DateRangeStatistics(APIView):
+    """
+    A view that computes statistics of the average exchange rates of a currency over a date range of any length.
+    """
+
+    def get(self, request, code: str, start: str, end: str) -> Response:
+        """
+        Computes the selected statistics of the average exchange rates of a currency between two dates.
+        Parameters:
+        -----------
+        request : HttpRequest
+            The request object, with the query parameters of `LastQuotationsStatistics`.
+        code : str
+            The currency code to compute the statistics for.
+        start : str
+            The first date of the range in the format yyyy-mm-dd.
+        end : str
+            The last date of the range in the format yyyy-mm-dd.
+        Returns:
+        --------
+        Response
+            A JSON response containing the number of quotations in the range and the value of each selected metric.
+        Raises:
+        --------
+            BadRequest: If the range or the query parameters are malformed.
+            NotFound: If NBP has no rates for the currency in the range.
+        """
+
+        rates_data = rates.rates_between("a", code, start, end)
+        metrics, percentiles, window = stats.parse_options(request.query_params, len(rates_data))
+        return Response(statistics_data(code, f"{start} to {end}", rates_data, metrics, percentiles, window))
+
+
+class BatchRates(APIView):
+    """
+    A view that answers many rate lookups in one request.
+    """
+
+    permission_classes = [AllowAny]
+
+    def post(self, request) -> Response:
+        """
+        Resolves a batch of lookups, deduplicating identical items and fetching the tables they need concurrently.
+        Parameters:
+        -----------
+        request : HttpRequest
+            The request object, with a JSON body `{"items": [...]}` where each item is `{"code": "gbp",
+            "date": "2023-01-02"}`, `{"code": "gbp", "number": 10}` or `{"code": "gbp", "number": 10,
+            "difference": true}`.
+        Returns:
+        --------
+        Response
+            A JSON response `{"results": [...]}` with, for each item in order, the body its single endpoint would
+            return under `result`, or its `error`.
+        Raises:
+        --------
+            ValidationError: If the body is not a list of items or has too many of them.
+        """
+
+        items = request.data.get("items") if isinstance(request.data, dict) else None
+        if not isinstance(items, list):
+            raise ValidationError({"detail": "400 BadRequest - The body must be an object with a list of `items`"})
+        max_items = batch.options()["MAX_ITEMS"]
+        if len(items) > max_items:
+            raise ValidationError({"detail": f"400 BadRequest - A batch cannot have more than {max_items} items"})
+        return Response({"results": batch.run(items)})
+
+
+class ConvertAmounts(APIView):
+    """
+    A view that converts many amounts of one currency into several others, on a date or over a date range.
+    """
+
+    permission_classes = [AllowAny]
+
+    def post(self, request) -> Response:
+        """
+        Converts amounts at the cross rates of the base and target currencies, computed through their table A rates.
+        Parameters:
+        -----------
+        request : HttpRequest
+            The request object, with a JSON body `{"base": "usd", "targets": ["eur", "pln"], "amounts": [1, 250.5],
+            "date": "2023-01-02"}`, or with a `start` and an `end` instead of the `date`.
+        Returns:
+        --------
+        Response
+            A JSON response `{"base": ..., "conversions": [...]}` with, for each date quoting every currency in
+            ascending order, its `effectiveDate`, the cross rate of each target under `rates` and the converted
+            amounts under `amounts`.
+        Raises:
+        --------
+            ValidationError: If the body is malformed or asks for too many values.
+            NotFound: If NBP has no rates of the currencies for the dates.
+        """
+
+        return Response(convert.convert(*convert.parse(request.data)))